@@ -0,0 +1,44 @@
+from io import BytesIO
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfgen import canvas
+
+from app.precompiled import A4_HEIGHT_IN_PTS
+
+
+class NotifyCanvas(canvas.Canvas):
+    def __init__(self, colour):
+        self.packet = BytesIO()
+        super().__init__(self.packet, pagesize=A4)
+
+        self.setStrokeColor(colour)
+        self.setFillColor(colour)
+
+    def get_bytes(self):
+        self.save()
+        self.packet.seek(0)
+        return self.packet
+
+    def rect(self, pt1, pt2):
+        """
+        Draw a rectangle given two points that are two of the corners for it.
+
+        pt1 and pt2 are two-tuples of two values in mm! (As in, you haven't already done "MY_VAL * mm")
+        all values are from TOP LEFT of the page
+
+        This function handles:
+        * conversion from mm to points
+        * conversion to bottom left coordinates
+        * just give two x coords and two y coords and it'll figure out which is left vs right side of the rectangle
+        """
+        left_x = min(pt1[0], pt2[0]) * mm
+        right_x = max(pt1[0], pt2[0]) * mm
+        top_y = min(pt1[1], pt2[1]) * mm
+        bottom_y = max(pt1[1], pt2[1]) * mm
+
+        bottom_y_from_bottom = A4_HEIGHT_IN_PTS - bottom_y
+
+        width = right_x - left_x
+        height = bottom_y - top_y
+        super().rect(left_x, bottom_y_from_bottom, width, height, fill=True, stroke=False)
@@ -1,4 +1,3 @@
-import base64
 import urllib.parse
 from io import BytesIO
 from typing import Literal
@@ -11,11 +10,12 @@ from flask import current_app
 from notifications_utils import LETTER_MAX_PAGE_COUNT
 from notifications_utils.s3 import s3download, s3upload
 from notifications_utils.template import LetterPrintTemplate
-from weasyprint import HTML
+from weasyprint import CSS, HTML
 
 from app import notify_celery
+from app.cmyk_rendering import CMYKURLFetcher, default_colour_css, device_cmyk_html
 from app.config import QueueNames, TaskNames
-from app.precompiled import sanitise_file_contents
+from app.precompiled import sanitise_letter
 from app.preview import get_page_count_for_pdf
 from app.templated import generate_templated_pdf
 from app.utils import PDFPurpose, get_datetime_from_json, get_transient_letter_file_location
@@ -30,22 +30,20 @@ def sanitise_and_upload_letter(self: Task, notification_id, filename, allow_inte
 
     try:
         pdf_content = s3download(current_app.config["LETTERS_SCAN_BUCKET_NAME"], filename).read()
-        sanitisation_details = sanitise_file_contents(
+        sanitisation_details = sanitise_letter(
             pdf_content,
             allow_international_letters=allow_international_letters,
             filename=filename,
         )
 
-        # Only files that have failed sanitisation have 'message' in the sanitisation_details dict
-        if sanitisation_details.get("message"):
+        # Only files that have failed sanitisation have a message
+        if sanitisation_details.message:
             validation_status = "failed"
         else:
             validation_status = "passed"
-            file_data = base64.b64decode(sanitisation_details["file"].encode())
-
             # If the file already exists in S3, it will be overwritten
             s3upload(
-                filedata=file_data,
+                filedata=sanitisation_details.file,
                 region=current_app.config["AWS_REGION"],
                 bucket_name=current_app.config["SANITISED_LETTER_BUCKET_NAME"],
                 file_location=filename,
@@ -75,13 +73,13 @@ def sanitise_and_upload_letter(self: Task, notification_id, filename, allow_inte
         return
 
     sanitise_data = {
-        "page_count": sanitisation_details["page_count"],
-        "message": sanitisation_details["message"],
-        "invalid_pages": sanitisation_details["invalid_pages"],
+        "page_count": sanitisation_details.page_count,
+        "message": sanitisation_details.message,
+        "invalid_pages": sanitisation_details.invalid_pages,
         "validation_status": validation_status,
         "filename": filename,
         "notification_id": notification_id,
-        "address": sanitisation_details["recipient_address"],
+        "address": sanitisation_details.recipient_address,
     }
     signed_data = current_app.signing_client.encode(sanitise_data)
 
@@ -136,11 +134,17 @@ def _create_pdf_for_letter(
         includes_first_page=includes_first_page,
         date=get_datetime_from_json(letter_details),
     )
-    html = HTML(string=str(template))
+    if current_app.config["WEASYPRINT_CMYK_RENDERING"]:
+        # draw everything in DeviceCMYK to begin with, so that we usually don't need to convert the PDF afterwards
+        html = HTML(string=device_cmyk_html(str(template)), url_fetcher=CMYKURLFetcher())
+        stylesheets = [CSS(string=default_colour_css())]
+    else:
+        html = HTML(string=str(template))
+        stylesheets = None
 
     try:
         with sentry_sdk.start_span(op="function", description=f"weasyprint.HTML.write_pdf[{language}]"):
-            pdf = BytesIO(html.write_pdf())
+            pdf = BytesIO(html.write_pdf(stylesheets=stylesheets))
     except WeasyprintError as exc:
         task.retry(exc=exc, queue=QueueNames.SANITISE_LETTERS)
 
@@ -259,26 +263,24 @@ def recreate_pdf_for_precompiled_letter(notification_id, file_location, allow_in
             f"{notification_id}.pdf",
         ).read()
 
-        sanitisation_details = sanitise_file_contents(
+        sanitisation_details = sanitise_letter(
             pdf_content,
             allow_international_letters=allow_international_letters,
             filename=file_location,
         )
 
-        # Only files that have failed sanitisation have 'message' in the sanitisation_details dict
-        if sanitisation_details.get("message"):
+        # Only files that have failed sanitisation have a message
+        if sanitisation_details.message:
             # The file previously passed sanitisation, so we need to manually investigate why it's now failing
             current_app.logger.error(
                 "Notification failed resanitisation: %s", notification_id, extra={"notification_id": notification_id}
             )
             return
 
-        file_data = base64.b64decode(sanitisation_details["file"].encode())
-
         # Upload the sanitised back-up file to S3, where it will overwrite the existing letter
         # in the final letters-pdf bucket.
         s3upload(
-            filedata=file_data,
+            filedata=sanitisation_details.file,
             region=current_app.config["AWS_REGION"],
             bucket_name=current_app.config["LETTERS_PDF_BUCKET_NAME"],
             file_location=file_location,
@@ -311,30 +313,29 @@ def recreate_pdf_for_template_letter_attachments(service_id, attachment_id, orig
             f"{attachment_id}.pdf",
         ).read()
 
-        sanitisation_details = sanitise_file_contents(
+        sanitisation_details = sanitise_letter(
             pdf_content,
             allow_international_letters=False,  # Letter attachments cannot contain addresses so this is always False
             filename=attachment_id,
             is_an_attachment=True,
         )
 
-        # Only files that have failed sanitisation have 'message' in the sanitisation_details dict
-        if sanitisation_details.get("message"):
+        # Only files that have failed sanitisation have a message
+        if sanitisation_details.message:
             # The file previously passed sanitisation, so we need to manually investigate why it's now failing
             current_app.logger.error(
                 "Attachment failed resanitisation id: %s", attachment_id, extra={"attachment_id": attachment_id}
             )
             return
 
-        file_data = base64.b64decode(sanitisation_details["file"].encode())
-        attachment_page_count = sanitisation_details["page_count"]
+        attachment_page_count = sanitisation_details.page_count
 
         metadata = {
             "page_count": str(attachment_page_count),
             "filename": urllib.parse.quote(original_filename),
         }
         s3upload(
-            filedata=file_data,
+            filedata=sanitisation_details.file,
             region=current_app.config["AWS_REGION"],
             bucket_name=current_app.config["LETTER_ATTACHMENT_BUCKET_NAME"],
             file_location=get_transient_letter_file_location(service_id, attachment_id),
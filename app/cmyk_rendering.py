@@ -0,0 +1,170 @@
+import html
+import re
+from functools import lru_cache
+
+import tinycss2
+import tinycss2.color3
+from weasyprint.urls import URLFetcher, URLFetcherResponse
+
+from app.vector_cmyk import rgb_to_cmyk
+
+# CSS properties (besides any ending in "color", and anything starting "border") whose values can contain a colour.
+# Colour keywords anywhere else, such as in a font name, are left alone.
+COLOUR_SHORTHAND_PROPERTIES = {
+    "background",
+    "box-shadow",
+    "caret",
+    "column-rule",
+    "fill",
+    "outline",
+    "stroke",
+    "text-decoration",
+    "text-emphasis",
+    "text-shadow",
+}
+
+# SVG presentation attributes that hold a single colour
+SVG_COLOUR_ATTRIBUTES = ("fill", "stroke", "stop-color", "flood-color", "lighting-color", "color")
+
+# An opening tag, which can't appear in text content because that has any `<` escaped
+OPENING_TAG = re.compile(r"<[a-zA-Z][^<>]*>")
+STYLE_ELEMENT = re.compile(r"(<style\b[^<>]*>)(.*?)(</style\s*>)", re.DOTALL | re.IGNORECASE)
+CDATA_SECTION = re.compile(r"<!\[CDATA\[(.*?)\]\]>", re.DOTALL)
+
+
+def _attribute(names):
+    return re.compile(rf"(\s(?:{'|'.join(names)})\s*=\s*)(\"[^\"]*\"|'[^']*')")
+
+
+STYLE_ATTRIBUTE = _attribute(["style"])
+SVG_COLOUR_ATTRIBUTE = _attribute([*SVG_COLOUR_ATTRIBUTES, "style"])
+SVG_ROOT = re.compile(r"<svg\b[^<>]*?(?=/?>)")
+SVG_FILL_ATTRIBUTE = _attribute(["fill"])
+
+
+def device_cmyk(r, g, b):
+    """
+    The CSS device-cmyk() colour that Ghostscript would convert an opaque RGB colour to.
+    """
+    c, m, y, k = rgb_to_cmyk(r, g, b)
+    return f"device-cmyk({c} {m} {y} {k})"
+
+
+def default_colour():
+    # WeasyPrint, and its SVG renderer, draw text and shapes in black unless told otherwise
+    return device_cmyk(0, 0, 0)
+
+
+def default_colour_css():
+    """
+    A stylesheet that makes text and borders CMYK black unless the letter's own styles give them a colour. `:where()`
+    has no specificity, so even a rule for `html` in the letter's styles comes first.
+    """
+    return f":where(html) {{ color: {default_colour()} }}"
+
+
+def _is_colour_property(name):
+    return name.endswith("color") or name.startswith("border") or name in COLOUR_SHORTHAND_PROPERTIES
+
+
+def _convert_component_values(values):
+    converted = []
+    for value in values:
+        colour = tinycss2.color3.parse_color(value)
+        # leave transparent colours, `currentcolor` and anything we don't understand (eg gradients) as they are, so
+        # that the PDF isn't pure CMYK and still goes through Ghostscript
+        if isinstance(colour, tinycss2.color3.RGBA) and colour.alpha == 1:
+            value = tinycss2.parse_one_component_value(device_cmyk(colour.red, colour.green, colour.blue))
+        converted.append(value)
+    return converted
+
+
+def _convert_block_contents(content):
+    nodes = tinycss2.parse_blocks_contents(content)
+    for node in nodes:
+        if node.type == "declaration" and _is_colour_property(node.lower_name):
+            node.value = _convert_component_values(node.value)
+        elif node.type in ("qualified-rule", "at-rule") and node.content is not None:
+            node.content = _convert_block_contents(node.content)
+    return tinycss2.parse_component_value_list(tinycss2.serialize(nodes))
+
+
+def device_cmyk_css(css):
+    """
+    Replaces opaque RGB colours in a stylesheet, or a `style` attribute, with device-cmyk() colours.
+    """
+    return tinycss2.serialize(_convert_block_contents(tinycss2.parse_component_value_list(css)))
+
+
+def _convert_style_element(match):
+    opening_tag, css, closing_tag = match.groups()
+    if CDATA_SECTION.search(css):
+        css = CDATA_SECTION.sub(lambda cdata: f"<![CDATA[{device_cmyk_css(cdata.group(1))}]]>", css)
+    else:
+        css = device_cmyk_css(css)
+    return f"{opening_tag}{css}{closing_tag}"
+
+
+def _convert_attributes(pattern, markup):
+    def convert_attribute(match):
+        name_and_equals, quoted_value = match.groups()
+        value = html.unescape(quoted_value[1:-1])
+        if name_and_equals.strip().startswith("style"):
+            value = device_cmyk_css(value)
+        else:
+            value = tinycss2.serialize(_convert_component_values(tinycss2.parse_component_value_list(value)))
+        return f'{name_and_equals}"{html.escape(value)}"'
+
+    return OPENING_TAG.sub(lambda tag: pattern.sub(convert_attribute, tag.group(0)), markup)
+
+
+def device_cmyk_html(markup):
+    """
+    Replaces the opaque RGB colours in an HTML document's stylesheets and `style` attributes with device-cmyk()
+    colours, so that WeasyPrint draws them in DeviceCMYK. They're converted with the same device link Ghostscript
+    uses, so they come out the same as if we'd converted the PDF afterwards.
+    """
+    markup = STYLE_ELEMENT.sub(_convert_style_element, markup)
+    return _convert_attributes(STYLE_ATTRIBUTE, markup)
+
+
+@lru_cache(maxsize=64)
+def device_cmyk_svg(svg: bytes) -> bytes:
+    """
+    Converts the colours in an SVG's presentation attributes, `style` attributes and stylesheets, and makes its
+    default fill CMYK black. Branding logos are the same for every letter a service sends, so we keep the most recent
+    conversions.
+    """
+    markup = svg.decode("utf-8")
+    markup = STYLE_ELEMENT.sub(_convert_style_element, markup)
+    markup = _convert_attributes(SVG_COLOUR_ATTRIBUTE, markup)
+
+    if (root := SVG_ROOT.search(markup)) and not SVG_FILL_ATTRIBUTE.search(root.group(0)):
+        markup = f'{markup[: root.end()]} fill="{default_colour()}"{markup[root.end() :]}'
+
+    return markup.encode("utf-8")
+
+
+class CMYKURLFetcher(URLFetcher):
+    """
+    Fetches letter assets for WeasyPrint as usual, but with SVGs (ie branding logos) converted to device-cmyk()
+    colours.
+    """
+
+    def fetch(self, url, headers=None):
+        response = super().fetch(url, headers)
+        if response.content_type != "image/svg+xml" and not response.url.lower().endswith(".svg"):
+            return response
+
+        try:
+            svg = response.read()
+        finally:
+            response.close()
+
+        try:
+            svg = device_cmyk_svg(svg)
+        except UnicodeDecodeError:
+            # leave it for Ghostscript to convert
+            pass
+
+        return URLFetcherResponse(response.url, svg, response.headers, response.status)
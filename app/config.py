@@ -3,6 +3,8 @@ import os
 
 from kombu import Exchange, Queue
 
+from container_limits import celery_concurrency
+
 
 class QueueNames:
     LETTERS = "letter-tasks"
@@ -56,6 +58,7 @@ class Config:
         },
         "timezone": "Europe/London",
         "worker_max_memory_per_child": 256 * 1024,  # in KiB
+        "worker_concurrency": celery_concurrency(),
         "worker_max_tasks_per_child": 64,
         "imports": ["app.celery.tasks"],
         "task_queues": [
@@ -83,6 +86,56 @@ class Config:
     LETTER_ATTACHMENT_BUCKET_NAME = os.environ.get("LETTER_ATTACHMENT_BUCKET_NAME")
     LETTER_LOGO_URL = os.environ.get("LETTER_LOGO_URL")
 
+    # "server" runs Ghostscript conversions on resident gs processes (see app/ghostscript_engine.py), "subprocess"
+    # starts a new gs process for every conversion
+    GHOSTSCRIPT_ENGINE = os.getenv("GHOSTSCRIPT_ENGINE", "subprocess")
+    GHOSTSCRIPT_TIMEOUT_SECONDS = int(os.getenv("GHOSTSCRIPT_TIMEOUT_SECONDS", 60))
+    # Ghostscript's input and output files are written here, so that they stay in memory (see
+    # app/ghostscript_workspace.py). If it's missing or full, the system temp directory is used instead
+    GHOSTSCRIPT_WORKSPACE_DIR = os.getenv("GHOSTSCRIPT_WORKSPACE_DIR", "/dev/shm")
+    # PDFs with at least this many pages are converted to CMYK in several Ghostscript processes at once, each
+    # converting a range of pages. 0 (the default) always converts in one process
+    CMYK_PARALLEL_MIN_PAGES = int(os.getenv("CMYK_PARALLEL_MIN_PAGES", 0))
+    # Precompiled letters with at least this many pages have their pages checked in several processes at once, each
+    # checking a range of pages. 0 (the default) always checks them in this process
+    PARALLEL_VALIDATION_MIN_PAGES = int(os.getenv("PARALLEL_VALIDATION_MIN_PAGES", 0))
+    # Convert templated letters that only contain text and vector graphics to CMYK without Ghostscript (see
+    # app/vector_cmyk.py)
+    CMYK_VECTOR_CONVERSION = os.environ.get("CMYK_VECTOR_CONVERSION", "1") == "1"
+    # Render templated print letters in device CMYK with WeasyPrint, so that they don't need converting afterwards
+    # (see app/cmyk_rendering.py)
+    WEASYPRINT_CMYK_RENDERING = os.environ.get("WEASYPRINT_CMYK_RENDERING", "1") == "1"
+    # Keep Ghostscript's output in the letter cache, keyed on a hash of its input, version and arguments, with the most
+    # recent outputs up to this many bytes in memory as well (see app/ghostscript_cache.py). Off by default, as every
+    # conversion that isn't cached waits for a read from and a write to S3
+    GHOSTSCRIPT_CACHE = os.environ.get("GHOSTSCRIPT_CACHE", "0") == "1"
+    GHOSTSCRIPT_CACHE_LOCAL_BYTES = int(os.getenv("GHOSTSCRIPT_CACHE_LOCAL_BYTES", 64 * 1024 * 1024))
+    # Keep the results of sanitising precompiled letters and attachments in the letter cache, keyed on a hash of the
+    # letter, the flags it was sanitised with and the app and Ghostscript versions, with the most recent results up to
+    # this many bytes in memory as well (see app/sanitise_cache.py). Off by default, like GHOSTSCRIPT_CACHE
+    SANITISE_CACHE = os.environ.get("SANITISE_CACHE", "0") == "1"
+    SANITISE_CACHE_LOCAL_BYTES = int(os.getenv("SANITISE_CACHE_LOCAL_BYTES", 64 * 1024 * 1024))
+    # Check whether precompiled letters have content outside the printable areas from the geometry of their text and
+    # drawings, and only rasterise the pages that can't be checked that way (see app/vector_bounds.py)
+    VECTOR_BOUNDS_CHECK = os.environ.get("VECTOR_BOUNDS_CHECK", "1") == "1"
+    # When pages do need rasterising, render only the parts of them outside the printable areas, in grayscale, at this
+    # resolution, rather than whole pages with the printable areas painted over
+    MARGIN_RASTER_BOUNDS_CHECK = os.environ.get("MARGIN_RASTER_BOUNDS_CHECK", "1") == "1"
+    MARGIN_RASTER_DPI = int(os.getenv("MARGIN_RASTER_DPI", 100))
+    # Rasterise this many pages at a time when checking whole pages' boundaries with poppler, so that long letters
+    # don't need every page in memory at once. 0 splits the pages evenly by the number of subprocesses that can run at
+    # once, up to `RASTER_BOUNDS_CHECK_MAX_PAGES_AT_A_TIME` in app/precompiled.py
+    RASTER_BOUNDS_CHECK_PAGES_AT_A_TIME = int(os.getenv("RASTER_BOUNDS_CHECK_PAGES_AT_A_TIME", 0))
+    # Remember whether each of this many recently checked pages had content outside the printable area or a notify
+    # tag, keyed on a hash of what's on the page, so that pages shared between letters are only checked once
+    # (see app/page_memo.py). 0 turns it off
+    PAGE_VALIDATION_MEMO_SIZE = int(os.getenv("PAGE_VALIDATION_MEMO_SIZE", 10000))
+    # Keep precompiled letters registered with /precompiled-documents in /dev/shm, where every worker can read them,
+    # up to this many bytes (or a quarter of the space there, if that's less, as /dev/shm is only 64MB in a default
+    # docker container), until they haven't been previewed for this many seconds (see app/document_store.py)
+    PRECOMPILED_DOCUMENT_STORE_BYTES = int(os.getenv("PRECOMPILED_DOCUMENT_STORE_BYTES", 8 * 1024 * 1024))
+    PRECOMPILED_DOCUMENT_TTL_SECONDS = int(os.getenv("PRECOMPILED_DOCUMENT_TTL_SECONDS", 600))
+
 
 class Development(Config):
     SERVER_NAME = os.getenv("SERVER_NAME")
@@ -122,6 +175,13 @@ class Test(Development):
     SANITISED_LETTER_BUCKET_NAME = "test-letters-sanitise"
     PRECOMPILED_ORIGINALS_BACKUP_LETTER_BUCKET_NAME = "test-letters-precompiled-originals-backup"
     LETTER_ATTACHMENT_BUCKET_NAME = "test-letter-attachments"
+
+    # tests that want it switch it on, so that the rest don't need Ghostscript's version or the cache mocked
+    GHOSTSCRIPT_CACHE = False
+    SANITISE_CACHE = False
+    # likewise, so that tests checking the same pdf don't depend on the order they run in
+    PAGE_VALIDATION_MEMO_SIZE = 0
+
     CELERY = {
         **Config.CELERY,
         "broker_transport_options": {
@@ -0,0 +1,169 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+from collections import namedtuple
+from contextlib import suppress
+
+from flask import current_app
+
+StoredDocument = namedtuple("StoredDocument", ["data", "page_count", "expires_at"])
+
+# Memory-backed where there is one, so that documents are as quick to read as if each process kept its own copy
+DOCUMENT_STORE_DIR = os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "template-preview-documents"
+)
+
+# Only use up to this much of the space in the directory that's free or used by documents already
+MAX_SHARE_OF_FREE_SPACE = 0.25
+
+# Handles come from requests, so anything else is never looked for on disk
+HANDLE = re.compile(r"[0-9a-f]{64}")
+
+
+class DocumentStore:
+    """
+    PDFs that clients have registered with us, so that they can ask for previews of their pages by handle instead of
+    sending the whole PDF with every request. Keyed on a hash of the PDF, up to a total size in bytes, with each one
+    forgotten once it hasn't been used for `ttl` seconds.
+
+    Documents are files in `directory`, named `<handle>.<page count>.pdf`, so every gunicorn worker on the instance
+    knows a handle whichever one registered it. A file's modified time is when it was last used. Other instances of the
+    app won't know a handle, and clients should register the PDF again if they're told it's unknown.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def add(self, data: bytes, *, page_count, ttl, max_size):
+        """
+        :return str: the handle, or None if there isn't room to keep the PDF
+        """
+        if len(data) > max_size:
+            return None
+
+        handle = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.directory, f"{handle}.{page_count}.pdf")
+        os.makedirs(self.directory, exist_ok=True)
+
+        now = time.time()
+        if not self._make_room(len(data), now, ttl=ttl, max_size=max_size, keep=path):
+            return None
+
+        # another worker could remove it between us looking for it and using it, in which case it's written again
+        if not (self._touch(path, now) or self._write(path, data, now)):
+            return None
+
+        return handle
+
+    def get(self, handle, *, ttl):
+        if not HANDLE.fullmatch(handle):
+            return None
+
+        now = time.time()
+        for name in self._document_names():
+            if not name.startswith(f"{handle}."):
+                continue
+
+            path = os.path.join(self.directory, name)
+            # other workers could remove it at any time
+            try:
+                if os.stat(path).st_mtime + ttl <= now:
+                    os.unlink(path)
+                    return None
+                with open(path, "rb") as f:
+                    data = f.read()
+                os.utime(path, (now, now))
+            except FileNotFoundError:
+                return None
+
+            return StoredDocument(data, int(name.split(".")[1]), now + ttl)
+
+        return None
+
+    def clear(self):
+        for name in self._document_names():
+            with suppress(FileNotFoundError):
+                os.unlink(os.path.join(self.directory, name))
+
+    def _document_names(self):
+        try:
+            return [name for name in os.listdir(self.directory) if name.endswith(".pdf")]
+        except FileNotFoundError:
+            return []
+
+    def _touch(self, path, now):
+        try:
+            os.utime(path, (now, now))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _write(self, path, data, now):
+        # written under another name and moved into place, so other workers never read half a document
+        try:
+            fd, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        except OSError:
+            current_app.logger.warning("Couldn't add document to store", exc_info=True)
+            return False
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temporary_path, path)
+            os.utime(path, (now, now))
+        except OSError:
+            # most likely the directory is full, which other things that use /dev/shm need to know about too
+            current_app.logger.warning("Couldn't add document to store", exc_info=True)
+            with suppress(OSError):
+                os.unlink(temporary_path)
+            return False
+
+        return True
+
+    def _free_space(self):
+        try:
+            stats = os.statvfs(self.directory)
+        except OSError:
+            return 0
+        return stats.f_bavail * stats.f_frsize
+
+    def _make_room(self, size, now, *, ttl, max_size, keep):
+        """
+        Forgets documents that have expired, then as many of the least recently used as it takes to fit a document of
+        `size` bytes. The store never takes more than `MAX_SHARE_OF_FREE_SPACE` of the space it could use, so that it
+        leaves room for Ghostscript's workspace (see app/ghostscript_workspace.py) and anything else in /dev/shm.
+
+        :return bool: False if there isn't room for the document even in an empty store
+        """
+        documents, stored = [], 0
+        for name in self._document_names():
+            path = os.path.join(self.directory, name)
+            with suppress(FileNotFoundError):
+                stat = os.stat(path)
+                if path == keep:
+                    # it's already in the store, so doesn't need any more room
+                    size, stored = 0, stat.st_size
+                elif stat.st_mtime + ttl <= now:
+                    os.unlink(path)
+                else:
+                    documents.append((stat.st_mtime, stat.st_size, path))
+
+        stored += sum(document_size for _, document_size, _ in documents)
+        limit = min(max_size, int((self._free_space() + stored) * MAX_SHARE_OF_FREE_SPACE))
+        if size > limit:
+            return False
+
+        # least recently used first
+        for _, document_size, path in sorted(documents):
+            if stored + size <= limit:
+                break
+            with suppress(FileNotFoundError):
+                os.unlink(path)
+            stored -= document_size
+
+        return True
+
+
+document_store = DocumentStore(DOCUMENT_STORE_DIR)
@@ -6,14 +6,40 @@ from flask import current_app
 from pypdf import PdfReader
 from pypdf.generic import IndirectObject
 
+from app.ghostscript_cache import cached_ghostscript_output
+from app.ghostscript_engine import run_on_ghostscript_server
+from app.ghostscript_workspace import ghostscript_workspace
+from app.resource_limits import subprocess_slot
+
+# pdfwrite settings for embedding fonts, shared by the Ghostscript server and subprocess paths. See `embed_fonts`.
+EMBED_FONTS_GHOSTSCRIPT_ARGS = [
+    "-sDEVICE=pdfwrite",
+    "-dAutoRotatePages=/None",
+]
+EMBED_FONTS_GHOSTSCRIPT_POSTSCRIPT = "<</NeverEmbed [ ]>> setdistillerparams"
 
-def contains_unembedded_fonts(pdf_data, filename=""):  # noqa: C901 (too complex)
-    """
-    Code adapted from https://gist.github.com/tiarno/8a2995e70cee42f01e79
 
+def contains_unembedded_fonts(pdf_data, filename=""):
+    """
     :param BytesIO pdf_data: a file-like object containing the pdf
     :return boolean: If any fonts are contained that are not embedded.
     """
+    unembedded = get_unembedded_fonts(PdfReader(pdf_data), filename)
+
+    # put things back as we found them
+    pdf_data.seek(0)
+    return unembedded
+
+
+def get_unembedded_fonts(pdf, filename=""):  # noqa: C901 (too complex)
+    """
+    The same as `contains_unembedded_fonts`, for a PDF that's already been read.
+
+    Code adapted from https://gist.github.com/tiarno/8a2995e70cee42f01e79
+
+    :param PdfReader pdf: the pdf
+    :return set: The names of the fonts that are used but not embedded
+    """
 
     def walk(obj, fnt, emb):
         """
@@ -51,18 +77,13 @@ def contains_unembedded_fonts(pdf_data, filename=""):  # noqa: C901 (too complex
         elif isinstance(obj, IndirectObject):
             walk(obj.get_object(), fnt, emb)
 
-    pdf = PdfReader(pdf_data)
     fonts = set()
     embedded = set()
     for page in pdf.pages:
         obj = page.get_object()
         walk(obj["/Resources"], fonts, embedded)
 
-    unembedded = fonts - embedded
-
-    # put things back as we found them
-    pdf_data.seek(0)
-    return unembedded
+    return fonts - embedded
 
 
 @sentry_sdk.trace
@@ -70,48 +91,66 @@ def embed_fonts(pdf_data):
     """
     Recreate the following
     gs \
-        -o %stdout \
+        -o output.pdf \
         -sstdout=%stderr \
         -sDEVICE=pdfwrite \
         -c "<</NeverEmbed [ ]>> setdistillerparams" \
-        -f %stdin
+        -f input.pdf
 
-    `-o %stdout` sets output to stdout. it also sets dBATCH and dNOPAUSE to ensure gs doesn't wait for user prompts.
+    `-o output.pdf` sets the output file. it also sets dBATCH and dNOPAUSE to ensure gs doesn't wait for user prompts.
     `-sstdout=%stderr` sets ghostscript logging output to stderr
     `-sDEVICE=pdfwrite` sets ghostscript to write to a PDF
     `-c "<</NeverEmbed [ ]>> setdistillerparams"` gives a postscript command to run.
-    `-f %stdin` read from stdin rather than a file
+    `-f input.pdf` reads the input file
+
+    The input and output files live in a `ghostscript_workspace`, rather than being piped through stdin and stdout.
 
     The postscript command in particular is setting the array of fonts that aren't embedded to an empty array. As
     https://ghostscript.com/doc/9.20/VectorDevices.htm#note_11 states, by default 14 fonts are never embedded. We want
     them to be embedded, which will result in a larger file, but one that should work even if those fonts aren't
     available on the print provider's system.
 
+    Outputs are cached on a hash of the input (see `cached_ghostscript_output`).
+
     :param BytesIO pdf: a file-like object containing the pdf
     :return BytesIO: New file-like containing the new pdf with embedded fonts
     """
-    gs_process = subprocess.Popen(
-        [
-            "gs",
-            "-o",
-            "%stdout",
-            "-sDEVICE=pdfwrite",
-            "-sstdout=%stderr",
-            "-dAutoRotatePages=/None",
-            "-c",
-            "<</NeverEmbed [ ]>> setdistillerparams",
-            "-f",
-            "%stdin",
-        ],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
+    return cached_ghostscript_output(
+        pdf_data,
+        EMBED_FONTS_GHOSTSCRIPT_ARGS,
+        EMBED_FONTS_GHOSTSCRIPT_POSTSCRIPT,
+        lambda: _embed_fonts_with_ghostscript(pdf_data),
     )
-    stdout, stderr = gs_process.communicate(input=pdf_data.read())
-    if gs_process.returncode != 0:
-        raise Exception(
-            f"ghostscript font embed process failed with return code: {gs_process.returncode}\n"
-            f"stderr:\n"
-            f"{stderr.decode('utf-8')}"
-        )
-    return BytesIO(stdout)
+
+
+def _embed_fonts_with_ghostscript(pdf_data):
+    if result := run_on_ghostscript_server(EMBED_FONTS_GHOSTSCRIPT_ARGS, EMBED_FONTS_GHOSTSCRIPT_POSTSCRIPT, pdf_data):
+        output, _ = result
+        return BytesIO(output)
+
+    with ghostscript_workspace(pdf_data) as workspace:
+        with subprocess_slot():
+            gs_process = subprocess.Popen(
+                [
+                    "gs",
+                    "-o",
+                    workspace.output_path,
+                    "-sstdout=%stderr",
+                    *EMBED_FONTS_GHOSTSCRIPT_ARGS,
+                    "-c",
+                    EMBED_FONTS_GHOSTSCRIPT_POSTSCRIPT,
+                    "-f",
+                    workspace.input_path,
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            _, stderr = gs_process.communicate()
+
+        if gs_process.returncode != 0:
+            raise Exception(
+                f"ghostscript font embed process failed with return code: {gs_process.returncode}\n"
+                f"stderr:\n"
+                f"{stderr.decode('utf-8')}"
+            )
+        return workspace.read_output()
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from functools import lru_cache
+from io import BytesIO
+
+from flask import current_app
+
+from app.letter_cache import LetterCache
+
+# Ghostscript reads ICC profiles and colour mappings from here, so they affect its output as much as its arguments do
+GHOSTSCRIPT_RESOURCES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ghostscript")
+# control.txt names the profiles it maps colours with relative to the directory the app runs in
+GHOSTSCRIPT_RESOURCES_RELATIVE_PATH = "app/ghostscript/"
+
+
+letter_cache = LetterCache("Ghostscript output")
+
+
+@lru_cache
+def ghostscript_version():
+    return subprocess.run(["gs", "--version"], capture_output=True, check=True, text=True).stdout.strip()
+
+
+@lru_cache
+def ghostscript_resources_digest():
+    digest = hashlib.sha256()
+    for filename in sorted(os.listdir(GHOSTSCRIPT_RESOURCES_DIR)):
+        digest.update(filename.encode())
+        with open(os.path.join(GHOSTSCRIPT_RESOURCES_DIR, filename), "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+@lru_cache
+def ghostscript_resources_dir():
+    """
+    A copy of app/ghostscript for Ghostscript to read, with the paths in control.txt made absolute, so that they
+    don't depend on Ghostscript's working directory and resident servers, which may only read from directories they're
+    given (see app/ghostscript_engine.py), can read them.
+
+    The copy is named after a hash of the resources, so that every process on a machine shares one, and the arguments
+    we run Ghostscript with, which are part of the cache key, are the same in each of them.
+    """
+    resources_dir = os.path.join(
+        tempfile.gettempdir(), f"template-preview-ghostscript-{ghostscript_resources_digest()[:16]}"
+    )
+    if os.path.isdir(resources_dir):
+        return resources_dir
+
+    staging_dir = tempfile.mkdtemp(prefix="template-preview-ghostscript-staging-")
+    for filename in os.listdir(GHOSTSCRIPT_RESOURCES_DIR):
+        with open(os.path.join(GHOSTSCRIPT_RESOURCES_DIR, filename), "rb") as f:
+            contents = f.read()
+        if filename == "control.txt":
+            contents = contents.replace(GHOSTSCRIPT_RESOURCES_RELATIVE_PATH.encode(), f"{resources_dir}/".encode())
+        with open(os.path.join(staging_dir, filename), "wb") as f:
+            f.write(contents)
+
+    try:
+        os.rename(staging_dir, resources_dir)
+    except OSError:
+        # another process got there first
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    return resources_dir
+
+
+def _input_digest(input_data):
+    position = input_data.tell()
+    if isinstance(input_data, BytesIO):
+        with input_data.getbuffer() as buffer:
+            digest = hashlib.sha256(buffer[position:]).hexdigest()
+    else:
+        digest = hashlib.sha256(input_data.read()).hexdigest()
+        input_data.seek(position)
+    return digest
+
+
+def _cache_key(input_data, args, postscript):
+    try:
+        version = ghostscript_version()
+    except (OSError, subprocess.CalledProcessError):
+        current_app.logger.warning("Couldn't get Ghostscript version, not caching its output", exc_info=True)
+        return None
+
+    parts = [_input_digest(input_data), version, ghostscript_resources_digest(), list(args), postscript]
+    return f"ghostscript/{hashlib.sha256(json.dumps(parts).encode()).hexdigest()}.pdf"
+
+
+def cached_ghostscript_output(input_data, args, postscript, run_ghostscript):
+    """
+    Returns what `run_ghostscript()` would, but only calls it if we haven't already run the same input through
+    Ghostscript with the same arguments. Outputs are stored in the letter cache (see `LetterCache`), keyed on a hash of
+    the input bytes, the Ghostscript version and everything we pass it.
+
+    Not being able to read from or write to the cache doesn't stop the conversion.
+
+    :param BytesIO input_data: a file-like object containing the pdf. Left where it was.
+    :param list args: the Ghostscript arguments `run_ghostscript` uses
+    :param str postscript: the PostScript `run_ghostscript` runs before the input
+    :param callable run_ghostscript: does the conversion, returning a file-like containing the output pdf
+    :return BytesIO: New file-like containing the output pdf
+    """
+    if not current_app.config["GHOSTSCRIPT_CACHE"] or not (cache_key := _cache_key(input_data, args, postscript)):
+        return run_ghostscript()
+
+    output, from_cache = letter_cache.get_or_make(
+        cache_key,
+        lambda: run_ghostscript().read(),
+        local_max_size=current_app.config["GHOSTSCRIPT_CACHE_LOCAL_BYTES"],
+    )
+    if from_cache:
+        current_app.logger.info("Using cached Ghostscript output", extra={"cache_key": cache_key})
+
+    return BytesIO(output)
@@ -0,0 +1,214 @@
+import atexit
+import os
+import select
+import shutil
+import subprocess
+import tempfile
+import time
+import uuid
+
+from flask import current_app
+
+from app.ghostscript_cache import ghostscript_resources_dir
+from app.resource_limits import subprocess_slot
+
+# Servers are restarted after this many jobs, so that anything the interpreter holds on to between documents (fonts,
+# leaked memory) can't build up indefinitely.
+MAX_JOBS_PER_SERVER = 100
+
+
+class GhostscriptEngineError(Exception):
+    pass
+
+
+class GhostscriptServer:
+    """
+    A resident `gs` process that reads PostScript commands from its stdin, so we only pay for interpreter start-up,
+    font map loading and ICC set-up once rather than once per PDF.
+
+    Each job points the pdfwrite device at a new output file, runs the input file, then points the device back at a
+    scratch file so that the job's output is closed and complete. The process runs with -dSAFER and may only write
+    inside its own working directory, and read from it and our Ghostscript resources (see `ghostscript_resources_dir`).
+    """
+
+    def __init__(self, args, postscript):
+        self.workdir = tempfile.mkdtemp(prefix="template-preview-gs-")
+        self.idle_output = os.path.join(self.workdir, "idle.pdf")
+        self.log_path = os.path.join(self.workdir, "gs.log")
+        self.jobs_run = 0
+        self._unread = b""
+
+        with open(self.log_path, "wb") as log:
+            self.process = subprocess.Popen(
+                [
+                    "gs",
+                    "-q",
+                    "-dNOPAUSE",
+                    "-dNOPROMPT",
+                    "-dBATCH",  # exit when stdin is closed
+                    "-dSAFER",
+                    f"--permit-file-read={self.workdir}/",
+                    f"--permit-file-read={ghostscript_resources_dir()}/",
+                    f"--permit-file-write={self.workdir}/",
+                    f"-sOutputFile={self.idle_output}",
+                    *args,
+                    "-c",
+                    postscript,
+                    "-f",
+                    "-",  # read commands from STDIN
+                ],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=log,
+                bufsize=0,
+            )
+
+    def run(self, input_data: bytes, *, timeout) -> tuple[bytes, bytes]:
+        """
+        Runs one PDF through the server. Returns the output PDF and anything Ghostscript printed while processing it.
+        """
+        job_id = uuid.uuid4().hex
+        input_path = os.path.join(self.workdir, f"{job_id}-in.pdf")
+        output_path = os.path.join(self.workdir, f"{job_id}-out.pdf")
+
+        with open(input_path, "wb") as f:
+            f.write(input_data)
+
+        # Paths only contain characters from mkdtemp and a hex uuid, so they don't need escaping in PostScript strings
+        command = (
+            f"{{ << /OutputFile ({output_path}) >> setpagedevice ({input_path}) run }} stopped "
+            f"{{ << /OutputFile ({self.idle_output}) >> setpagedevice }} stopped or "
+            f"{{ (FAILED {job_id}) }} {{ (DONE {job_id}) }} ifelse = flush clear\n"
+        )
+
+        try:
+            try:
+                self.process.stdin.write(command.encode())
+                self.process.stdin.flush()
+            except OSError as e:
+                raise GhostscriptEngineError(f"ghostscript server is not running: {e}") from e
+
+            status, messages = self._read_until_job_finishes(job_id, deadline=time.monotonic() + timeout)
+
+            if status != "DONE":
+                raise GhostscriptEngineError(f"ghostscript server failed to process job\nstdout: {messages}")
+
+            with open(output_path, "rb") as f:
+                return f.read(), messages
+        finally:
+            self.jobs_run += 1
+            for path in (input_path, output_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _read_until_job_finishes(self, job_id, *, deadline):
+        stdout = self.process.stdout.fileno()
+        messages = b""
+
+        while True:
+            line, newline, rest = self._unread.partition(b"\n")
+            if not newline:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not select.select([stdout], [], [], remaining)[0]:
+                    raise GhostscriptEngineError("ghostscript server timed out")
+
+                if not (chunk := os.read(stdout, 65536)):
+                    raise GhostscriptEngineError(
+                        f"ghostscript server exited with return code: {self.process.wait()}\nstderr: {self._log()}"
+                    )
+                self._unread += chunk
+                continue
+
+            self._unread = rest
+            status, _, finished_job_id = line.strip().decode(errors="replace").partition(" ")
+            if finished_job_id == job_id and status in ("DONE", "FAILED"):
+                return status, messages
+
+            messages += line + newline
+
+    def _log(self):
+        with open(self.log_path, "rb") as f:
+            return f.read()
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class GhostscriptPool:
+    """
+    Keeps idle Ghostscript servers for each set of arguments we run Ghostscript with. A server that fails, times out
+    or crashes is thrown away rather than reused, so one bad PDF can't affect later jobs.
+
+    Servers belong to the process that started them. If we've been forked since (eg into a celery child) the pool is
+    emptied and new servers are started as they're needed.
+    """
+
+    def __init__(self):
+        self._pid = os.getpid()
+        self._idle_servers = {}
+
+    def run(self, args, postscript, input_data: bytes, *, timeout) -> tuple[bytes, bytes]:
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._idle_servers = {}
+
+        key = (tuple(args), postscript)
+        idle_servers = self._idle_servers.setdefault(key, [])
+
+        try:
+            server = idle_servers.pop()
+        except IndexError:
+            try:
+                server = GhostscriptServer(args, postscript)
+            except OSError as e:
+                raise GhostscriptEngineError(f"could not start ghostscript server: {e}") from e
+
+        try:
+            with subprocess_slot():
+                result = server.run(input_data, timeout=timeout)
+        except BaseException:
+            server.close()
+            raise
+
+        if server.jobs_run >= MAX_JOBS_PER_SERVER:
+            server.close()
+        else:
+            idle_servers.append(server)
+
+        return result
+
+    def close(self):
+        if os.getpid() != self._pid:
+            return
+        for idle_servers in self._idle_servers.values():
+            while idle_servers:
+                idle_servers.pop().close()
+
+
+ghostscript_servers = GhostscriptPool()
+atexit.register(ghostscript_servers.close)
+
+
+def run_on_ghostscript_server(args, postscript, input_data):
+    """
+    Runs `input_data` (a file-like containing a PDF) through a resident Ghostscript server, if they're enabled.
+
+    Returns the output PDF bytes and anything Ghostscript printed, or None if the caller should start a `gs`
+    subprocess instead - either because servers are disabled or because this one failed. `input_data` is rewound
+    either way.
+    """
+    if current_app.config["GHOSTSCRIPT_ENGINE"] != "server":
+        return None
+
+    try:
+        return ghostscript_servers.run(
+            args, postscript, input_data.read(), timeout=current_app.config["GHOSTSCRIPT_TIMEOUT_SECONDS"]
+        )
+    except GhostscriptEngineError as e:
+        current_app.logger.warning("Ghostscript server failed, falling back to a subprocess: %s", e)
+        return None
+    finally:
+        input_data.seek(0)
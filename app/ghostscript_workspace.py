@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from io import BytesIO
+
+from flask import current_app
+
+# Only use the configured (normally memory-backed) directory if it has room for this many copies of the input, to
+# leave space for Ghostscript's output and for other workers. /dev/shm is only 64MB in a default docker container.
+WORKSPACE_HEADROOM = 4
+
+
+class GhostscriptWorkspace:
+    """
+    A private directory holding one Ghostscript job's input and output files.
+
+    Ghostscript needs random access to a PDF, so when it reads one from stdin it first spools it to a temporary file
+    of its own. Writing the input ourselves and passing file paths saves that, and lets us read the output back in one
+    go instead of collecting it from a pipe in chunks.
+    """
+
+    def __init__(self, directory):
+        self.path = tempfile.mkdtemp(prefix="template-preview-gs-", dir=directory)
+        self.input_path = os.path.join(self.path, "input.pdf")
+        self.output_path = os.path.join(self.path, "output.pdf")
+
+    def write_input(self, pdf_data):
+        """
+        Writes the rest of `pdf_data` from its current position, as `pdf_data.read()` would.
+        """
+        with open(self.input_path, "wb") as f:
+            if isinstance(pdf_data, BytesIO):
+                # write straight from the BytesIO's own buffer rather than copying it with `read()` first
+                with pdf_data.getbuffer() as buffer:
+                    f.write(buffer[pdf_data.tell() :])
+                pdf_data.seek(0, os.SEEK_END)
+            else:
+                shutil.copyfileobj(pdf_data, f)
+
+    def read_output(self):
+        # a single read of a file whose size is known up front allocates the result once
+        with open(self.output_path, "rb") as f:
+            return BytesIO(f.read())
+
+    def close(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def _workspace_directory(input_size):
+    directory = current_app.config["GHOSTSCRIPT_WORKSPACE_DIR"]
+
+    try:
+        stats = os.statvfs(directory)
+    except OSError:
+        return tempfile.gettempdir()
+
+    if stats.f_bavail * stats.f_frsize < input_size * WORKSPACE_HEADROOM:
+        current_app.logger.info(
+            "Not enough space in %s for Ghostscript workspace, using %s",
+            directory,
+            tempfile.gettempdir(),
+            extra={"input_size": input_size},
+        )
+        return tempfile.gettempdir()
+
+    return directory
+
+
+@contextmanager
+def ghostscript_workspace(pdf_data):
+    """
+    Writes `pdf_data` (a file-like containing a PDF) to a new workspace, and removes the workspace when the block
+    exits. Run Ghostscript with `workspace.input_path` and `workspace.output_path`, then call `workspace.read_output()`.
+    """
+    position = pdf_data.tell()
+    input_size = pdf_data.seek(0, os.SEEK_END) - position
+    pdf_data.seek(position)
+
+    workspace = GhostscriptWorkspace(_workspace_directory(input_size))
+    try:
+        workspace.write_input(pdf_data)
+        yield workspace
+    finally:
+        workspace.close()
@@ -0,0 +1,96 @@
+import threading
+from collections import OrderedDict
+
+from botocore.exceptions import BotoCoreError
+from botocore.exceptions import ClientError as BotoClientError
+from flask import current_app
+from notifications_utils.s3 import S3ObjectNotFound, s3download, s3upload
+
+
+class LocalTier:
+    """
+    The most recently used cached outputs, up to a total size in bytes, so that repeats in the same process don't need
+    to go to S3.
+    """
+
+    def __init__(self):
+        self._outputs = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._outputs:
+                return None
+            self._outputs.move_to_end(key)
+            return self._outputs[key]
+
+    def set(self, key, output: bytes, *, max_size):
+        if len(output) > max_size:
+            return
+
+        with self._lock:
+            if key in self._outputs:
+                self._size -= len(self._outputs.pop(key))
+            self._outputs[key] = output
+            self._size += len(output)
+
+            while self._size > max_size:
+                _, evicted = self._outputs.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._outputs.clear()
+            self._size = 0
+
+
+class LetterCache:
+    """
+    Outputs of expensive work, kept in the letter cache bucket like `current_app.cache` keeps previews, with the most
+    recently used in memory as well.
+
+    Unlike `current_app.cache`, outputs are bytes that the caller builds the key for, the memory they take is bounded
+    by size rather than by count, as they can be whole letters, and not being able to read from or write to the bucket
+    doesn't stop the work being done.
+    """
+
+    def __init__(self, description):
+        self.description = description
+        self.local_tier = LocalTier()
+
+    def _download(self, cache_key):
+        try:
+            return s3download(current_app.config["LETTER_CACHE_BUCKET_NAME"], cache_key).read()
+        except S3ObjectNotFound:
+            return None
+        except (BotoClientError, BotoCoreError):
+            current_app.logger.warning("Couldn't read %s from cache", self.description, exc_info=True)
+            return None
+
+    def _upload(self, cache_key, output):
+        try:
+            s3upload(
+                filedata=output,
+                region=current_app.config["AWS_REGION"],
+                bucket_name=current_app.config["LETTER_CACHE_BUCKET_NAME"],
+                file_location=cache_key,
+            )
+        except (BotoClientError, BotoCoreError):
+            current_app.logger.warning("Couldn't write %s to cache", self.description, exc_info=True)
+
+    def get_or_make(self, cache_key, make, *, local_max_size):
+        """
+        :param str cache_key: where the output is kept in the bucket
+        :param callable make: does the work, returning the output as bytes. Exceptions it raises aren't cached.
+        :param int local_max_size: how many bytes of outputs to keep in memory
+        :return tuple: the output, and whether it came from the cache
+        """
+        from_cache = True
+        if (output := self.local_tier.get(cache_key)) is None and (output := self._download(cache_key)) is None:
+            output = make()
+            self._upload(cache_key, output)
+            from_cache = False
+
+        self.local_tier.set(cache_key, output, max_size=local_max_size)
+        return output, from_cache
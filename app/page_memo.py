@@ -0,0 +1,125 @@
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+
+# Part of every key, so that changing what a check finds means pages we've already seen are checked again
+PAGE_CHECKS_VERSION = 1
+
+
+class PageMemo:
+    """
+    The results of checks on the pages we've seen most recently, up to a number of results, keyed on the check and
+    the page's fingerprint (see `PdfDocument.page_fingerprint`).
+
+    Letters from the same service tend to share most of their pages, such as terms and conditions or a reply form, so
+    only the pages that change from letter to letter need checking.
+    """
+
+    def __init__(self):
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._results:
+                return None
+            self._results.move_to_end(key)
+            return self._results[key]
+
+    def set(self, key, result: bool, *, max_size):
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+
+            while len(self._results) > max_size:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
+page_memo = PageMemo()
+
+
+def _key(document, page_number, *, check, is_an_attachment):
+    # A page's result depends on what's on it and whether it's checked as the first page of a letter, which has the
+    # address block and can't have a notify tag
+    return (
+        check,
+        PAGE_CHECKS_VERSION,
+        document.page_fingerprint(page_number - 1),
+        page_number == 1 and not is_an_attachment,
+    )
+
+
+def unchecked_pages(document, page_numbers, *, checks, is_an_attachment):
+    """
+    :return list: the page numbers that we don't have a result for from every one of `checks`
+    """
+    if not current_app.config["PAGE_VALIDATION_MEMO_SIZE"]:
+        return list(page_numbers)
+
+    return [
+        page_number
+        for page_number in page_numbers
+        if any(
+            page_memo.get(_key(document, page_number, check=check, is_an_attachment=is_an_attachment)) is None
+            for check in checks
+        )
+    ]
+
+
+def remember_results(document, results, *, check, is_an_attachment):
+    """
+    Records results of a check that were found some other way than through `remembered_invalid_pages`, such as in
+    another process.
+
+    :param dict results: whether each page number failed the check
+    """
+    if not (max_size := current_app.config["PAGE_VALIDATION_MEMO_SIZE"]):
+        return
+
+    for page_number, is_invalid in results.items():
+        page_memo.set(
+            _key(document, page_number, check=check, is_an_attachment=is_an_attachment), is_invalid, max_size=max_size
+        )
+
+
+def remembered_invalid_pages(document, page_numbers, *, check, is_an_attachment, find_invalid_pages):
+    """
+    Returns what `find_invalid_pages(page_numbers)` would, but only calls it for the pages we haven't checked before.
+
+    :param PdfDocument document: the pdf
+    :param list page_numbers: the pages to check, one-indexed
+    :param str check: names the check, to keep its results apart from other checks'
+    :param bool is_an_attachment: whether the pdf is attached to a letter, so has no first page
+    :param callable find_invalid_pages: does the check on a list of page numbers, returning the ones that fail
+    :return list: the page numbers that fail the check, in order
+    """
+    if not current_app.config["PAGE_VALIDATION_MEMO_SIZE"]:
+        return find_invalid_pages(page_numbers)
+
+    known = {}
+    for page_number in page_numbers:
+        result = page_memo.get(_key(document, page_number, check=check, is_an_attachment=is_an_attachment))
+        if result is not None:
+            known[page_number] = result
+
+    if new_pages := [page_number for page_number in page_numbers if page_number not in known]:
+        invalid_pages = set(find_invalid_pages(new_pages))
+        new_results = {page_number: page_number in invalid_pages for page_number in new_pages}
+        remember_results(document, new_results, check=check, is_an_attachment=is_an_attachment)
+        known.update(new_results)
+
+    if len(new_pages) < len(page_numbers):
+        current_app.logger.info(
+            "Reusing %s results for %s of %s pages",
+            check,
+            len(page_numbers) - len(new_pages),
+            len(page_numbers),
+            extra={"check": check},
+        )
+
+    return [page_number for page_number in page_numbers if known[page_number]]
@@ -0,0 +1,289 @@
+import hashlib
+import re
+from io import BytesIO
+
+from pypdf import PdfReader, PdfWriter
+
+PYPDF = "pypdf"
+PYMUPDF = "pymupdf"
+
+# A reference to another object, such as "12 0 R", in pymupdf's definition of an object
+REFERENCE = re.compile(r"\b(\d+) (\d+) R\b")
+
+# References that point back up the document, to the page tree or to the page an annotation is on, rather than at
+# anything that changes how a page looks
+BACK_REFERENCE = re.compile(r"/(?:Parent|P)\s*\d+ \d+ R\b")
+
+# A stream's length, which could be written in the stream's dictionary or in an object of its own, and which we hash the
+# stream itself instead of
+STREAM_LENGTH = re.compile(r"/Length\b\s*\d+(?: \d+ R\b)?")
+
+# Entries in the document catalog that change how every page looks: which optional content is shown, how form fields
+# are drawn, and the colour space the document is meant to be printed in
+CATALOG_RENDER_STATE = ("OCProperties", "AcroForm", "OutputIntents")
+
+
+class PdfDocument:
+    """
+    A PDF on its way through sanitising.
+
+    Each stage of sanitising used to parse the PDF for itself, with pypdf or pymupdf, and write it out again if it
+    changed anything. Instead, stages share one of these, which parses the PDF with each library at most once (and
+    only when a stage first asks), and keeps anything worked out from it, such as page sizes or the words on a page,
+    until a stage changes the document.
+
+    A stage that changes the document edits `reader` or `pymupdf_document` in place and then calls `edited_with`. The
+    PDF is only written out again when something needs it in a different form: the other library, Ghostscript, or the
+    finished file.
+    """
+
+    def __init__(self, data: bytes):
+        self._data = data
+        self._reader = None
+        self._pymupdf_document = None
+        self._edited_with = None
+        self._facts = {}
+
+    @classmethod
+    def of(cls, pdf):
+        """
+        :param pdf: a PdfDocument, which is returned as it is, or a file-like object containing the pdf, which is read
+            from its current position and left where it was
+        """
+        if isinstance(pdf, cls):
+            return pdf
+
+        position = pdf.tell()
+        data = pdf.read()
+        pdf.seek(position)
+        return cls(data)
+
+    @property
+    def data(self) -> bytes:
+        if self._edited_with == PYPDF:
+            output = PdfWriter()
+            output.append_pages_from_reader(self._reader)
+            pdf_bytes = BytesIO()
+            output.write(pdf_bytes)
+            self._data = pdf_bytes.getvalue()
+        elif self._edited_with == PYMUPDF:
+            self._data = self._pymupdf_document.tobytes()
+
+        self._edited_with = None
+        return self._data
+
+    def file(self):
+        """
+        :return BytesIO: New file-like containing the pdf, for code that reads files, such as Ghostscript
+        """
+        return BytesIO(self.data)
+
+    @property
+    def reader(self):
+        if self._reader is None:
+            self._reader = PdfReader(BytesIO(self.data))
+        return self._reader
+
+    @property
+    def pymupdf_document(self):
+        if self._pymupdf_document is None:
+            import pymupdf
+
+            self._pymupdf_document = pymupdf.open(stream=self.data, filetype="pdf")
+        return self._pymupdf_document
+
+    def edited_with(self, library):
+        """
+        Records that a stage has changed the document through `reader` (PYPDF) or `pymupdf_document` (PYMUPDF). The
+        other library's copy, and everything worked out from the document, are out of date.
+        """
+        if library == PYPDF:
+            self._pymupdf_document = None
+        else:
+            self._reader = None
+
+        self._edited_with = library
+        self._facts.clear()
+
+    def cached(self, key, compute):
+        """
+        Returns `compute()`, only calling it the first time `key` is asked for since the document last changed.
+        """
+        if key not in self._facts:
+            self._facts[key] = compute()
+        return self._facts[key]
+
+    @property
+    def page_count(self):
+        return len(self.reader.pages)
+
+    def page_boxes(self):
+        """
+        :return list: The media box and /Rotate of each page
+        """
+        return self.cached("page_boxes", lambda: [(page.mediabox, page.get("/Rotate")) for page in self.reader.pages])
+
+    def words(self, page_number):
+        """
+        :param int page_number: zero-indexed
+        :return list: pymupdf's `get_text_words()` for the page
+        """
+        return self.cached(("words", page_number), lambda: self.pymupdf_document[page_number].get_text_words())
+
+    def page_fingerprint(self, page_number):
+        """
+        A hash of everything that affects how a page looks: its boxes and rotation, its content streams, resources and
+        annotations, everything they refer to, and the parts of the document catalog that apply to every page (see
+        `CATALOG_RENDER_STATE`). Pages that look the same have the same fingerprint, even in different documents, as
+        long as they're made of the same objects.
+
+        :param int page_number: zero-indexed
+        :return str: hex digest
+        """
+        digests = self.cached("object_digests", lambda: _ObjectDigests(self.pymupdf_document))
+        return self.cached(("page_fingerprint", page_number), lambda: digests.of_page(page_number))
+
+
+class _ObjectDigests:
+    """
+    Hashes of the objects in a pymupdf document, each including the hashes of the objects it refers to in place of
+    their object numbers, so that two objects hash the same if they're made of the same things. Objects that refer to
+    each other in a loop each include the hash of the whole loop.
+    """
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.definitions = {}
+        self.digests = {}
+        self._catalog_render_state = None
+
+    def _definition(self, xref):
+        if xref not in self.definitions:
+            definition = BACK_REFERENCE.sub("", self.doc.xref_object(xref, compressed=True))
+            if self.doc.xref_is_stream(xref):
+                definition = STREAM_LENGTH.sub("", definition, count=1)
+            self.definitions[xref] = definition
+        return self.definitions[xref]
+
+    def _references(self, definition):
+        return [
+            int(match.group(1))
+            for match in REFERENCE.finditer(definition)
+            if 0 < int(match.group(1)) < self.doc.xref_length()
+        ]
+
+    def _with_digests(self, definition, digest_of=None):
+        digest_of = digest_of or (lambda reference: self.digests.get(reference, "?"))
+        return REFERENCE.sub(lambda match: digest_of(int(match.group(1))), definition)
+
+    def _digest(self, xref, digest_of=None):
+        digest = hashlib.sha256(self._with_digests(self._definition(xref), digest_of).encode())
+        if self.doc.xref_is_stream(xref):
+            digest.update(self.doc.xref_stream_raw(xref))
+        return digest.hexdigest()
+
+    def of_xref(self, xref):
+        # Finds the strongly connected components of the objects (either a single object, or objects that refer to
+        # each other in a loop) with Tarjan's algorithm, without recursing as a PDF can nest objects as deeply as it
+        # likes. Each component is found after everything it refers to outside itself, so can be hashed straight away.
+        if xref in self.digests:
+            return self.digests[xref]
+
+        order, lowest = {}, {}
+        in_progress, walk = [], []
+
+        def visit(current):
+            order[current] = lowest[current] = len(order)
+            in_progress.append(current)
+            walk.append((current, iter(self._references(self._definition(current)))))
+
+        visit(xref)
+        while walk:
+            current, references = walk[-1]
+            for reference in references:
+                if reference in self.digests:
+                    continue
+                if reference not in order:
+                    visit(reference)
+                    break
+                # it's been visited but not hashed, so it's in a component we're still finding
+                lowest[current] = min(lowest[current], order[reference])
+            else:
+                walk.pop()
+                if walk:
+                    parent = walk[-1][0]
+                    lowest[parent] = min(lowest[parent], lowest[current])
+                if lowest[current] == order[current]:
+                    component = []
+                    while not component or component[-1] != current:
+                        component.append(in_progress.pop())
+                    self._digest_component(component)
+
+        return self.digests[xref]
+
+    def _digest_component(self, component):
+        if len(component) == 1 and component[0] not in self._references(self._definition(component[0])):
+            self.digests[component[0]] = self._digest(component[0])
+            return
+
+        # Objects in a loop can't each include the others' hashes, so instead they all include the whole loop. It's
+        # written out from one of its objects, numbering the others in the order they're referred to, and that
+        # object is picked by what the objects are made of rather than their object numbers where possible, so the
+        # same loop hashes the same in different documents.
+        members = set(component)
+        start = min(component, key=lambda member: (self._digest(member), member))
+        numbers = {start: 0}
+
+        def number_of(reference):
+            if reference not in members:
+                return self.digests.get(reference, "?")
+            if reference not in numbers:
+                numbers[reference] = len(numbers)
+                queue.append(reference)
+            return f"#{numbers[reference]}"
+
+        queue = [start]
+        component_digest = hashlib.sha256()
+        for member in queue:
+            component_digest.update(self._digest(member, number_of).encode())
+        component_digest = component_digest.hexdigest()
+
+        for member, number in numbers.items():
+            self.digests[member] = hashlib.sha256(f"{component_digest}#{number}".encode()).hexdigest()
+
+    def _inherited(self, xref, key):
+        while True:
+            kind, value = self.doc.xref_get_key(xref, key)
+            if kind != "null":
+                return value
+            kind, parent = self.doc.xref_get_key(xref, "Parent")
+            if kind != "xref":
+                return None
+            xref = int(parent.split()[0])
+
+    def _with_references_digested(self, value):
+        for reference in self._references(value):
+            self.of_xref(reference)
+        return self._with_digests(value)
+
+    def catalog_render_state(self):
+        if self._catalog_render_state is None:
+            catalog = self.doc.pdf_catalog()
+            digest = hashlib.sha256()
+            for key in CATALOG_RENDER_STATE:
+                kind, value = self.doc.xref_get_key(catalog, key)
+                if kind != "null":
+                    digest.update(f"/{key} {self._with_references_digested(value)}".encode())
+            self._catalog_render_state = digest.hexdigest()
+        return self._catalog_render_state
+
+    def of_page(self, page_number):
+        page = self.doc[page_number]
+        resources = self._with_references_digested(self._inherited(page.xref, "Resources") or "")
+
+        digest = hashlib.sha256()
+        digest.update(self.catalog_render_state().encode())
+        digest.update(repr((tuple(page.mediabox), tuple(page.cropbox), page.rotation)).encode())
+        digest.update(self.of_xref(page.xref).encode())
+        digest.update(resources.encode())
+        return digest.hexdigest()
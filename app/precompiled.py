@@ -1,37 +1,38 @@
 import base64
+import json
 import math
 import unicodedata
+import zipfile
+from functools import lru_cache, partial
 from io import BytesIO
 from itertools import groupby
 from operator import itemgetter
 
-import pymupdf
 import sentry_sdk
 from flask import Blueprint, current_app, jsonify, request, send_file
-from notifications_utils.pdf import is_letter_too_long, pdf_page_count
+from notifications_utils.pdf import is_letter_too_long
 from notifications_utils.recipient_validation.postal_address import PostalAddress
-from pdf2image import convert_from_bytes
 from pypdf import PdfReader, PdfWriter
 from pypdf.errors import PdfReadError
-from reportlab.lib.colors import Color, black, white
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import mm
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfgen import canvas
 
 from app import InvalidRequest, ValidationFailed, auth
-from app.embedded_fonts import contains_unembedded_fonts, embed_fonts
-from app.preview import png_from_pdf
+from app.embedded_fonts import embed_fonts, get_unembedded_fonts
+from app.page_memo import remember_results, remembered_invalid_pages, unchecked_pages
+from app.pdf_document import PYMUPDF, PYPDF, PdfDocument
+from app.preview import pngs_from_pdf
+from app.resource_limits import free_subprocess_slots, process_slot, subprocess_concurrency, subprocess_slot
+from app.sanitise_cache import SanitiseResult, cached_sanitise_result
 from app.transformation import (
     convert_pdf_to_cmyk,
-    does_pdf_contain_cmyk,
-    does_pdf_contain_rgb,
+    get_document_colour_spaces,
+    split_into_page_ranges,
 )
 
 A4_WIDTH = 210.0
 A4_HEIGHT = 297.0
 PT_TO_MM = 1.0 / 72 * 25.4
+# Points in a millimetre, as reportlab's `mm` is, without importing reportlab whenever the app starts
+mm = 72 / 25.4
 
 NOTIFY_TAG_FROM_TOP_OF_PAGE = 1.8
 NOTIFY_TAG_FROM_LEFT_OF_PAGE = 1.8
@@ -40,7 +41,9 @@ NOTIFY_TAG_BOUNDING_BOX_HEIGHT = 6.149
 NOTIFY_TAG_FONT_SIZE = 6
 NOTIFY_TAG_LINE_HEIGHT = NOTIFY_TAG_FONT_SIZE * PT_TO_MM
 NOTIFY_TAG_TEXT = "NOTIFY"
-NOTIFY_TAG_BOUNDING_BOX = pymupdf.Rect(
+# Bounding boxes are plain (x1, y1, x2, y2) tuples rather than pymupdf.Rect objects so that pymupdf isn't imported until
+# a PDF is actually being processed. pymupdf accepts them anywhere it accepts a rect.
+NOTIFY_TAG_BOUNDING_BOX = (
     # add on a margin to ensure we capture all text
     0,  # x1
     0,  # y1
@@ -74,7 +77,7 @@ ADDRESS_LEFT_FROM_LEFT_OF_PAGE = 24.60
 ADDRESS_RIGHT_FROM_LEFT_OF_PAGE = 120.0
 ADDRESS_TOP_FROM_TOP_OF_PAGE = 39.50
 ADDRESS_BOTTOM_FROM_TOP_OF_PAGE = 66.30
-ADDRESS_BOUNDING_BOX = pymupdf.Rect(
+ADDRESS_BOUNDING_BOX = (
     # add on a margin to ensure we capture all text
     (ADDRESS_LEFT_FROM_LEFT_OF_PAGE - 3) * mm,  # x1
     (ADDRESS_TOP_FROM_TOP_OF_PAGE - 3) * mm,  # y1
@@ -89,47 +92,56 @@ LOGO_BOTTOM_FROM_TOP_OF_PAGE = 30.00
 
 A4_HEIGHT_IN_PTS = A4_HEIGHT * mm
 
-MAX_FILESIZE = 2 * 1024 * 1024  # 2MB
-ALLOWED_FILESIZE_INFLATION_PERCENTAGE = 50  # warn if filesize after sanitising has grown by more than 50%
-
-precompiled_blueprint = Blueprint("precompiled_blueprint", __name__)
-
+# The colour of the red overlay, Color(100, 0, 0, alpha=0.2), as it comes out when rasterised
+RED_TRANSPARENT_RGBA = (255, 0, 0, 51)
 
-class NotifyCanvas(canvas.Canvas):
-    def __init__(self, colour):
-        self.packet = BytesIO()
-        super().__init__(self.packet, pagesize=A4)
-
-        self.setStrokeColor(colour)
-        self.setFillColor(colour)
-
-    def get_bytes(self):
-        self.save()
-        self.packet.seek(0)
-        return self.packet
+# The areas that letters can print in, as pairs of corners in mm from the top left of the page, made 1mm bigger on
+# every side (see `_overlay_printable_areas_with_white`)
+PRINTABLE_AREAS_OF_ADDRESS_PAGE = [
+    # Body
+    (
+        (BORDER_LEFT_FROM_LEFT_OF_PAGE - 1, BODY_TOP_FROM_TOP_OF_PAGE - 1),
+        (BORDER_RIGHT_FROM_LEFT_OF_PAGE + 1, BORDER_BOTTOM_FROM_TOP_OF_PAGE + 1),
+    ),
+    # Service address block - the writeable area on the right hand side (up to the top right corner)
+    (
+        (SERVICE_ADDRESS_LEFT_FROM_LEFT_OF_PAGE - 1, SERVICE_ADDRESS_TOP_FROM_TOP_OF_PAGE - 1),
+        (SERVICE_ADDRESS_RIGHT_FROM_LEFT_OF_PAGE + 1, SERVICE_ADDRESS_BOTTOM_FROM_TOP_OF_PAGE + 1),
+    ),
+    # Service Logo Block - the writeable area above the address (only as far across as the address extends)
+    (
+        (BORDER_LEFT_FROM_LEFT_OF_PAGE - 1, BORDER_TOP_FROM_TOP_OF_PAGE - 1),
+        (LOGO_RIGHT_FROM_LEFT_OF_PAGE + 1, LOGO_BOTTOM_FROM_TOP_OF_PAGE + 1),
+    ),
+    # Citizen Address Block - the address window
+    (
+        (ADDRESS_LEFT_FROM_LEFT_OF_PAGE - 1, ADDRESS_TOP_FROM_TOP_OF_PAGE - 1),
+        (ADDRESS_RIGHT_FROM_LEFT_OF_PAGE + 1, ADDRESS_BOTTOM_FROM_TOP_OF_PAGE + 1),
+    ),
+]
+PRINTABLE_AREAS_OF_PAGE = [
+    # Each page of content
+    (
+        (BORDER_LEFT_FROM_LEFT_OF_PAGE - 1, BORDER_TOP_FROM_TOP_OF_PAGE - 1),
+        (BORDER_RIGHT_FROM_LEFT_OF_PAGE + 1, BORDER_BOTTOM_FROM_TOP_OF_PAGE + 1),
+    ),
+]
 
-    def rect(self, pt1, pt2):
-        """
-        Draw a rectangle given two points that are two of the corners for it.
+# When validating in parallel, don't start a process for fewer pages than this, as it wouldn't save enough to cover the
+# cost of starting the process and reading the letter again
+PARALLEL_VALIDATION_MIN_PAGES_PER_PROCESS = 3
 
-        pt1 and pt2 are two-tuples of two values in mm! (As in, you haven't already done "MY_VAL * mm")
-        all values are from TOP LEFT of the page
+# When rasterising pages to check their boundaries with poppler, and RASTER_BOUNDS_CHECK_PAGES_AT_A_TIME isn't set,
+# don't hold more than this many pages in memory at once
+RASTER_BOUNDS_CHECK_MAX_PAGES_AT_A_TIME = 10
 
-        This function handles:
-        * conversion from mm to points
-        * conversion to bottom left coordinates
-        * just give two x coords and two y coords and it'll figure out which is left vs right side of the rectangle
-        """
-        left_x = min(pt1[0], pt2[0]) * mm
-        right_x = max(pt1[0], pt2[0]) * mm
-        top_y = min(pt1[1], pt2[1]) * mm
-        bottom_y = max(pt1[1], pt2[1]) * mm
+# The checks that validating pages does, in order, which name their results in the page memo (see app/page_memo.py)
+PAGE_CHECKS = ("content-outside-printable-area", "notify-tag-found-in-content")
 
-        bottom_y_from_bottom = A4_HEIGHT_IN_PTS - bottom_y
+MAX_FILESIZE = 2 * 1024 * 1024  # 2MB
+ALLOWED_FILESIZE_INFLATION_PERCENTAGE = 50  # warn if filesize after sanitising has grown by more than 50%
 
-        width = right_x - left_x
-        height = bottom_y - top_y
-        super().rect(left_x, bottom_y_from_bottom, width, height, fill=True, stroke=False)
+precompiled_blueprint = Blueprint("precompiled_blueprint", __name__)
 
 
 class PrecompiledPostalAddress(PostalAddress):
@@ -169,6 +181,13 @@ class PrecompiledPostalAddress(PostalAddress):
 @precompiled_blueprint.route("/precompiled/sanitise", methods=["POST"])
 @auth.login_required
 def sanitise_precompiled_letter():
+    """
+    Returns the result of `sanitise_letter` as json, with the sanitised pdf base64 encoded in `file`.
+
+    With `?raw_file=true`, a letter that passes is returned as the pdf itself instead, with the rest of the result as
+    json in the X-Sanitise-Result header, so that big letters don't need encoding and decoding. Letters that fail
+    don't have a file, so they're returned as json either way.
+    """
     encoded_string = request.get_data()
     allow_international_letters = request.args.get("allow_international_letters") == "true"
 
@@ -177,15 +196,23 @@ def sanitise_precompiled_letter():
 
     is_an_attachment = request.args.get("is_an_attachment") == "true"
 
-    sanitise_json = sanitise_file_contents(
+    result = sanitise_letter(
         encoded_string,
         allow_international_letters=allow_international_letters,
         filename=request.args.get("upload_id"),
         is_an_attachment=is_an_attachment,
     )
-    status_code = 400 if sanitise_json.get("message") else 200
+    status_code = 400 if result.message else 200
+
+    if status_code != 200 or request.args.get("raw_file") != "true":
+        return jsonify(_sanitise_result_json(result)), status_code
 
-    return jsonify(sanitise_json), status_code
+    response = send_file(path_or_file=BytesIO(result.file), mimetype="application/pdf")
+    # json escapes the newlines in the address and anything that isn't ascii, so it's safe to use as a header
+    response.headers["X-Sanitise-Result"] = json.dumps(
+        {key: value for key, value in result._asdict().items() if key != "file"}
+    )
+    return response
 
 
 def _warn_if_filesize_has_grown(*, orig_filesize: int, new_filesize: int, filename: str) -> None:
@@ -230,49 +257,100 @@ def _warn_if_filesize_has_grown(*, orig_filesize: int, new_filesize: int, filena
         )
 
 
-def sanitise_file_contents(encoded_string, *, allow_international_letters, filename, is_an_attachment=False):
+def _sanitise_result_json(result):
+    return {
+        **result._asdict(),
+        "file": base64.b64encode(result.file).decode("utf-8") if result.file is not None else None,
+    }
+
+
+def sanitise_letter(pdf_data, *, allow_international_letters, filename, is_an_attachment=False) -> SanitiseResult:
     """
     Given a PDF, returns a new PDF that has been sanitised and dvla approved 👍
 
     * makes sure letter meets DVLA's printable boundaries and page dimensions requirements
     * re-writes address block (to ensure it's in arial in the right location)
     * adds NOTIFY tag if not present
+
+    The sanitised PDF is returned as bytes in the result's `file`, for tasks that upload it straight to S3.
+
+    Results are cached on the input and flags (see app/sanitise_cache.py), so sanitising the same letter again, for
+    example when a task is retried, returns the same result without doing the work again.
     """
     try:
-        file_data = BytesIO(encoded_string)
+        return cached_sanitise_result(
+            pdf_data,
+            allow_international_letters=allow_international_letters,
+            is_an_attachment=is_an_attachment,
+            filename=filename,
+            sanitise=lambda: _sanitise_letter(
+                pdf_data,
+                allow_international_letters=allow_international_letters,
+                filename=filename,
+                is_an_attachment=is_an_attachment,
+            ),
+        )
+    # Anything else is probably a bug but usually infrequent, so pretend it's invalid. These results aren't cached, in
+    # case it doesn't happen next time.
+    except Exception as error:
+        current_app.logger.exception(
+            "Unexpected exception for precompiled pdf: %s for file name: %s",
+            repr(error),
+            filename,
+            extra={"file_name": filename},
+        )
+
+        return SanitiseResult(
+            page_count=None,
+            recipient_address=None,
+            message="unable-to-read-the-file",
+            invalid_pages=None,
+            file=None,
+        )
+
+
+def _sanitise_letter(encoded_string, *, allow_international_letters, filename, is_an_attachment):
+    try:
+        # every stage shares this, so the PDF is only parsed and written out again when it needs to be
+        document = PdfDocument(encoded_string)
 
-        page_count = pdf_page_count(file_data)
+        page_count = document.page_count
         if is_letter_too_long(page_count):
             message = "letter-too-long"
             raise ValidationFailed(message, page_count=page_count)
 
-        message, invalid_pages = get_invalid_pages_with_message(file_data, is_an_attachment=is_an_attachment)
+        # Checks stop at the first that fails, in order of precedence, which is also roughly cheapest first: page count,
+        # page sizes, content outside the printable area, notify tags and then the address (in `rewrite_pdf`, before
+        # anything is converted). Content outside the printable area takes precedence over the address, so pages that
+        # need rasterising to check it have to be rasterised even if the address is invalid, but most pages can be
+        # checked from their geometry instead (see `_get_pages_with_content_outside_printable_area`)
+        message, invalid_pages = get_invalid_pages_with_message(document, is_an_attachment=is_an_attachment)
         if message:
             raise ValidationFailed(message, invalid_pages, page_count=page_count)
 
         if is_an_attachment:
-            file_data = normalise_fonts_and_colours(file_data, filename)
+            document = normalise_fonts_and_colours(document, filename)
             recipient_address = None
         else:
-            file_data, recipient_address = rewrite_pdf(
-                file_data,
+            document, recipient_address = rewrite_pdf(
+                document,
                 page_count=page_count,
                 allow_international_letters=allow_international_letters,
                 filename=filename,
             )
 
-        raw_file = file_data.read()
+        raw_file = document.data
 
         _warn_if_filesize_has_grown(orig_filesize=len(encoded_string), new_filesize=len(raw_file), filename=filename)
 
-        return {
-            "recipient_address": recipient_address,
-            "page_count": page_count,
-            "message": None,
-            "invalid_pages": None,
-            "file": base64.b64encode(raw_file).decode("utf-8"),
-        }
-    # PdfReadError usually happens at pdf_page_count, when we first try to read the PDF.
+        return SanitiseResult(
+            recipient_address=recipient_address,
+            page_count=page_count,
+            message=None,
+            invalid_pages=None,
+            file=raw_file,
+        )
+    # PdfReadError usually happens at document.page_count, when we first try to read the PDF.
     except (ValidationFailed, PdfReadError) as error:
         current_app.logger.warning(
             "Validation failed for precompiled pdf: %s for file name: %s",
@@ -282,73 +360,76 @@ def sanitise_file_contents(encoded_string, *, allow_international_letters, filen
             extra={"file_name": filename},
         )
 
-        return {
-            "page_count": getattr(error, "page_count", None),
-            "recipient_address": None,
-            "message": getattr(error, "message", "unable-to-read-the-file"),
-            "invalid_pages": getattr(error, "invalid_pages", None),
-            "file": None,
-        }
-    # Anything else is probably a bug but usually infrequent, so pretend it's invalid.
-    except Exception as error:
-        current_app.logger.exception(
-            "Unexpected exception for precompiled pdf: %s for file name: %s",
-            repr(error),
-            filename,
-            extra={"file_name": filename},
+        return SanitiseResult(
+            page_count=getattr(error, "page_count", None),
+            recipient_address=None,
+            message=getattr(error, "message", "unable-to-read-the-file"),
+            invalid_pages=getattr(error, "invalid_pages", None),
+            file=None,
         )
 
-        return {
-            "page_count": None,
-            "recipient_address": None,
-            "message": "unable-to-read-the-file",
-            "invalid_pages": None,
-            "file": None,
-        }
-
 
-def rewrite_pdf(file_data, *, page_count, allow_international_letters, filename):
-    log_metadata_for_letter(file_data, filename)
+def rewrite_pdf(pdf, *, page_count, allow_international_letters, filename):
+    document = PdfDocument.of(pdf)
+    log_metadata_for_letter(document, filename)
 
-    file_data, recipient_address = rewrite_address_block(
-        file_data,
+    document, recipient_address = rewrite_address_block(
+        document,
         page_count=page_count,
         allow_international_letters=allow_international_letters,
         filename=filename,
     )
 
-    file_data = normalise_fonts_and_colours(file_data, filename)
+    document = normalise_fonts_and_colours(document, filename)
 
     # during switchover, DWP and CYSP will still be sending the notify tag. Only add it if it's not already there
-    if not is_notify_tag_present(file_data):
+    if not is_notify_tag_present(document):
         current_app.logger.info("PDF does not contain Notify tag, adding one.", extra={"file_name": filename})
-        file_data = add_notify_tag_to_letter(file_data)
+        document = add_notify_tag_to_letter(document)
     else:
         current_app.logger.info("PDF already contains Notify tag (%s).", filename, extra={"file_name": filename})
 
-    return file_data, recipient_address
+    return document, recipient_address
 
 
 @sentry_sdk.trace
-def normalise_fonts_and_colours(file_data, filename):
-    if not does_pdf_contain_cmyk(file_data):
+def normalise_fonts_and_colours(pdf, filename):
+    """
+    :param pdf: a PdfDocument, or a file-like object containing the pdf
+    :return PdfDocument: the same document if nothing needed changing, otherwise Ghostscript's output
+    """
+    document = PdfDocument.of(pdf)
+
+    # Work out everything Ghostscript needs to do before running it, so that a PDF that needs converting to CMYK and
+    # has fonts to embed is only rewritten once
+    colour_spaces = get_document_colour_spaces(document.pymupdf_document)
+
+    needs_cmyk_conversion = False
+    if "CMYK" not in colour_spaces:
         current_app.logger.info("PDF does not contain CMYK data, converting to CMYK.", extra={"file_name": filename})
-        file_data = convert_pdf_to_cmyk(file_data)
+        needs_cmyk_conversion = True
 
-    elif does_pdf_contain_rgb(file_data):
+    elif "RGB" in colour_spaces:
         current_app.logger.info("PDF contains RGB data, converting to CMYK.", extra={"file_name": filename})
-        file_data = convert_pdf_to_cmyk(file_data)
+        needs_cmyk_conversion = True
 
-    if unembedded := contains_unembedded_fonts(file_data, filename):
+    if unembedded := get_unembedded_fonts(document.reader, filename):
         unembedded_concat = ", ".join(sorted(unembedded))
         current_app.logger.info(
             "PDF contains unembedded fonts: %s",
             unembedded_concat,
             extra={"file_name": filename, "unembedded_fonts": unembedded_concat},
         )
-        file_data = embed_fonts(file_data)
 
-    return file_data
+    if needs_cmyk_conversion:
+        # Ghostscript leaves the standard 14 fonts unembedded by default, so embed all fonts in the same pass rather
+        # than checking its output and running Ghostscript again
+        return PdfDocument.of(convert_pdf_to_cmyk(document.file(), embed_all_fonts=True))
+
+    if unembedded:
+        return PdfDocument.of(embed_fonts(document.file()))
+
+    return document
 
 
 @precompiled_blueprint.route("/precompiled/overlay.png", methods=["POST"])
@@ -378,15 +459,54 @@ def overlay_template_png_for_page():
         raise InvalidRequest(f"page_number or is_first_page must be specified in request params {request.args}")
 
     return send_file(
-        path_or_file=png_from_pdf(
-            _colour_no_print_areas_of_single_page_pdf_in_red(file_data, is_first_page=is_first_page),
-            # the pdf is only one page, so this is always 1.
-            page_number=1,
-        ),
+        path_or_file=_png_with_no_print_areas_in_red(file_data, is_first_page=is_first_page),
         mimetype="image/png",
     )
 
 
+@precompiled_blueprint.route("/precompiled/overlay-pages.zip", methods=["POST"])
+@auth.login_required
+def overlay_template_pngs_for_pages():
+    """
+    The admin app can call this once with a whole PDF, instead of calling overlay.png for each page, to get pngs of
+    every page to show on the front end. Returns a zip file containing `1.png`, `2.png` and so on.
+
+    The pages are rasterised in one go, and cached the same way overlay.png caches them, so later calls to either
+    endpoint with the same pages don't rasterise them again.
+    """
+    encoded_string = request.get_data()
+
+    if not encoded_string:
+        raise InvalidRequest("no data received in POST")
+
+    is_an_attachment = request.args.get("is_an_attachment", "").lower() == "true"
+
+    document = PdfDocument(encoded_string)
+    try:
+        pages = document.reader.pages
+        page_count = len(pages)
+    except PdfReadError as e:
+        raise InvalidRequest(f"Unable to read the PDF data: {e}") from e
+
+    # every page is held in memory at once
+    if is_letter_too_long(page_count):
+        raise InvalidRequest(f"Too many pages to overlay at once ({page_count})")
+
+    page_numbers = range(1, page_count + 1)
+    pngs = _unmodified_page_pngs(document, page_numbers)
+
+    output = BytesIO()
+    # pngs are already compressed
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_STORED) as zip_file:
+        for page_number in page_numbers:
+            is_first_page = page_number == 1 and not is_an_attachment
+            png = _colour_png_in_red(pngs[page_number], pages[page_number - 1], is_first_page)
+            zip_file.writestr(f"{page_number}.png", png.getvalue())
+    output.seek(0)
+
+    return send_file(path_or_file=output, mimetype="application/zip")
+
+
 @precompiled_blueprint.route("/precompiled/overlay.pdf", methods=["POST"])
 @auth.login_required
 def overlay_template_pdf():
@@ -404,12 +524,10 @@ def overlay_template_pdf():
     if request.args:
         raise InvalidRequest(f"Did not expect any args but received {request.args}. Did you mean to call overlay.png?")
 
-    pdf = PdfReader(BytesIO(encoded_string))
-
-    for i in range(len(pdf.pages)):
-        _colour_no_print_areas_of_page_in_red(pdf.pages[i], is_first_page=(i == 0))
-
-    return send_file(path_or_file=bytesio_from_pdf(pdf), mimetype="application/pdf")
+    return send_file(
+        path_or_file=_colour_no_print_areas_of_pdf_in_red(BytesIO(encoded_string)),
+        mimetype="application/pdf",
+    )
 
 
 def log_metadata_for_letter(src_pdf, filename):
@@ -420,8 +538,7 @@ def log_metadata_for_letter(src_pdf, filename):
     produce an examplar version using the same method.
     """
 
-    pdf = PdfReader(src_pdf)
-    info = pdf.metadata
+    info = PdfDocument.of(src_pdf).reader.metadata
 
     if not info:
         current_app.logger.info(
@@ -440,11 +557,17 @@ def add_notify_tag_to_letter(src_pdf):
     """
     Adds the word 'NOTIFY' to the first page of the PDF
 
-    :param PdfReader src_pdf: A File object or an object that supports the standard read and seek methods
+    :param src_pdf: A PdfDocument, or a File object or an object that supports the standard read and seek methods
+    :return PdfDocument: the document, changed
     """
+    from reportlab.lib.colors import white
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
 
-    pdf = PdfReader(src_pdf)
-    page = pdf.pages[0]
+    from app.canvas import NotifyCanvas
+
+    document = PdfDocument.of(src_pdf)
+    page = document.reader.pages[0]
     can = NotifyCanvas(white)
     pdfmetrics.registerFont(TTFont(FONT, TRUE_TYPE_FONT_FILE))
     can.setFont(FONT, NOTIFY_TAG_FONT_SIZE)
@@ -460,27 +583,28 @@ def add_notify_tag_to_letter(src_pdf):
 
     can.drawString(x, y, NOTIFY_TAG_TEXT)
 
-    # move to the beginning of the StringIO buffer
-    notify_tag_pdf = PdfReader(can.get_bytes())
-
-    notify_tag_page = notify_tag_pdf.pages[0]
-    page.merge_page(notify_tag_page)
-
-    return bytesio_from_pdf(pdf)
+    return overlay_first_page_of_pdf_with_new_content(document, can.get_bytes())
 
 
 @sentry_sdk.trace
 def get_invalid_pages_with_message(src_pdf, is_an_attachment=False):
-    invalid_pages = _get_pages_with_invalid_orientation_or_size(src_pdf)
+    document = PdfDocument.of(src_pdf)
+
+    invalid_pages = _get_pages_with_invalid_orientation_or_size(document)
     if len(invalid_pages) > 0:
         return "letter-not-a4-portrait-oriented", invalid_pages
 
-    pdf_to_validate = _overlay_printable_areas_with_white(src_pdf, is_an_attachment=is_an_attachment)
-    invalid_pages = list(_get_out_of_bounds_pages(pdf_to_validate))
-    if len(invalid_pages) > 0:
-        return "content-outside-printable-area", invalid_pages
+    if page_ranges := _get_page_ranges_for_parallel_validation(document, is_an_attachment):
+        pages_outside_printable_area, pages_with_notify_tag = _validate_page_ranges_in_parallel(
+            document, page_ranges, is_an_attachment
+        )
+    else:
+        pages_outside_printable_area, pages_with_notify_tag = _validate_pages(document, is_an_attachment)
 
-    invalid_pages = _get_pages_with_notify_tag(pdf_to_validate, is_an_attachment=is_an_attachment)
+    if len(pages_outside_printable_area) > 0:
+        return "content-outside-printable-area", pages_outside_printable_area
+
+    invalid_pages = pages_with_notify_tag
     if len(invalid_pages) > 0:
         # we really dont expect to see many of these so lets log
         invalid_pages_concat = ", ".join(str(p) for p in sorted(invalid_pages))
@@ -494,6 +618,148 @@ def get_invalid_pages_with_message(src_pdf, is_an_attachment=False):
     return "", []
 
 
+def _get_page_ranges_for_parallel_validation(document, is_an_attachment):
+    """
+    If parallel validation is switched on (PARALLEL_VALIDATION_MIN_PAGES), the letter has enough pages that we haven't
+    checked before and there are enough free subprocess slots, returns the 1-indexed, inclusive page ranges to
+    validate in separate processes. Otherwise returns None.
+    """
+    min_pages = current_app.config["PARALLEL_VALIDATION_MIN_PAGES"]
+    if not min_pages or document.page_count < min_pages:
+        return None
+
+    # pages that are in the page memo are quicker to look up here than to check again in another process
+    page_numbers = range(1, document.page_count + 1)
+    if len(unchecked_pages(document, page_numbers, checks=PAGE_CHECKS, is_an_attachment=is_an_attachment)) < min_pages:
+        return None
+
+    # each process takes a slot of its own, so only start as many as there are slots free for right now
+    range_count = min(free_subprocess_slots(), document.page_count // PARALLEL_VALIDATION_MIN_PAGES_PER_PROCESS)
+    if range_count < 2:
+        return None
+
+    return split_into_page_ranges(document.page_count, range_count)
+
+
+def _validate_page_ranges_in_parallel(document, page_ranges, is_an_attachment):
+    """
+    Checks each range of pages for content outside the printable areas and notify tags in a process of its own.
+
+    :return tuple: the pages with content outside the printable area, and the pages with notify tags, in order. Pages
+        with notify tags aren't looked for in ranges that have content outside the printable area.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    current_app.logger.info(
+        "Validating %s pages in %s parallel processes",
+        document.page_count,
+        len(page_ranges),
+        extra={"page_count": document.page_count, "process_count": len(page_ranges)},
+    )
+
+    # gunicorn workers are threaded (or eventlet) and celery children may have threads of their own, and forking a
+    # process with threads can leave the child waiting on a lock that one of the other threads held. A forkserver is
+    # started without any, and forks the validation processes for us with this module already imported.
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["app.precompiled"])
+
+    with ProcessPoolExecutor(
+        max_workers=len(page_ranges),
+        mp_context=context,
+        initializer=_init_validation_process,
+        initargs=(dict(current_app.config),),
+    ) as executor:
+        futures = [
+            executor.submit(_validate_page_range, document.data, page_range, is_an_attachment)
+            for page_range in page_ranges
+        ]
+        results = [future.result() for future in futures]
+
+    # the validation processes don't outlive the letter, so the results are remembered here for the next one
+    invalid_pages = {check: [] for check in PAGE_CHECKS}
+    for range_results in results:
+        for check, page_results in range_results.items():
+            remember_results(document, page_results, check=check, is_an_attachment=is_an_attachment)
+            invalid_pages[check] += [page_number for page_number, is_invalid in page_results.items() if is_invalid]
+
+    return tuple(invalid_pages[check] for check in PAGE_CHECKS)
+
+
+def _init_validation_process(config):
+    """
+    Runs at the start of each validation process, which doesn't have the app that started it, so gives it one with the
+    same config that the validation can log to.
+    """
+    from flask import Flask
+    from notifications_utils.logging import flask as utils_logging
+
+    from app import configure_global_logging
+
+    app = Flask("app")
+    # the process is only used for one letter, so the app that started it remembers the results instead
+    app.config.update(config, PAGE_VALIDATION_MEMO_SIZE=0)
+    utils_logging.init_app(app)
+    configure_global_logging(app)
+    app.app_context().push()
+
+
+def _validate_page_range(pdf_data, page_range, is_an_attachment):
+    """
+    Runs in a validation process (see `_validate_page_ranges_in_parallel`), holding a subprocess slot, as it's as much
+    work for the container as any subprocess we start
+
+    :return dict: for each check in `PAGE_CHECKS` that was done, whether each page failed it. Pages with notify tags
+        aren't looked for if any page has content outside the printable area.
+    """
+    first_page, last_page = page_range
+    page_numbers = range(first_page, last_page + 1)
+    with process_slot():
+        pages_outside_printable_area, pages_with_notify_tag = _validate_pages(
+            PdfDocument(pdf_data), is_an_attachment, page_numbers=page_numbers
+        )
+
+    checked = {"content-outside-printable-area": pages_outside_printable_area}
+    if not pages_outside_printable_area:
+        checked["notify-tag-found-in-content"] = pages_with_notify_tag
+
+    return {
+        check: {page_number: page_number in invalid_pages for page_number in page_numbers}
+        for check, invalid_pages in checked.items()
+    }
+
+
+def _validate_pages(document, is_an_attachment, page_numbers=None):
+    """
+    :return tuple: the pages with content outside the printable area, and the pages with notify tags. Pages with notify
+        tags are only looked for if there's no content outside the printable area.
+    """
+    page_numbers = list(range(1, document.page_count + 1) if page_numbers is None else page_numbers)
+
+    pages_outside_printable_area = remembered_invalid_pages(
+        document,
+        page_numbers,
+        check="content-outside-printable-area",
+        is_an_attachment=is_an_attachment,
+        find_invalid_pages=lambda pages: _get_pages_with_content_outside_printable_area(
+            document, is_an_attachment=is_an_attachment, page_numbers=pages
+        ),
+    )
+    if pages_outside_printable_area:
+        return pages_outside_printable_area, []
+
+    # Look for notify tags in the document itself, which we'll want to read the address from later anyway
+    return [], remembered_invalid_pages(
+        document,
+        page_numbers,
+        check="notify-tag-found-in-content",
+        is_an_attachment=is_an_attachment,
+        find_invalid_pages=lambda pages: _get_pages_with_notify_tag(
+            document, is_an_attachment=is_an_attachment, page_numbers=pages
+        ),
+    )
+
+
 def _is_page_A4_portrait(page_height, page_width, rotation):
     if math.isclose(page_height, A4_HEIGHT, abs_tol=2) and math.isclose(page_width, 210, abs_tol=2):
         if rotation in [0, 180, None]:
@@ -505,14 +771,10 @@ def _is_page_A4_portrait(page_height, page_width, rotation):
 
 
 def _get_pages_with_invalid_orientation_or_size(src_pdf):
-    pdf = PdfReader(src_pdf)
     invalid_pages = []
-    for page_num in range(len(pdf.pages)):
-        page = pdf.pages[page_num]
-
-        page_height = float(page.mediabox.height) / mm
-        page_width = float(page.mediabox.width) / mm
-        rotation = page.get("/Rotate")
+    for page_num, (mediabox, rotation) in enumerate(PdfDocument.of(src_pdf).page_boxes()):
+        page_height = float(mediabox.height) / mm
+        page_width = float(mediabox.width) / mm
 
         if not _is_page_A4_portrait(page_height, page_width, rotation):
             invalid_pages.append(page_num + 1)
@@ -550,12 +812,12 @@ def _overlay_printable_areas_with_white(src_pdf, is_an_attachment=False):
     For letter attachments, there is no address page, so we overlay all pages like we would subsequent pages
     of a full letter.
 
-    :param BytesIO src_pdf: A file-like
+    :param src_pdf: A PdfDocument or a file-like. It isn't changed.
     :param Boolean is_an_attachment: a parameter that informs if the file-like is a full letter or a letter attachment
     :return BytesIO: New file like containing the overlaid pdf
     """
-
-    pdf = PdfReader(src_pdf)
+    # The overlays are merged into the pages, so they need a copy of their own rather than the document's reader
+    pdf = PdfReader(PdfDocument.of(src_pdf).file())
     page_number = 0
 
     if not is_an_attachment:
@@ -564,75 +826,192 @@ def _overlay_printable_areas_with_white(src_pdf, is_an_attachment=False):
 
     # For each subsequent page its just the body of text
     for page_num in range(page_number, len(pdf.pages)):
-        page = pdf.pages[page_num]
+        pdf.pages[page_num].merge_page(_white_overlay(is_first_page=False))
+
+    return bytesio_from_pdf(pdf)
+
+
+def _overlay_printable_areas_of_address_block_page_with_white(pdf):
+    pdf.pages[0].merge_page(_white_overlay(is_first_page=True))
 
-        can = NotifyCanvas(white)
 
-        # Each page of content
-        pt1 = BORDER_LEFT_FROM_LEFT_OF_PAGE - 1, BORDER_TOP_FROM_TOP_OF_PAGE - 1
-        pt2 = BORDER_RIGHT_FROM_LEFT_OF_PAGE + 1, BORDER_BOTTOM_FROM_TOP_OF_PAGE + 1
+def _overlay_page(colour, areas):
+    """
+    Draws an A4 page with `areas` filled in `colour`, to merge onto other pages.
+
+    The page is copied into a PdfWriter, so that everything it's made of is read into memory and it can be merged onto
+    any number of pages without being changed or read again.
+
+    :param list areas: pairs of opposite corners, in mm from the top left of the page (see `NotifyCanvas.rect`)
+    :return PageObject: the page
+    """
+    from app.canvas import NotifyCanvas
+
+    can = NotifyCanvas(colour)
+    for pt1, pt2 in areas:
         can.rect(pt1, pt2)
 
-        # move to the beginning of the StringIO buffer
-        new_pdf = PdfReader(can.get_bytes())
+    return PdfWriter().add_page(PdfReader(can.get_bytes()).pages[0])
 
-        page.merge_page(new_pdf.pages[0])
 
-    out = bytesio_from_pdf(pdf)
-    # it's a good habit to put things back exactly the way we found them
-    src_pdf.seek(0)
+# The overlays are the same for every page of every letter, so each is only drawn once per process
+@lru_cache
+def _white_overlay(is_first_page):
+    """
+    The printable areas in white. The first page is more varied because of address blocks etc, subsequent pages are
+    more simple.
+    """
+    from reportlab.lib.colors import white
 
-    return out
+    return _overlay_page(white, PRINTABLE_AREAS_OF_ADDRESS_PAGE if is_first_page else PRINTABLE_AREAS_OF_PAGE)
 
 
-def _overlay_printable_areas_of_address_block_page_with_white(pdf):
-    page = pdf.pages[0]
-    can = NotifyCanvas(white)
+def _no_print_areas(is_first_page):
+    """
+    The areas where the service can't print as per the template, as pairs of opposite corners in mm from the top left
+    of the page. If `is_first_page` is set, this includes the areas around the address block too.
+    """
+    # Each page of content
+    areas = [
+        # left margin:
+        ((0, 0), (BORDER_LEFT_FROM_LEFT_OF_PAGE, A4_HEIGHT)),
+        # top margin:
+        ((BORDER_LEFT_FROM_LEFT_OF_PAGE, 0), (BORDER_RIGHT_FROM_LEFT_OF_PAGE, BORDER_TOP_FROM_TOP_OF_PAGE)),
+        # right margin:
+        ((BORDER_RIGHT_FROM_LEFT_OF_PAGE, 0), (A4_WIDTH, A4_HEIGHT)),
+        # bottom margin:
+        ((BORDER_LEFT_FROM_LEFT_OF_PAGE, BORDER_BOTTOM_FROM_TOP_OF_PAGE), (BORDER_RIGHT_FROM_LEFT_OF_PAGE, A4_HEIGHT)),
+    ]
 
-    # Overlay the blanks where the service can print as per the template
     # The first page is more varied because of address blocks etc subsequent pages are more simple
+    if is_first_page:
+        areas += [
+            # left from address block (from logo area all the way to body)
+            (
+                (BORDER_LEFT_FROM_LEFT_OF_PAGE, LOGO_BOTTOM_FROM_TOP_OF_PAGE),
+                (ADDRESS_LEFT_FROM_LEFT_OF_PAGE, BODY_TOP_FROM_TOP_OF_PAGE),
+            ),
+            # directly above address block
+            (
+                (ADDRESS_LEFT_FROM_LEFT_OF_PAGE, LOGO_BOTTOM_FROM_TOP_OF_PAGE),
+                (ADDRESS_RIGHT_FROM_LEFT_OF_PAGE, ADDRESS_TOP_FROM_TOP_OF_PAGE),
+            ),
+            # right from address block (from logo area all the way to body)
+            (
+                (ADDRESS_RIGHT_FROM_LEFT_OF_PAGE, LOGO_BOTTOM_FROM_TOP_OF_PAGE),
+                (SERVICE_ADDRESS_LEFT_FROM_LEFT_OF_PAGE, BODY_TOP_FROM_TOP_OF_PAGE),
+            ),
+            # below address block
+            (
+                (ADDRESS_LEFT_FROM_LEFT_OF_PAGE, ADDRESS_BOTTOM_FROM_TOP_OF_PAGE),
+                (ADDRESS_RIGHT_FROM_LEFT_OF_PAGE, BODY_TOP_FROM_TOP_OF_PAGE),
+            ),
+        ]
 
-    # Body
-    pt1 = BORDER_LEFT_FROM_LEFT_OF_PAGE - 1, BODY_TOP_FROM_TOP_OF_PAGE - 1
-    pt2 = BORDER_RIGHT_FROM_LEFT_OF_PAGE + 1, BORDER_BOTTOM_FROM_TOP_OF_PAGE + 1
-    can.rect(pt1, pt2)
-
-    # Service address block - the writeable area on the right hand side (up to the top right corner)
-    pt1 = (
-        SERVICE_ADDRESS_LEFT_FROM_LEFT_OF_PAGE - 1,
-        SERVICE_ADDRESS_TOP_FROM_TOP_OF_PAGE - 1,
-    )
-    pt2 = (
-        SERVICE_ADDRESS_RIGHT_FROM_LEFT_OF_PAGE + 1,
-        SERVICE_ADDRESS_BOTTOM_FROM_TOP_OF_PAGE + 1,
-    )
-    can.rect(pt1, pt2)
+    return areas
 
-    # Service Logo Block - the writeable area above the address (only as far across as the address extends)
-    pt1 = BORDER_LEFT_FROM_LEFT_OF_PAGE - 1, BORDER_TOP_FROM_TOP_OF_PAGE - 1
-    pt2 = LOGO_RIGHT_FROM_LEFT_OF_PAGE + 1, LOGO_BOTTOM_FROM_TOP_OF_PAGE + 1
-    can.rect(pt1, pt2)
 
-    # Citizen Address Block - the address window
-    pt1 = ADDRESS_LEFT_FROM_LEFT_OF_PAGE - 1, ADDRESS_TOP_FROM_TOP_OF_PAGE - 1
-    pt2 = ADDRESS_RIGHT_FROM_LEFT_OF_PAGE + 1, ADDRESS_BOTTOM_FROM_TOP_OF_PAGE + 1
-    can.rect(pt1, pt2)
+@lru_cache
+def _red_overlay(is_first_page):
+    """
+    The areas where the service can't print (see `_no_print_areas`), in transparent red.
+    """
+    from reportlab.lib.colors import Color
 
-    # move to the beginning of the StringIO buffer
-    new_pdf = PdfReader(can.get_bytes())
+    red_transparent = Color(100, 0, 0, alpha=0.2)
 
-    page.merge_page(new_pdf.pages[0])
+    return _overlay_page(red_transparent, _no_print_areas(is_first_page))
 
 
-def _colour_no_print_areas_of_single_page_pdf_in_red(src_pdf, is_first_page):
+@lru_cache(maxsize=16)
+def _red_mask(is_first_page, size, mediabox, rotation):
+    """
+    The areas where the service can't print (see `_no_print_areas`), in transparent red, as an image to composite
+    over a page rasterised to `size`. It covers the same pixels as `_red_overlay` would if it was merged onto the page
+    before rasterising.
+
+    :param tuple size: the width and height of the rasterised page, in pixels
+    :param tuple mediabox: the page's media box (left, bottom, right, top), in points
+    :param int rotation: the page's /Rotate, in degrees clockwise
+    :return Image: an RGBA image
+    """
+    from PIL import Image, ImageDraw
+
+    rotation %= 360
+    # the overlay is drawn on the page before it's rotated
+    width, height = reversed(size) if rotation in (90, 270) else size
+    left, bottom, right, top = mediabox
+    x_scale = width / (right - left)
+    y_scale = height / (top - bottom)
+
+    mask = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(mask)
+    for pt1, pt2 in _no_print_areas(is_first_page):
+        # the overlays are drawn from the bottom left of the page, as if it was A4 (see `NotifyCanvas.rect`)
+        x0 = round((min(pt1[0], pt2[0]) * mm - left) * x_scale)
+        x1 = round((max(pt1[0], pt2[0]) * mm - left) * x_scale)
+        y0 = round((top - (A4_HEIGHT_IN_PTS - min(pt1[1], pt2[1]) * mm)) * y_scale)
+        y1 = round((top - (A4_HEIGHT_IN_PTS - max(pt1[1], pt2[1]) * mm)) * y_scale)
+        if x0 < x1 and y0 < y1:
+            draw.rectangle((x0, y0, x1 - 1, y1 - 1), fill=RED_TRANSPARENT_RGBA)
+
+    # Pillow rotates anticlockwise
+    return mask.rotate(-rotation, expand=True)
+
+
+def _colour_png_in_red(png, page, is_first_page):
     """
-    Overlays the non-printable areas onto the src PDF, this is so users know which parts of they letter fail validation.
-    This function expects that src_pdf only represents a single page. It adds red areas (if `is_first_page` is set, then
-    it'll add red areas around the address window too) and returns a single page pdf.
+    Composites the non-printable areas, in red, over a rasterised page.
 
-    :param BytesIO src_pdf: A file-like representing a single page pdf
+    :param BytesIO png: the page, rasterised as it is
+    :param PageObject page: the page
     :param bool is_first_page: true if we should overlay the address block red area too.
+    :return BytesIO: New file-like containing the png
     """
+    from PIL import Image
+
+    with Image.open(png) as image:
+        mediabox = tuple(float(value) for value in page.mediabox)
+        red = _red_mask(is_first_page, image.size, mediabox, page.rotation)
+        coloured = Image.alpha_composite(image.convert("RGBA"), red).convert("RGB")
+
+    output = BytesIO()
+    coloured.save(output, format="png")
+    output.seek(0)
+    return output
+
+
+def _unmodified_page_pngs(document, page_numbers):
+    """
+    Rasterises pages of a pdf as they are. Each page is cached on its fingerprint (see `PdfDocument.page_fingerprint`),
+    so a page is only rasterised once, whether it's sent to us on its own or with the rest of its letter. Pages that
+    aren't cached are rasterised together, in one pass over the pdf.
+
+    :param PdfDocument document: the pdf
+    :param list page_numbers: one-indexed
+    :return dict: a file-like containing a png for each page number
+    """
+    rasterised = []
+
+    def rasterise(page_number):
+        if not rasterised:
+            rasterised.extend(pngs_from_pdf(document.data))
+            # ImageMagick gives one image per page it could render, so pages could be out of step with the pdf's
+            if len(rasterised) != document.page_count:
+                raise InvalidRequest(
+                    f"Unable to rasterise the PDF: got {len(rasterised)} images for {document.page_count} pages"
+                )
+        return rasterised[page_number - 1]
+
+    return {
+        page_number: current_app.cache(
+            document.page_fingerprint(page_number - 1), folder="precompiled-pngs", extension="png"
+        )(partial(rasterise, page_number))()
+        for page_number in page_numbers
+    }
+
+
+def _read_single_page_pdf(src_pdf):
     try:
         pdf = PdfReader(src_pdf)
     except PdfReadError as e:
@@ -641,90 +1020,291 @@ def _colour_no_print_areas_of_single_page_pdf_in_red(src_pdf, is_first_page):
     if len(pdf.pages) != 1:
         # this function is used to render images, which call template-preview separately for each page. This function
         # should be colouring a single page pdf (which might be any individual page of an original precompiled letter)
-        raise InvalidRequest("_colour_no_print_areas_of_page_in_red should only be called for a one-page-pdf")
+        raise InvalidRequest("_png_with_no_print_areas_in_red should only be called for a one-page-pdf")
 
-    page = pdf.pages[0]
-    _colour_no_print_areas_of_page_in_red(page, is_first_page)
+    return pdf
 
-    out = bytesio_from_pdf(pdf)
-    # it's a good habit to put things back exactly the way we found them
-    src_pdf.seek(0)
-    return out
 
-
-def _colour_no_print_areas_of_page_in_red(page, is_first_page):
+def _png_with_no_print_areas_in_red(src_pdf, is_first_page):
     """
-    Overlays the non-printable areas onto a single page. It adds red areas (if `is_first_page` is set, then it'll add
-    red areas around the address window too) and returns a new page object that you can then merge .
+    Rasterises a single page pdf with the non-printable areas coloured in red, like rasterising the page with
+    `_red_overlay` merged onto it.
+
+    The page is rasterised as it is, and the red composited over the image. Rasterising is the expensive part, and
+    it's cached for the unmodified page (see `_unmodified_page_pngs`), so the page only needs rasterising once
+    whichever way it's viewed.
 
-    :param PageObject page: A page, as returned by PdfReader.pages[i]. Note: This is modified by this function.
+    :param BytesIO src_pdf: A file-like representing a single page pdf
     :param bool is_first_page: true if we should overlay the address block red area too.
-    :return: None. It modifies the page object instead
+    :return BytesIO: New file-like containing the png
     """
-    red_transparent = Color(100, 0, 0, alpha=0.2)
+    document = PdfDocument.of(src_pdf)
+    page = _read_single_page_pdf(document.file()).pages[0]
 
-    # Overlay the areas where the service can't print as per the template
-    can = NotifyCanvas(red_transparent)
+    return _colour_png_in_red(_unmodified_page_pngs(document, [1])[1], page, is_first_page)
 
-    # Each page of content
-    # left margin:
-    pt1 = 0, 0
-    pt2 = BORDER_LEFT_FROM_LEFT_OF_PAGE, A4_HEIGHT
-    can.rect(pt1, pt2)
-    # top margin:
-    pt1 = BORDER_LEFT_FROM_LEFT_OF_PAGE, 0
-    pt2 = BORDER_RIGHT_FROM_LEFT_OF_PAGE, BORDER_TOP_FROM_TOP_OF_PAGE
-    can.rect(pt1, pt2)
-    # right margin:
-    pt1 = BORDER_RIGHT_FROM_LEFT_OF_PAGE, 0
-    pt2 = A4_WIDTH, A4_HEIGHT
-    can.rect(pt1, pt2)
-    # bottom margin:
-    pt1 = BORDER_LEFT_FROM_LEFT_OF_PAGE, BORDER_BOTTOM_FROM_TOP_OF_PAGE
-    pt2 = BORDER_RIGHT_FROM_LEFT_OF_PAGE, A4_HEIGHT
-    can.rect(pt1, pt2)
 
-    # The first page is more varied because of address blocks etc subsequent pages are more simple
-    if is_first_page:
-        # left from address block (from logo area all the way to body)
-        pt1 = BORDER_LEFT_FROM_LEFT_OF_PAGE, LOGO_BOTTOM_FROM_TOP_OF_PAGE
-        pt2 = ADDRESS_LEFT_FROM_LEFT_OF_PAGE, BODY_TOP_FROM_TOP_OF_PAGE
-        can.rect(pt1, pt2)
+def _colour_no_print_areas_of_pdf_in_red(src_pdf):
+    """
+    Overlays the non-printable areas (see `_red_overlay`) onto every page of a pdf, with the red areas around the
+    address window on the first page.
 
-        # directly above address block
-        pt1 = ADDRESS_LEFT_FROM_LEFT_OF_PAGE, LOGO_BOTTOM_FROM_TOP_OF_PAGE
-        pt2 = ADDRESS_RIGHT_FROM_LEFT_OF_PAGE, ADDRESS_TOP_FROM_TOP_OF_PAGE
-        can.rect(pt1, pt2)
+    Rather than merging a copy of the overlay into every page, each overlay is added to the pdf once, as a form
+    XObject, and each page draws one of them after its own content. The pdf only grows by the size of the overlays
+    however many pages it has, and the pages' own content isn't parsed or rewritten.
 
-        # right from address block (from logo area all the way to body)
-        pt1 = ADDRESS_RIGHT_FROM_LEFT_OF_PAGE, LOGO_BOTTOM_FROM_TOP_OF_PAGE
-        pt2 = SERVICE_ADDRESS_LEFT_FROM_LEFT_OF_PAGE, BODY_TOP_FROM_TOP_OF_PAGE
-        can.rect(pt1, pt2)
+    :param BytesIO src_pdf: A file-like containing the pdf
+    :return BytesIO: New file-like containing the overlaid pdf
+    """
+    from pypdf.generic import ArrayObject, DecodedStreamObject, DictionaryObject, NameObject
+
+    pdf = PdfWriter()
+    pdf.append_pages_from_reader(PdfReader(src_pdf))
+
+    def add_stream(data):
+        stream = DecodedStreamObject()
+        stream.set_data(data)
+        return pdf._add_object(stream.flate_encode())
+
+    # Each page's content is drawn between these, so that it can't leave anything (such as a transformation) that
+    # would move the overlay
+    save_graphics_state = add_stream(b"q\n")
+    draw_overlay = {}
+
+    for page_number, page in enumerate(pdf.pages):
+        is_first_page = page_number == 0
+        name = f"/NotifyRedOverlay{'FirstPage' if is_first_page else ''}"
+
+        if name not in draw_overlay:
+            overlay = _red_overlay(is_first_page)
+            form = DecodedStreamObject()
+            form.set_data(overlay.get_contents().get_data())
+            form.update(
+                {
+                    NameObject("/Type"): NameObject("/XObject"),
+                    NameObject("/Subtype"): NameObject("/Form"),
+                    NameObject("/BBox"): overlay.mediabox,
+                    NameObject("/Resources"): overlay["/Resources"].clone(pdf),
+                }
+            )
+            draw_overlay[name] = (pdf._add_object(form.flate_encode()), add_stream(f"\nQ q {name} Do Q\n".encode()))
+
+        form, draw = draw_overlay[name]
+
+        # Pages can share their resources, so each overlay has a name of its own
+        if "/Resources" not in page:
+            page[NameObject("/Resources")] = DictionaryObject()
+        resources = page["/Resources"].get_object()
+        if "/XObject" not in resources:
+            resources[NameObject("/XObject")] = DictionaryObject()
+        resources["/XObject"].get_object()[NameObject(name)] = form
+
+        contents = page.get("/Contents")
+        if contents is None:
+            contents = []
+        elif isinstance(contents.get_object(), ArrayObject):
+            contents = list(contents.get_object())
+        else:
+            contents = [contents]
+        page[NameObject("/Contents")] = ArrayObject([save_graphics_state, *contents, draw])
+
+    output = BytesIO()
+    pdf.write(output)
+    output.seek(0)
+    return output
 
-        # below address block
-        pt1 = ADDRESS_LEFT_FROM_LEFT_OF_PAGE, ADDRESS_BOTTOM_FROM_TOP_OF_PAGE
-        pt2 = ADDRESS_RIGHT_FROM_LEFT_OF_PAGE, BODY_TOP_FROM_TOP_OF_PAGE
-        can.rect(pt1, pt2)
 
-    # move to the beginning of the StringIO buffer
-    new_pdf = PdfReader(can.get_bytes())
+def _printable_areas_on_page(page, is_first_page):
+    """
+    The printable areas as boxes in pymupdf's coordinates for the page, which are placed where the overlays in
+    `_overlay_printable_areas_with_white` land: measured from the bottom left of the media box, as if it was A4.
+    """
+    import pymupdf
+
+    areas = PRINTABLE_AREAS_OF_ADDRESS_PAGE if is_first_page else PRINTABLE_AREAS_OF_PAGE
+    boxes = []
+    for (x0, y0), (x1, y1) in areas:
+        box = pymupdf.Rect(x0 * mm, A4_HEIGHT_IN_PTS - y1 * mm, x1 * mm, A4_HEIGHT_IN_PTS - y0 * mm)
+        boxes.append(tuple(box * page.transformation_matrix))
+    return boxes
+
+
+@sentry_sdk.trace
+def _get_pages_with_content_outside_printable_area(src_pdf, is_an_attachment=False, page_numbers=None):
+    """
+    Finds the pages with anything that isn't white outside the printable areas.
+
+    Where we can, this is worked out from the geometry of the text and drawings on each page (see
+    app/vector_bounds.py), and only pages that we can't be sure about that way (eg with images near the edge) are
+    rasterised (see `_rasterise_pages_to_check_boundaries`).
+
+    :param src_pdf: A PdfDocument or a file-like
+    :param Boolean is_an_attachment: whether the pdf is a letter attachment, which has no address page
+    :param page_numbers: the pages to check (1-indexed, in order). All of them if not given
+    :return list: page numbers (1-indexed)
+    """
+    from app.vector_bounds import content_outside_areas, uses_transparency
+
+    document = PdfDocument.of(src_pdf)
+    if page_numbers is None:
+        page_numbers = range(1, document.page_count + 1)
+
+    if not current_app.config["VECTOR_BOUNDS_CHECK"]:
+        return list(_rasterise_pages_to_check_boundaries(document, page_numbers, is_an_attachment))
+
+    transparency = document.cached("transparency", lambda: uses_transparency(document.pymupdf_document))
+    invalid_pages = []
+    pages_to_rasterise = []
+    for page_number in page_numbers:
+        page = document.pymupdf_document[page_number - 1]
+        areas = _printable_areas_on_page(page, is_first_page=page_number == 1 and not is_an_attachment)
+        outside = content_outside_areas(page, areas, transparency=transparency)
+
+        if outside is None:
+            pages_to_rasterise.append(page_number)
+        elif outside:
+            current_app.logger.warning(
+                "Letter exceeds boundaries on page %s", page_number, extra={"page_number": page_number}
+            )
+            invalid_pages.append(page_number)
+
+    if pages_to_rasterise:
+        current_app.logger.info(
+            "Rasterising %s of %s pages to check boundaries",
+            len(pages_to_rasterise),
+            len(page_numbers),
+            extra={"pages_rasterised": len(pages_to_rasterise)},
+        )
+        invalid_pages += _rasterise_pages_to_check_boundaries(document, pages_to_rasterise, is_an_attachment)
+
+    return sorted(invalid_pages)
+
+
+def _rasterise_pages_to_check_boundaries(document, page_numbers, is_an_attachment):
+    """
+    :param PdfDocument document: the letter
+    :param page_numbers: the pages to check (1-indexed, in order)
+    :param Boolean is_an_attachment: whether the pdf is a letter attachment, which has no address page
+    :return: iterable containing the page numbers with content outside the printable areas (1-indexed)
+    """
+    if not current_app.config["MARGIN_RASTER_BOUNDS_CHECK"]:
+        pdf_to_validate = _overlay_printable_areas_with_white(document, is_an_attachment=is_an_attachment)
+        return _get_out_of_bounds_pages(pdf_to_validate, page_numbers=list(page_numbers))
+
+    pages = [document.pymupdf_document[page_number - 1] for page_number in page_numbers]
+    # pymupdf only renders what's in the crop box, but content outside it is still out of bounds, so those pages are
+    # rendered whole by poppler instead
+    cropped_pages = [page.number + 1 for page in pages if page.cropbox != page.mediabox]
+
+    invalid_pages = list(
+        _get_pages_with_content_in_margins([page for page in pages if page.cropbox == page.mediabox], is_an_attachment)
+    )
+    if cropped_pages:
+        pdf_to_validate = _overlay_printable_areas_with_white(document, is_an_attachment=is_an_attachment)
+        invalid_pages += _get_out_of_bounds_pages(pdf_to_validate, page_numbers=cropped_pages)
+
+    return sorted(invalid_pages)
+
+
+def _margins_of_page(page, is_first_page):
+    """
+    The parts of the page outside its printable areas, as boxes in the coordinates pymupdf renders the page in
+    """
+    import pymupdf
+
+    from app.vector_bounds import boxes_outside
 
-    # note that the original page object is modified. I don't know if the original underlying src_pdf buffer is affected
-    # but i assume not.
-    page.merge_page(new_pdf.pages[0])
+    # the printable areas are in pymupdf's coordinates for the unrotated page
+    areas = [tuple(pymupdf.Rect(area) * page.rotation_matrix) for area in _printable_areas_on_page(page, is_first_page)]
+    return boxes_outside(tuple(page.rect), areas)
 
 
-def _get_out_of_bounds_pages(src_pdf_bytes):
+def _is_white(pixmap):
+    from PIL import Image
+
+    # a view of the pixmap's samples rather than a copy, so finding the lightest and darkest pixels happens in C
+    image = Image.frombuffer("L", (pixmap.width, pixmap.height), pixmap.samples_mv, "raw", "L", pixmap.stride, 1)
+    # pymupdf's antialiasing rounds the edges of white shapes drawn on white down to 254
+    return image.getextrema()[0] >= 254
+
+
+def _get_pages_with_content_in_margins(pages, is_an_attachment):
+    """
+    Renders just the parts of each page outside its printable areas, in grayscale, and checks that they're white.
+    Unlike `_get_out_of_bounds_pages`, this doesn't need the printable areas overlaying with white first, and doesn't
+    render them at all.
+
+    :param list pages: pymupdf pages
+    :param Boolean is_an_attachment: whether the pdf is a letter attachment, which has no address page
+    :return: iterable containing page numbers (1-indexed)
+    """
+    import pymupdf
+
+    dpi = current_app.config["MARGIN_RASTER_DPI"]
+
+    for page in pages:
+        page_number = page.number + 1
+        for margin in _margins_of_page(page, is_first_page=page_number == 1 and not is_an_attachment):
+            pixmap = page.get_pixmap(dpi=dpi, colorspace=pymupdf.csGRAY, clip=margin, alpha=False)
+            if pixmap.width and pixmap.height and not _is_white(pixmap):
+                current_app.logger.warning(
+                    "Letter exceeds boundaries on page %s", page_number, extra={"page_number": page_number}
+                )
+                yield page_number
+                break
+
+
+def _page_ranges(page_numbers, max_length):
+    """
+    Groups sorted page numbers into (first, last) ranges of consecutive pages, each at most `max_length` pages long
+    """
+    ranges = []
+    for page_number in page_numbers:
+        if ranges and ranges[-1][1] == page_number - 1 and page_number - ranges[-1][0] < max_length:
+            ranges[-1] = (ranges[-1][0], page_number)
+        else:
+            ranges.append((page_number, page_number))
+    return ranges
+
+
+def _rasterise_pages(pdf_data, page_numbers):
+    """
+    Rasterises a few pages at a time, so that however long the letter is, only that many pages are in memory at once.
+
+    :param bytes pdf_data: the pdf
+    :param list page_numbers: the pages to rasterise (1-indexed, in order)
+    :return: iterable of (page number, PIL image). Each image is closed once the next one is asked for.
+    """
+    from pdf2image import convert_from_bytes
+
+    # each chunk starts a pdftoppm process, so by default the pages are split between as few as can run at once
+    if not (pages_at_a_time := current_app.config["RASTER_BOUNDS_CHECK_PAGES_AT_A_TIME"]):
+        pages_at_a_time = min(
+            RASTER_BOUNDS_CHECK_MAX_PAGES_AT_A_TIME, math.ceil(len(page_numbers) / subprocess_concurrency())
+        )
+
+    for first_page, last_page in _page_ranges(page_numbers, pages_at_a_time):
+        with subprocess_slot():
+            images = convert_from_bytes(pdf_data, first_page=first_page, last_page=last_page)
+
+        for page_number in range(first_page, last_page + 1):
+            image = images.pop(0)
+            yield page_number, image
+            image.close()
+
+
+def _get_out_of_bounds_pages(src_pdf_bytes, *, page_numbers):
     """
     Checks each pixel of the image to determine the colour - if any pixel is not white return false
     :param BytesIO src_pdf_bytes: filelike containing PDF from which to take pages.
+    :param list page_numbers: the pages to check (1-indexed, in order)
     :return: iterable containing page numbers (1-indexed)
     :return: False if there is any colour but white, otherwise true
     """
-    images = convert_from_bytes(src_pdf_bytes.read())
+    pdf_data = src_pdf_bytes.read()
     src_pdf_bytes.seek(0)
 
-    for i, image in enumerate(images, start=1):
+    for i, image in _rasterise_pages(pdf_data, page_numbers):
         colours = image.convert("RGB").getcolors()
 
         if colours is None:
@@ -743,34 +1323,30 @@ def _get_out_of_bounds_pages(src_pdf_bytes):
 
 @sentry_sdk.trace
 def rewrite_address_block(pdf, *, page_count, allow_international_letters, filename):
-    address = extract_address_block(pdf)
+    document = PdfDocument.of(pdf)
+    address = extract_address_block(document)
     address.allow_international_letters = allow_international_letters
 
     if address.error_code:
         raise ValidationFailed(address.error_code, [1], page_count=page_count)
 
-    pdf = redact_precompiled_letter_address_block(pdf)
-    pdf = add_address_to_precompiled_letter(pdf, address.normalised)
-    return pdf, address.normalised
+    document = redact_precompiled_letter_address_block(document)
+    document = add_address_to_precompiled_letter(document, address.normalised)
+    return document, address.normalised
 
 
 def _extract_text_from_first_page_of_pdf(pdf, rect):
     """
     Extracts all text within a block on the first page
 
-    :param BytesIO pdf: pdf bytestream from which to extract
+    :param pdf: PdfDocument or BytesIO pdf bytestream from which to extract
     :param rect: rectangle describing the area to extract from
     :return: Any text found
     """
-    pdf.seek(0)
-    doc = pymupdf.open("pdf", pdf)
-    page = doc[0]
-    ret = _extract_text_from_page(page, rect)
-    pdf.seek(0)
-    return ret
+    return _extract_text_from_page(PdfDocument.of(pdf), 0, rect)
 
 
-def _extract_text_from_page(page, rect):
+def _extract_text_from_page(document, page_number, rect):
     """
     Extracts all text within a block.
     Taken from this script: https://github.com/pymupdf/PyMuPDF-Utilities/blob/master/textboxtract.py
@@ -781,11 +1357,15 @@ def _extract_text_from_page(page, rect):
     and is structured as follows:
     (x1, y1, x2, y2, word value, paragraph number, line number, word position within the line)
 
-    :param pymupdf.Page page: pymupdf page object from which to extract
+    :param PdfDocument document: document from which to extract
+    :param int page_number: zero-indexed page from which to extract
     :param rect: rectangle describing the area to extract from
     :return: Any text found
     """
-    words = page.get_text_words()
+    import pymupdf
+
+    page = document.pymupdf_document[page_number]
+    words = document.words(page_number)
     mywords = [w for w in words if pymupdf.Rect(w[:4]).intersects(rect)]
 
     def _get_address_from_get_textwords():
@@ -828,7 +1408,7 @@ def _extract_text_from_page(page, rect):
 def extract_address_block(pdf):
     """
     Extracts all text within the text block
-    :param BytesIO pdf: pdf bytestream from which to extract
+    :param pdf: PdfDocument or BytesIO pdf bytestream from which to extract
     :return: multi-line address string
     """
     return PrecompiledPostalAddress(_extract_text_from_first_page_of_pdf(pdf, ADDRESS_BOUNDING_BOX))
@@ -836,47 +1416,45 @@ def extract_address_block(pdf):
 
 def is_notify_tag_present(pdf):
     """
-    pdf is a file-like object containing at least the first page of a PDF
+    pdf is a PdfDocument, or a file-like object containing at least the first page of a PDF
     """
     return _extract_text_from_first_page_of_pdf(pdf, NOTIFY_TAG_BOUNDING_BOX) == "NOTIFY"
 
 
-def _get_pages_with_notify_tag(src_pdf_bytes, is_an_attachment=False):
+def _get_pages_with_notify_tag(src_pdf_bytes, is_an_attachment=False, page_numbers=None):
     """
     Looks at all pages (except for page 1 for full letters), and returns any pages that have the NOTIFY tag
     in the top left. DVLA can't process letters with NOTIFY tags on later pages because their software thinks
     it's a marker signifying when a new letter starts. We've seen services attach pages from previous letters
     sent via notify
+
+    :param page_numbers: the pages to look at (1-indexed, in order). All of them if not given
     """
-    src_pdf_bytes.seek(0)
-    doc = pymupdf.open("pdf", src_pdf_bytes)
-    starting_page_index = 1
-    if is_an_attachment:
-        starting_page_index = 0
-    if doc.page_count == starting_page_index:
-        # if no extra pages we dont need to do anything
-        src_pdf_bytes.seek(0)
-        return []
-
-    invalid_pages = [
-        page.number + 1  # return 1 indexed pages
-        for page in doc.pages(start=starting_page_index)
-        if _extract_text_from_page(page, NOTIFY_TAG_BOUNDING_BOX) == "NOTIFY"
+    document = PdfDocument.of(src_pdf_bytes)
+    if page_numbers is None:
+        page_numbers = range(1, document.pymupdf_document.page_count + 1)
+
+    return [
+        page_number
+        for page_number in page_numbers
+        if (page_number > 1 or is_an_attachment)
+        and _extract_text_from_page(document, page_number - 1, NOTIFY_TAG_BOUNDING_BOX) == "NOTIFY"
     ]
 
-    src_pdf_bytes.seek(0)
-    return invalid_pages
-
 
 def redact_precompiled_letter_address_block(pdf):
-    pdf.seek(0)  # make sure we're at the beginning
-    doc = pymupdf.open("pdf", pdf)
-    first_page = doc[0]
+    """
+    :param pdf: PdfDocument or BytesIO pdf bytestream to redact
+    :return PdfDocument: the document, changed
+    """
+    document = PdfDocument.of(pdf)
+    first_page = document.pymupdf_document[0]
 
     first_page.add_redact_annot(ADDRESS_BOUNDING_BOX)
 
     first_page.apply_redactions()
-    return BytesIO(doc.tobytes())
+    document.edited_with(PYMUPDF)
+    return document
 
 
 def add_address_to_precompiled_letter(pdf, address):
@@ -884,10 +1462,14 @@ def add_address_to_precompiled_letter(pdf, address):
     Given a pdf, blanks out any existing address (adds a white rectangle over existing address),
     and then puts the supplied address in over it.
 
-    :param BytestIO pdf: pdf bytestream from which to extract
-    :return: BytesIO new pdf
+    :param pdf: PdfDocument or BytesIO pdf bytestream from which to extract
+    :return PdfDocument: the document, changed
     """
-    old_pdf = PdfReader(pdf)
+    from reportlab.lib.colors import black, white
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    from app.canvas import NotifyCanvas
 
     can = NotifyCanvas(white)
 
@@ -919,27 +1501,29 @@ def add_address_to_precompiled_letter(pdf, address):
     textobject.textLines(address)
     can.drawText(textobject)
 
-    return overlay_first_page_of_pdf_with_new_content(old_pdf, can.get_bytes())
+    return overlay_first_page_of_pdf_with_new_content(PdfDocument.of(pdf), can.get_bytes())
 
 
-def overlay_first_page_of_pdf_with_new_content(old_pdf_reader, new_page_buffer):
+def overlay_first_page_of_pdf_with_new_content(document, new_page_buffer):
     """
     Does not overwrite old PDF. Instead overlays new content - for example, we call this where new_page_buffer is a
     transparent page that just contains "NOTIFY" in white text. the old content is still there, and NOTIFY is written
     on top of it.
 
-    :param PdfReader old_pdf_reader: a rich pdf object that we want to add content to the first page of
+    :param PdfDocument document: the document that we want to add content to the first page of
     :param BytesIO new_page_buffer: BytesIO containing the raw bytes for the new content
+    :return PdfDocument: the document, changed
     """
     # move to the beginning of the buffer and replay it into a pdf writer
     new_page_buffer.seek(0)
     new_pdf = PdfReader(new_page_buffer)
     new_page = new_pdf.pages[0]
-    existing_page = old_pdf_reader.pages[0]
+    existing_page = document.reader.pages[0]
     # combines the two pages - overlaying, not overwriting.
     existing_page.merge_page(new_page)
+    document.edited_with(PYPDF)
 
-    return bytesio_from_pdf(old_pdf_reader)
+    return document
 
 
 def bytesio_from_pdf(pdf):
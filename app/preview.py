@@ -1,4 +1,5 @@
 import base64
+import binascii
 import pickle
 from io import BytesIO
 
@@ -9,13 +10,11 @@ from notifications_utils.template import (
 )
 from pypdf import PdfReader, PdfWriter
 from pypdf.errors import PdfReadError
-from wand.color import Color
-from wand.exceptions import MissingDelegateError
-from wand.image import Image
-from weasyprint import HTML
 
-from app import auth
+from app import InvalidRequest, auth
+from app.document_store import document_store
 from app.letter_attachments import get_attachment_pdf
+from app.resource_limits import subprocess_slot
 from app.schemas import get_and_validate_json_from_request, letter_attachment_preview_schema, preview_schema
 from app.templated import generate_templated_pdf
 from app.utils import PDFPurpose, get_datetime_from_json
@@ -26,6 +25,9 @@ preview_blueprint = Blueprint("preview_blueprint", __name__)
 # When the background is set to white traces of the Notify tag are visible in the preview png
 # As modifying the pdf text is complicated, a quick solution is to place a white block over it
 def hide_notify_tag(image):
+    from wand.color import Color
+    from wand.image import Image
+
     with Image(width=130, height=50, background=Color("white")) as cover:
         if image.colorspace == "cmyk":
             cover.transform_colorspace("cmyk")
@@ -45,24 +47,77 @@ def png_from_pdf(data, page_number, hide_notify=False):
 
     @current_app.cache(serialised_page, hide_notify, folder="pngs", extension="png")
     def _generate():
-        output = BytesIO()
-        new_pdf = BytesIO()
-        writer = PdfWriter()
-        writer.add_page(pickle.loads(serialised_page))
-        writer.write(new_pdf)
-        new_pdf.seek(0)
-
-        with Image(blob=new_pdf, resolution=150) as rasterized_pdf:
-            if hide_notify:
-                hide_notify_tag(rasterized_pdf)
-            with rasterized_pdf.convert("png") as converted:
-                converted.save(file=output)
-        output.seek(0)
-        return output
+        return _rasterise_page(pickle.loads(serialised_page), hide_notify)
+
+    return _generate()
+
+
+@sentry_sdk.trace
+def png_from_stored_document(handle, document, page_number, hide_notify=False):
+    """
+    Like `png_from_pdf`, for a pdf in the document store. The handle is a hash of the whole pdf, so it's used as the
+    cache key instead of the page, and the pdf is only read if the png isn't cached.
+
+    Pages are cached for every instance of the app, so one that doesn't have the document (because another instance
+    registered it) can still return pages that have been previewed before.
+
+    :param str handle: the document's handle
+    :param StoredDocument document: the document, or None if it isn't in this instance's store
+    """
+    if document and not 1 <= page_number <= document.page_count:
+        abort(400, f"Letter does not have a page {page_number}")
+
+    @current_app.cache(handle, page_number, hide_notify, folder="pngs", extension="png")
+    def _generate():
+        if not document:
+            raise InvalidRequest(f"Unknown document {handle}, register it again", code=404)
+        return _rasterise_page(PdfReader(BytesIO(document.data)).pages[page_number - 1], hide_notify)
 
     return _generate()
 
 
+def _rasterise_page(page, hide_notify):
+    from wand.image import Image
+
+    output = BytesIO()
+    new_pdf = BytesIO()
+    writer = PdfWriter()
+    writer.add_page(page)
+    writer.write(new_pdf)
+    new_pdf.seek(0)
+
+    # ImageMagick renders PDFs by running Ghostscript
+    with subprocess_slot(), Image(blob=new_pdf, resolution=150) as rasterized_pdf:
+        if hide_notify:
+            hide_notify_tag(rasterized_pdf)
+        with rasterized_pdf.convert("png") as converted:
+            converted.save(file=output)
+    output.seek(0)
+    return output
+
+
+@sentry_sdk.trace
+def pngs_from_pdf(data):
+    """
+    Rasterises every page of a pdf in one go, the same way `png_from_pdf` rasterises a page. Not cached.
+
+    :param bytes data: the pdf
+    :return list: a new file-like containing a png for each page
+    """
+    from wand.image import Image
+
+    pngs = []
+    # ImageMagick renders PDFs by running Ghostscript, once for the whole pdf
+    with subprocess_slot(), Image(blob=data, resolution=150) as rasterized_pdf:
+        for frame in rasterized_pdf.sequence:
+            output = BytesIO()
+            with Image(image=frame) as page, page.convert("png") as converted:
+                converted.save(file=output)
+            output.seek(0)
+            pngs.append(output)
+    return pngs
+
+
 @sentry_sdk.trace
 def get_page_count_for_pdf(pdf_data):
     reader = PdfReader(pdf_data)
@@ -214,6 +269,8 @@ def get_html(json, language="english", includes_first_page=True):
 def get_pdf(html) -> BytesIO:
     @current_app.cache(html, folder="templated", extension="pdf")
     def _get():
+        from weasyprint import HTML
+
         # Span description is a bit inexact, it's not *strictly* _just_ that function, but close enough
         with sentry_sdk.start_span(op="function", description="weasyprint.HTML.write_pdf"):
             return BytesIO(HTML(string=html).write_pdf())
@@ -221,23 +278,66 @@ def get_pdf(html) -> BytesIO:
     return _get()
 
 
+@preview_blueprint.route("/precompiled-documents", methods=["POST"])
+@auth.login_required
+def register_precompiled_letter():
+    """
+    POST /precompiled-documents with a base64 encoded pdf, like /precompiled-preview.png takes
+
+    returns {"handle": "a hash of the pdf", "page_count": 2}. The pdf's pages can then be previewed with
+    /precompiled-preview.png?handle=<handle>&page=<page>, without sending the pdf again, until the handle hasn't been
+    used for PRECOMPILED_DOCUMENT_TTL_SECONDS. Handles are only known to the instance of the app that returned them
+    (though pages that have already been previewed can be returned by any instance), so if /precompiled-preview.png
+    returns a 404 the pdf should be registered again.
+    """
+    encoded_string = request.get_data()
+
+    if not encoded_string:
+        abort(400)
+
+    try:
+        data = base64.decodebytes(encoded_string)
+        page_count = get_page_count_for_pdf(BytesIO(data))
+    except (binascii.Error, PdfReadError):
+        abort(400, "Could not read PDF")
+
+    handle = document_store.add(
+        data,
+        page_count=page_count,
+        ttl=current_app.config["PRECOMPILED_DOCUMENT_TTL_SECONDS"],
+        max_size=current_app.config["PRECOMPILED_DOCUMENT_STORE_BYTES"],
+    )
+    if not handle:
+        raise InvalidRequest("PDF is too large to register, send it to /precompiled-preview.png instead", code=413)
+
+    return jsonify(handle=handle, page_count=page_count), 201
+
+
 @preview_blueprint.route("/precompiled-preview.png", methods=["POST"])
 @auth.login_required
 def view_precompiled_letter():
+    from wand.exceptions import MissingDelegateError
+
     try:
-        encoded_string = request.get_data()
+        page_number = int(request.args.get("page", 1))
+        hide_notify = request.args.get("hide_notify", "") == "true"
+
+        if handle := request.args.get("handle"):
+            document = document_store.get(handle, ttl=current_app.config["PRECOMPILED_DOCUMENT_TTL_SECONDS"])
+            png = png_from_stored_document(handle, document, page_number=page_number, hide_notify=hide_notify)
+        else:
+            encoded_string = request.get_data()
 
-        if not encoded_string:
-            abort(400)
+            if not encoded_string:
+                abort(400)
 
-        return send_file(
-            path_or_file=png_from_pdf(
+            png = png_from_pdf(
                 BytesIO(base64.decodebytes(encoded_string)),
-                page_number=int(request.args.get("page", 1)),
-                hide_notify=request.args.get("hide_notify", "") == "true",
-            ),
-            mimetype="image/png",
-        )
+                page_number=page_number,
+                hide_notify=hide_notify,
+            )
+
+        return send_file(path_or_file=png, mimetype="image/png")
 
     # catch invalid pdfs
     except MissingDelegateError as e:
@@ -0,0 +1,92 @@
+import fcntl
+import os
+import time
+from contextlib import contextmanager
+
+from flask import current_app, has_app_context
+
+from container_limits import subprocess_concurrency
+
+SUBPROCESS_SLOTS_DIR = os.path.join("/tmp", "template-preview-subprocess-slots")
+
+# Set while this process holds a slot for itself (see `process_slot`)
+_holding_process_slot = False
+
+
+@contextmanager
+def subprocess_slot():
+    """
+    Blocks until fewer than `subprocess_concurrency()` subprocesses are running in this container, and holds a slot
+    until the block exits.
+
+    Slots are lock files, so they are shared by every gunicorn worker and celery child however they were started, and
+    are released by the kernel if a process dies while holding one.
+    """
+    if _holding_process_slot:
+        yield
+        return
+
+    os.makedirs(SUBPROCESS_SLOTS_DIR, exist_ok=True)
+    started_waiting = time.monotonic()
+
+    while True:
+        for slot in range(subprocess_concurrency()):
+            fd = os.open(os.path.join(SUBPROCESS_SLOTS_DIR, f"{slot}.lock"), os.O_CREAT | os.O_RDWR, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+
+            waited = time.monotonic() - started_waiting
+            if waited > 1 and has_app_context():
+                current_app.logger.info("Waited %.1fs for a free subprocess slot", waited, extra={"wait_time": waited})
+
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+            return
+
+        time.sleep(0.05)
+
+
+@contextmanager
+def process_slot():
+    """
+    Holds a subprocess slot until the block exits, for a process that we've started to do work of its own (see
+    `_validate_page_ranges_in_parallel` in app/precompiled.py). Subprocesses it starts in the meantime run in that slot
+    rather than waiting for another, as every slot could be held by processes that are all waiting.
+    """
+    global _holding_process_slot
+
+    with subprocess_slot():
+        _holding_process_slot = True
+        try:
+            yield
+        finally:
+            _holding_process_slot = False
+
+
+def free_subprocess_slots() -> int:
+    """
+    How many subprocess slots nothing holds right now. Other processes can take them at any time, so this is only a
+    guide to how much work to start.
+    """
+    os.makedirs(SUBPROCESS_SLOTS_DIR, exist_ok=True)
+    free = 0
+
+    for slot in range(subprocess_concurrency()):
+        fd = os.open(os.path.join(SUBPROCESS_SLOTS_DIR, f"{slot}.lock"), os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            continue
+        else:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            free += 1
+        finally:
+            os.close(fd)
+
+    return free
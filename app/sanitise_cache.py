@@ -0,0 +1,102 @@
+import hashlib
+import json
+import subprocess
+from collections import namedtuple
+
+from flask import current_app
+
+from app.ghostscript_cache import ghostscript_resources_digest, ghostscript_version
+from app.letter_cache import LetterCache
+
+# The sanitised letter is raw bytes in `file`, or None if the letter failed validation
+SanitiseResult = namedtuple("SanitiseResult", ["recipient_address", "page_count", "message", "invalid_pages", "file"])
+
+letter_cache = LetterCache("sanitised letter")
+
+# Settings that can change which pages a letter fails validation on, and so what sanitising it gives. Any new setting
+# like them needs adding here, so that changing it doesn't give letters results worked out with the old value.
+VALIDATION_SETTINGS = ("VECTOR_BOUNDS_CHECK", "MARGIN_RASTER_BOUNDS_CHECK", "MARGIN_RASTER_DPI")
+
+
+def _app_version():
+    try:
+        from app.version import __git_commit__
+    except ImportError:
+        return None
+    return __git_commit__ or None
+
+
+def _pipeline_version():
+    """
+    Everything other than the input that changes what sanitising a letter gives: our code, and the Ghostscript it
+    converts letters with. None if we can't tell, in which case results aren't cached.
+    """
+    if not (app_version := _app_version()):
+        return None
+
+    try:
+        return [app_version, ghostscript_version(), ghostscript_resources_digest()]
+    except (OSError, subprocess.CalledProcessError):
+        current_app.logger.warning("Couldn't get Ghostscript version, not caching sanitised letters", exc_info=True)
+        return None
+
+
+def _cache_key(pdf_data, *, allow_international_letters, is_an_attachment):
+    if not (version := _pipeline_version()):
+        return None
+
+    parts = [
+        hashlib.sha256(pdf_data).hexdigest(),
+        allow_international_letters,
+        is_an_attachment,
+        version,
+        {setting: current_app.config[setting] for setting in VALIDATION_SETTINGS},
+    ]
+    return f"sanitise/{hashlib.sha256(json.dumps(parts).encode()).hexdigest()}.json"
+
+
+def _serialise(result):
+    # json escapes newlines, so the first one ends it and everything after that is the file
+    metadata = json.dumps(result._replace(file=result.file is not None)._asdict())
+    return metadata.encode() + b"\n" + (result.file or b"")
+
+
+def _deserialise(serialised):
+    metadata, _, file = serialised.partition(b"\n")
+    result = SanitiseResult(**json.loads(metadata))
+    return result._replace(file=file if result.file else None)
+
+
+def cached_sanitise_result(pdf_data, *, allow_international_letters, is_an_attachment, filename, sanitise):
+    """
+    Returns what `sanitise()` would, but only calls it if we haven't already sanitised the same bytes, with the same
+    flags, with this version of the app and Ghostscript. Results, whether the letter passed or failed validation, are
+    stored in the letter cache (see `LetterCache`), keyed on a hash of all of those.
+
+    :param bytes pdf_data: the pdf
+    :param bool allow_international_letters: passed to `sanitise`
+    :param bool is_an_attachment: passed to `sanitise`
+    :param str filename: for logging
+    :param callable sanitise: sanitises the pdf, returning a `SanitiseResult`. Exceptions it raises aren't cached.
+    :return SanitiseResult: the result
+    """
+    if not current_app.config["SANITISE_CACHE"] or not (
+        cache_key := _cache_key(
+            pdf_data, allow_international_letters=allow_international_letters, is_an_attachment=is_an_attachment
+        )
+    ):
+        return sanitise()
+
+    serialised, from_cache = letter_cache.get_or_make(
+        cache_key,
+        lambda: _serialise(sanitise()),
+        local_max_size=current_app.config["SANITISE_CACHE_LOCAL_BYTES"],
+    )
+    if from_cache:
+        current_app.logger.info(
+            "Using cached sanitised letter for file name: %s",
+            filename,
+            extra={"file_name": filename, "cache_key": cache_key},
+        )
+
+    return _deserialise(serialised)
@@ -1,9 +1,12 @@
 from collections.abc import Callable
 from io import BytesIO
 
+from flask import current_app
+
 from app.letter_attachments import add_attachment_to_letter
 from app.transformation import convert_pdf_to_cmyk
 from app.utils import PDFPurpose, stitch_pdfs
+from app.vector_cmyk import is_pdf_device_cmyk
 
 
 def generate_templated_pdf(
@@ -21,8 +24,13 @@ def generate_templated_pdf(
     else:
         pdf = create_pdf_lambda(letter_details, language="english", includes_first_page=True)
 
-    if purpose == PDFPurpose.PRINT:
-        pdf = convert_pdf_to_cmyk(pdf)
+    # Print letters are normally rendered in CMYK already (see `WEASYPRINT_CMYK_RENDERING`), unless they include images.
+    # Without it they never are, so aren't worth checking.
+    if purpose == PDFPurpose.PRINT and not (
+        current_app.config["WEASYPRINT_CMYK_RENDERING"] and is_pdf_device_cmyk(pdf)
+    ):
+        # WeasyPrint output is usually just text, flat colours and a vector logo, which we can convert ourselves
+        pdf = convert_pdf_to_cmyk(pdf, try_vector_conversion=True)
         pdf.seek(0)
 
     # Letter attachments are passed through `/precompiled/sanitise` endpoint, so already in CMYK.
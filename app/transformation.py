@@ -1,19 +1,174 @@
 #!/usr/bin/env python
+import os
+import re
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from io import BytesIO
 
-import pymupdf
 import sentry_sdk
 from flask import current_app
+from pypdf import PdfReader
 
 from app import InvalidRequest
+from app.embedded_fonts import EMBED_FONTS_GHOSTSCRIPT_POSTSCRIPT
+from app.ghostscript_cache import cached_ghostscript_output, ghostscript_resources_dir
+from app.ghostscript_engine import run_on_ghostscript_server
+from app.ghostscript_workspace import ghostscript_workspace
+from app.resource_limits import subprocess_concurrency, subprocess_slot
+from app.vector_cmyk import convert_vector_pdf_to_cmyk
 
+# The colour family of each colour space, as far as deciding whether a PDF needs converting to CMYK goes. PyMuPDF
+# converts Lab images to RGB when it loads them, so we've always treated them as RGB.
+COLOUR_SPACE_FAMILIES = {
+    "DeviceGray": "Gray",
+    "CalGray": "Gray",
+    "G": "Gray",
+    "DeviceRGB": "RGB",
+    "CalRGB": "RGB",
+    "RGB": "RGB",
+    "Lab": "RGB",
+    "DeviceCMYK": "CMYK",
+    "CMYK": "CMYK",
+}
+ICC_COMPONENT_FAMILIES = {1: "Gray", 3: "RGB", 4: "CMYK"}
+
+PDF_TOKEN = re.compile(
+    rb"/[^\s/\[\]()<>{}%]*"  # name
+    rb"|\d+\s+\d+\s+R(?![^\s/\[\]()<>])"  # reference
+    rb"|[\[\]]|<<|>>"
+    rb"|<[^>]*>"  # hex string
+    rb"|\((?:\\.|[^\\)])*\)"  # string
+    rb"|[^\s/\[\]()<>]+"  # number, keyword etc
+)
+INLINE_IMAGE_DICT = re.compile(rb"(?<![^\s])BI\s(.*?)\sID\s", re.DOTALL)
+INLINE_IMAGE_COLOUR_SPACE = re.compile(rb"/(?:CS|ColorSpace)\s*(\[[^\]]*\]|/[^\s/\[\]()<>]+)")
+
+
+class _Reference(int):
+    pass
+
+
+def _parse_pdf_object(source: bytes):
+    """
+    Parses the PDF syntax PyMuPDF returns for an object into names (str), references (`_Reference`) and arrays
+    (list). Dictionaries become a dict of their tokens, and anything else is kept as bytes. This is only enough to
+    read colour space definitions.
+    """
+    stack = [[]]
+    for token in PDF_TOKEN.findall(source):
+        if token in (b"[", b"<<"):
+            stack.append([])
+        elif token in (b"]", b">>") and len(stack) > 1:
+            array = stack.pop()
+            stack[-1].append(array if token == b"]" else {"tokens": array})
+        elif token.startswith(b"/"):
+            stack[-1].append(token[1:].decode("latin-1"))
+        elif token.endswith(b"R") and token[0:1].isdigit():
+            stack[-1].append(_Reference(token.split()[0]))
+        else:
+            stack[-1].append(token)
+    return stack[0][0] if stack[0] else None
+
+
+class _ColourSpaceInventory:
+    """
+    Works out the colour family (see COLOUR_SPACE_FAMILIES) of images from their /ColorSpace entries, without
+    decoding them. Colour spaces stored as their own objects are only resolved once per document.
+    """
+
+    def __init__(self, doc):
+        self.doc = doc
+        self._families_by_xref = {}
+
+    def family_of_image(self, xref):
+        return self._family_of_reference(xref, key="ColorSpace")
+
+    def family_of_inline_image(self, page, colour_space: bytes):
+        colour_space = _parse_pdf_object(colour_space)
+        if isinstance(colour_space, str) and colour_space not in COLOUR_SPACE_FAMILIES:
+            # a named colour space from the page's resources
+            value_type, value = self.doc.xref_get_key(page.xref, f"Resources/ColorSpace/{colour_space}")
+            return self._family(self._value(value_type, value))
+        return self._family(colour_space)
+
+    def _family_of_reference(self, xref, key=None):
+        memo_key = (xref, key)
+        if memo_key not in self._families_by_xref:
+            if key:
+                value = self._value(*self.doc.xref_get_key(xref, key))
+            else:
+                value = _parse_pdf_object(self.doc.xref_object(xref, compressed=True).encode("latin-1"))
+            # stop reference loops in broken PDFs going any further
+            self._families_by_xref[memo_key] = None
+            self._families_by_xref[memo_key] = self._family(value)
+        return self._families_by_xref[memo_key]
+
+    @staticmethod
+    def _value(value_type, value):
+        if value_type == "xref":
+            return _Reference(value.split()[0])
+        if value_type in ("name", "array"):
+            return _parse_pdf_object(value.encode("latin-1"))
+        return None
+
+    def _family(self, colour_space):
+        if isinstance(colour_space, _Reference):
+            return self._family_of_reference(colour_space)
+
+        if isinstance(colour_space, str):
+            return COLOUR_SPACE_FAMILIES.get(colour_space)
+
+        if not isinstance(colour_space, list) or not colour_space or not isinstance(colour_space[0], str):
+            return None
+
+        name, *params = colour_space
+        if name == "ICCBased" and params and isinstance(params[0], _Reference):
+            value_type, components = self.doc.xref_get_key(params[0], "N")
+            if value_type == "int" and int(components) in ICC_COMPONENT_FAMILIES:
+                return ICC_COMPONENT_FAMILIES[int(components)]
+            return self._family(self._value(*self.doc.xref_get_key(params[0], "Alternate")))
+
+        if name in ("Indexed", "I") and params:
+            return self._family(params[0])
+
+        # [/Separation name alternate tint] and [/DeviceN [names] alternate tint attributes]
+        if name in ("Separation", "DeviceN") and len(params) > 1:
+            return self._family(params[1])
+
+        return COLOUR_SPACE_FAMILIES.get(name)
+
+
+@sentry_sdk.trace
+def get_pdf_colour_spaces(data):
+    """
+    Returns the colour families ("Gray", "RGB" and "CMYK") of the images in the PDF, including inline images on each
+    page.
+
+    This reads the /ColorSpace of each image rather than loading the image, so it doesn't decode any pixels, and
+    each image is only looked at once however many pages use it.
+    """
+    import pymupdf
 
-def _does_pdf_contain_colorspace(colourspace, data):
     doc = pymupdf.open(stream=data, filetype="pdf")
+    colour_spaces = get_document_colour_spaces(doc)
+    data.seek(0)
+    return colour_spaces
+
+
+def get_document_colour_spaces(doc):
+    """
+    The same as `get_pdf_colour_spaces`, for a PDF that's already open in pymupdf.
+    """
+    inventory = _ColourSpaceInventory(doc)
+    colour_spaces = set()
+    seen_xrefs = set()
+
     for i in range(len(doc)):
         try:
-            page = doc.get_page_images(i)
+            page_images = doc.get_page_images(i)
+            page = doc[i]
+            contents = page.read_contents() if page.get_contents() else b""
         except RuntimeError as e:
             current_app.logger.warning(
                 "PyMuPDF couldn't read page info for page %s",
@@ -21,59 +176,196 @@ def _does_pdf_contain_colorspace(colourspace, data):
                 extra={"page_number": i + 1},
             )
             raise InvalidRequest(f"Invalid PDF on page {i + 1}") from e
-        for img in page:
+
+        for img in page_images:
             xref = img[0]
-            pix = pymupdf.Pixmap(doc, xref)
-            if colourspace in pix.colorspace.__str__():
-                data.seek(0)
-                return True
-    data.seek(0)
-    return False
+            if xref not in seen_xrefs:
+                seen_xrefs.add(xref)
+                colour_spaces.add(inventory.family_of_image(xref))
+
+        if b"BI" in contents:
+            for inline_image_dict in INLINE_IMAGE_DICT.findall(contents):
+                if match := INLINE_IMAGE_COLOUR_SPACE.search(inline_image_dict):
+                    colour_spaces.add(inventory.family_of_inline_image(page, match.group(1)))
+
+    colour_spaces.discard(None)
+    return colour_spaces
 
 
 def does_pdf_contain_cmyk(data):
-    return _does_pdf_contain_colorspace("CMYK", data)
+    return "CMYK" in get_pdf_colour_spaces(data)
 
 
 def does_pdf_contain_rgb(data):
-    return _does_pdf_contain_colorspace("RGB", data)
+    return "RGB" in get_pdf_colour_spaces(data)
 
 
-@sentry_sdk.trace
-def convert_pdf_to_cmyk(input_data):
-    gs_process = subprocess.Popen(
-        [
-            "gs",
-            "-q",  # quiet on STDOUT
-            "-o",
-            "-",  # write to STDOUT
-            "-dCompatibilityLevel=1.7",  # DVLA require PDF v1.7 (see edaad254)
-            "-sDEVICE=pdfwrite",  # generate PDF output
-            "-sColorConversionStrategy=CMYK",
-            "-sSourceObjectICC=app/ghostscript/control.txt",  # custom mappings to ensure black -> black (see a890f9f0)
-            "-dBandBufferSpace=100000000",  # make it faster (see 14233fb0)
-            "-dBufferSpace=100000000",  # make it faster (see 14233fb0)
-            "-dMaxPatternBitmap=1000000",  # make it faster (see 14233fb0)
-            "-dAutoRotatePages=/None",  # stop inferring page rotation (see 250b205b)
-            "-c",
-            "100000000 setvmthreshold",  # make it faster (see 14233fb0)
-            "-f",
-            "-",  # read from STDIN
-        ],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    stdout, stderr = gs_process.communicate(input=input_data.read())
+# pdfwrite settings for converting a PDF to CMYK, shared by the Ghostscript server and subprocess paths
+@lru_cache
+def cmyk_ghostscript_args():
+    return [
+        "-dCompatibilityLevel=1.7",  # DVLA require PDF v1.7 (see edaad254)
+        "-sDEVICE=pdfwrite",  # generate PDF output
+        "-sColorConversionStrategy=CMYK",
+        # custom mappings to ensure black -> black (see a890f9f0)
+        f"-sSourceObjectICC={ghostscript_resources_dir()}/control.txt",
+        "-dBandBufferSpace=100000000",  # make it faster (see 14233fb0)
+        "-dBufferSpace=100000000",  # make it faster (see 14233fb0)
+        "-dMaxPatternBitmap=1000000",  # make it faster (see 14233fb0)
+        "-dAutoRotatePages=/None",  # stop inferring page rotation (see 250b205b)
+    ]
+
+
+CMYK_GHOSTSCRIPT_POSTSCRIPT = "100000000 setvmthreshold"  # make it faster (see 14233fb0)
 
+# When converting in parallel, don't start a Ghostscript process for fewer pages than this, as it wouldn't save
+# enough to cover the cost of starting gs and joining the output back together
+CMYK_PARALLEL_MIN_PAGES_PER_PROCESS = 5
+
+
+def _raise_if_error_in_stream(output):
     # See: https://github.com/alphagov/notifications-template-preview/pull/713
-    error_in_stream = b"**** Error" in stdout and b"Output may be incorrect." in stdout
+    error_in_stream = b"**** Error" in output and b"Output may be incorrect." in output
     if error_in_stream:
         raise Exception("ghostscript cmyk transformation failed to read all content streams")
 
+
+@sentry_sdk.trace
+def convert_pdf_to_cmyk(input_data, *, embed_all_fonts=False, try_vector_conversion=False):
+    """
+    :param BytesIO input_data: a file-like object containing the pdf
+    :param bool embed_all_fonts: also embed every font, as `embed_fonts` does, in the same Ghostscript pass
+    :param bool try_vector_conversion: if the pdf is only text and vector graphics, rewrite its colours without
+        Ghostscript (see `convert_vector_pdf_to_cmyk`). Only for PDFs whose fonts are already embedded.
+    :return BytesIO: New file-like containing the CMYK pdf
+    """
+    if try_vector_conversion and not embed_all_fonts and current_app.config["CMYK_VECTOR_CONVERSION"]:
+        if (output := convert_vector_pdf_to_cmyk(input_data)) is not None:
+            return output
+
+    postscript = CMYK_GHOSTSCRIPT_POSTSCRIPT
+    if embed_all_fonts:
+        postscript = f"{postscript} {EMBED_FONTS_GHOSTSCRIPT_POSTSCRIPT}"
+
+    return cached_ghostscript_output(
+        input_data,
+        cmyk_ghostscript_args(),
+        postscript,
+        lambda: _convert_pdf_to_cmyk_with_ghostscript(input_data, postscript),
+    )
+
+
+def _convert_pdf_to_cmyk_with_ghostscript(input_data, postscript):
+    page_ranges = _get_page_ranges_for_parallel_conversion(input_data)
+
+    if not page_ranges and (result := run_on_ghostscript_server(cmyk_ghostscript_args(), postscript, input_data)):
+        output, messages = result
+        _raise_if_error_in_stream(messages)
+        return BytesIO(output)
+
+    with ghostscript_workspace(input_data) as workspace:
+        if page_ranges:
+            return _convert_page_ranges_to_cmyk(workspace, postscript, page_ranges)
+
+        _run_cmyk_ghostscript(workspace.input_path, workspace.output_path, postscript)
+        return workspace.read_output()
+
+
+def _run_cmyk_ghostscript(input_path, output_path, postscript, page_range=None):
+    page_args = [f"-dFirstPage={page_range[0]}", f"-dLastPage={page_range[1]}"] if page_range else []
+
+    with subprocess_slot():
+        gs_process = subprocess.Popen(
+            [
+                "gs",
+                "-q",  # quiet on STDOUT
+                "-o",
+                output_path,
+                *cmyk_ghostscript_args(),
+                *page_args,
+                "-c",
+                postscript,
+                "-f",
+                input_path,
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        stdout, stderr = gs_process.communicate()
+
+    _raise_if_error_in_stream(stdout)
+
     if gs_process.returncode != 0:
         raise Exception(
             f"ghostscript cmyk transformation failed with return code: "
             f"{gs_process.returncode}\nstdout: {stdout}\nstderr:{stderr}"
         )
-    return BytesIO(stdout)
+
+
+def _get_page_ranges_for_parallel_conversion(input_data):
+    """
+    If parallel conversion is switched on (CMYK_PARALLEL_MIN_PAGES) and this PDF is long enough, returns the
+    1-indexed, inclusive page ranges to convert in separate Ghostscript processes. Otherwise returns None.
+    """
+    min_pages = current_app.config["CMYK_PARALLEL_MIN_PAGES"]
+    if not min_pages or subprocess_concurrency() < 2:
+        return None
+
+    position = input_data.tell()
+    page_count = len(PdfReader(input_data).pages)
+    input_data.seek(position)
+
+    if page_count < min_pages:
+        return None
+
+    range_count = min(subprocess_concurrency(), page_count // CMYK_PARALLEL_MIN_PAGES_PER_PROCESS)
+    if range_count < 2:
+        return None
+
+    return split_into_page_ranges(page_count, range_count)
+
+
+def split_into_page_ranges(page_count, range_count):
+    """
+    Splits the pages into `range_count` 1-indexed, inclusive ranges of consecutive pages, spreading any remainder over
+    the first ranges, so that no range is more than a page longer than another
+    """
+    pages_per_range, remainder = divmod(page_count, range_count)
+    page_ranges = []
+    first_page = 1
+    for i in range(range_count):
+        last_page = first_page + pages_per_range - 1 + (1 if i < remainder else 0)
+        page_ranges.append((first_page, last_page))
+        first_page = last_page + 1
+
+    return page_ranges
+
+
+def _convert_page_ranges_to_cmyk(workspace, postscript, page_ranges):
+    import pymupdf
+
+    current_app.logger.info(
+        "Converting %s pages to CMYK in %s parallel ghostscript processes",
+        page_ranges[-1][1],
+        len(page_ranges),
+        extra={"page_count": page_ranges[-1][1], "process_count": len(page_ranges)},
+    )
+
+    output_paths = [os.path.join(workspace.path, f"pages-{first}-{last}.pdf") for first, last in page_ranges]
+
+    with ThreadPoolExecutor(max_workers=len(page_ranges)) as executor:
+        futures = [
+            executor.submit(_run_cmyk_ghostscript, workspace.input_path, output_path, postscript, page_range)
+            for page_range, output_path in zip(page_ranges, output_paths, strict=True)
+        ]
+        for future in futures:
+            future.result()
+
+    combined = pymupdf.open()
+    for output_path in output_paths:
+        with pymupdf.open(output_path) as part:
+            combined.insert_pdf(part)
+
+    # garbage=4 merges objects that are identical across the parts, like images repeated on every page, which would
+    # otherwise be stored once per part
+    return BytesIO(combined.tobytes(garbage=4))
@@ -12,8 +12,11 @@ from pypdf import PdfReader, PdfWriter
 @sentry_sdk.trace
 def stitch_pdfs(first_pdf: BytesIO, second_pdf: BytesIO) -> BytesIO:
     output = PdfWriter()
-    output.append_pages_from_reader(PdfReader(first_pdf))
+    first_reader = PdfReader(first_pdf)
+    output.append_pages_from_reader(first_reader)
     output.append_pages_from_reader(PdfReader(second_pdf))
+    # keep the version of the PDF (DVLA require v1.7) rather than using pypdf's default
+    output.pdf_header = first_reader.pdf_header.encode()
 
     pdf_bytes = BytesIO()
     output.write(pdf_bytes)
@@ -0,0 +1,282 @@
+import re
+
+# Rasterising antialiases the edges of shapes, so anything this close (in points) to the edge of a printable area
+# might leave a grey pixel outside it. It's also roughly how far our bounding boxes could be out by.
+EDGE_TOLERANCE = 1.0
+
+# Glyphs can spill out of the box their font metrics give them (eg italics, or accents), by up to this much of the
+# font size
+GLYPH_OVERHANG = 0.25
+
+# pymupdf gives the colours of text and paths in sRGB, which white is in whatever colour space it was drawn in
+WHITE = (1.0, 1.0, 1.0)
+
+# Colours this close to white might still come out white when rasterised, depending on how they're rounded
+NEARLY_WHITE = 1 - 2 / 255
+
+# Content that looks the same drawn over white paper as over nothing. Anything else, such as a blend mode that makes
+# white visible or a soft mask that could hide something, means the page needs rasterising to be sure.
+NON_NORMAL_BLEND_MODE = re.compile(rb"/BM\s*(?:\[|/(?!Normal\b|Compatible\b))")
+SOFT_MASK = re.compile(rb"/SMask\s*(?!/None)")
+IMAGE = re.compile(rb"/Subtype\s*/Image\b")
+
+# bboxlog entries for things we can see the geometry and colour of in text and drawings. Any other painting outside
+# the printable areas (images, shadings and image masks) means the page needs rasterising.
+TEXT_AND_PATH_PAINTING = {"fill-path", "stroke-path", "fill-text", "stroke-text", "ignore-text"}
+
+# texttrace span types
+TEXT_FILL, TEXT_STROKE, TEXT_CLIP, TEXT_INVISIBLE = 0, 1, 2, 3
+
+
+def _pad(box, amount):
+    x0, y0, x1, y1 = box
+    return x0 - amount, y0 - amount, x1 + amount, y1 + amount
+
+
+def _intersection(box, other):
+    x0, y0, x1, y1 = max(box[0], other[0]), max(box[1], other[1]), min(box[2], other[2]), min(box[3], other[3])
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return x0, y0, x1, y1
+
+
+def _contains(box, other):
+    return box[0] <= other[0] and box[1] <= other[1] and box[2] >= other[2] and box[3] >= other[3]
+
+
+def boxes_outside(box, areas):
+    """
+    The parts of `box` that aren't in any of `areas`, as a list of boxes
+    """
+    pieces = [box]
+    for area in areas:
+        remaining = []
+        for piece in pieces:
+            overlap = _intersection(piece, area)
+            if overlap is None:
+                remaining.append(piece)
+                continue
+
+            x0, y0, x1, y1 = piece
+            ox0, oy0, ox1, oy1 = overlap
+            remaining += [
+                other
+                for other in (
+                    (x0, y0, x1, oy0),  # above
+                    (x0, oy1, x1, y1),  # below
+                    (x0, oy0, ox0, oy1),  # left
+                    (ox1, oy0, x1, oy1),  # right
+                )
+                if other[0] < other[2] and other[1] < other[3]
+            ]
+        pieces = remaining
+    return pieces
+
+
+class _Mark:
+    """
+    Something painted on a page: a path, or a character of text.
+
+    :param tuple box: everywhere it could have painted (x0, y0, x1, y1)
+    :param int seqno: the order it was painted in
+    :param bool white: whether it's painted in white, so can't be seen outside the printable areas
+    :param tuple ink_box: if it's opaque and clearly not white, a box it paints some of
+    :param bool fills_ink_box: whether it paints all of `ink_box` (a filled rectangle) rather than somewhere in it
+        (a character)
+    """
+
+    def __init__(self, box, seqno, *, white, ink_box=None, fills_ink_box=False):
+        self.box = box
+        self.seqno = seqno
+        self.white = white
+        self.ink_box = ink_box
+        self.fills_ink_box = fills_ink_box
+
+
+def _clearly_not_white(colour):
+    return colour is not None and min(colour) < NEARLY_WHITE
+
+
+def _marks_from_drawings(drawings):
+    for drawing in drawings:
+        if drawing["type"] in ("clip", "group"):
+            continue
+
+        fills = "f" in drawing["type"] and drawing["fill_opacity"] != 0
+        strokes = "s" in drawing["type"] and drawing["stroke_opacity"] != 0
+        if not fills and not strokes:
+            continue
+
+        box = tuple(drawing["rect"])
+        colours = []
+        if fills:
+            # pattern fills don't have a colour
+            colours.append(drawing["fill"])
+        if strokes:
+            colours.append(drawing["color"])
+            # allow for line joins and caps, and draw hairlines (width 0) a pixel wide
+            box = _pad(box, max(drawing["width"] or 0, 1))
+
+        is_one_rectangle = len(drawing["items"]) == 1 and drawing["items"][0][0] == "re"
+        opaque_fill = fills and _clearly_not_white(drawing["fill"]) and drawing["fill_opacity"] == 1
+
+        yield _Mark(
+            box,
+            drawing["seqno"],
+            white=all(colour == WHITE for colour in colours),
+            ink_box=tuple(drawing["rect"]) if is_one_rectangle and opaque_fill else None,
+            fills_ink_box=True,
+        )
+
+
+def _marks_from_text(spans):
+    for span in spans:
+        if span["type"] == TEXT_INVISIBLE or span["opacity"] == 0:
+            continue
+
+        white = span["color"] == WHITE
+        opaque = span["type"] == TEXT_FILL and _clearly_not_white(span["color"]) and span["opacity"] == 1
+        overhang = span["size"] * (GLYPH_OVERHANG if span["dir"] == (1.0, 0.0) else 1)
+        if span["type"] == TEXT_STROKE:
+            overhang += span["linewidth"]
+
+        for character in span["chars"]:
+            unicode, _glyph, _origin, box = character
+            x0, y0, x1, y1 = box
+            has_ink = chr(unicode).strip() and x0 < x1 and y0 < y1
+            yield _Mark(
+                _pad(box, overhang),
+                span["seqno"],
+                white=white,
+                ink_box=box if opaque and has_ink else None,
+            )
+
+
+def uses_transparency(doc):
+    """
+    Whether any graphics state in the PDF uses a blend mode that could make white content visible, or a soft mask
+    that could hide content. Image soft masks (alpha channels) don't count, as we always rasterise pages with images
+    outside the printable areas.
+
+    :param pymupdf.Document doc: the pdf
+    """
+    for xref in range(1, doc.xref_length()):
+        definition = doc.xref_object(xref, compressed=True).encode()
+        if NON_NORMAL_BLEND_MODE.search(definition):
+            return True
+        if SOFT_MASK.search(definition) and not IMAGE.search(definition):
+            return True
+    return False
+
+
+def _rectangular_clips(drawings):
+    clips = [drawing for drawing in drawings if drawing["type"] == "clip"]
+    if any(len(clip["items"]) != 1 or clip["items"][0][0] != "re" for clip in clips):
+        return None
+    return [tuple(clip["scissor"]) for clip in clips]
+
+
+def _definitely_visible(mark, areas, page_box, marks, clips, other_painting):
+    """
+    Whether some of what `mark` definitely paints is outside the printable areas, where nothing could hide it.
+    """
+    if mark.ink_box is None or not _contains(page_box, mark.ink_box):
+        return False
+
+    padded_areas = [_pad(area, EDGE_TOLERANCE) for area in areas]
+    if mark.fills_ink_box:
+        pieces = [
+            piece
+            for piece in boxes_outside(mark.ink_box, padded_areas)
+            if piece[2] - piece[0] >= EDGE_TOLERANCE and piece[3] - piece[1] >= EDGE_TOLERANCE
+        ]
+    else:
+        # a character paints somewhere in its box, but we don't know where, so all of it needs to be outside
+        if any(_intersection(mark.ink_box, area) for area in padded_areas):
+            return False
+        pieces = [mark.ink_box]
+
+    for piece in pieces:
+        hidden = (
+            # painted over in white afterwards
+            any(other.white and other.seqno > mark.seqno and _intersection(other.box, piece) for other in marks)
+            # clipped away
+            or any(not _contains(clip, piece) for clip in clips)
+            # an image or shading, which we can't tell the order or colour of
+            or any(_intersection(box, piece) for box in other_painting)
+        )
+        if not hidden:
+            return True
+
+    return False
+
+
+def _has_checkable_geometry(page, spans):
+    # pymupdf coordinates are for the crop box, rotated, but the overlays are drawn on the media box
+    if page.rotation or page.cropbox != page.mediabox:
+        return False
+
+    # annotations are drawn on top of the overlays
+    if page.first_annot or page.first_widget:
+        return False
+
+    # a Type 3 font's glyphs are drawn by content streams that could put anything anywhere
+    if any(font[2] == "Type3" for font in page.get_fonts(full=True)):
+        return False
+
+    # text used as a clipping path
+    return not any(span["type"] == TEXT_CLIP for span in spans)
+
+
+def content_outside_areas(page, areas, *, transparency):
+    """
+    Works out from the geometry of what's on a page whether any of it can be seen outside the given areas, the way
+    rasterising the page with the areas painted over in white would, but without rasterising it.
+
+    :param pymupdf.Page page: the page
+    :param list areas: boxes (x0, y0, x1, y1) in pymupdf page coordinates that content is allowed in
+    :param bool transparency: whether the document uses transparency (see `uses_transparency`)
+    :return: True if there's content outside the areas, False if there isn't, or None if we can't be sure and the page
+        needs rasterising
+    """
+    spans = page.get_texttrace()
+    if not _has_checkable_geometry(page, spans):
+        return None
+
+    page_box = tuple(page.rect)
+
+    painting = [(kind, box) for kind, box in page.get_bboxlog() if kind != "ignore-text"]
+    if not painting:
+        return False
+
+    drawings = page.get_drawings(extended=True)
+    marks = [*_marks_from_drawings(drawings), *_marks_from_text(spans)]
+    other_painting = [
+        visible
+        for kind, box in painting
+        if kind not in TEXT_AND_PATH_PAINTING and (visible := _intersection(_pad(box, EDGE_TOLERANCE), page_box))
+    ]
+
+    outside = []
+    for mark in marks:
+        visible = _intersection(_pad(mark.box, EDGE_TOLERANCE), page_box)
+        if visible and boxes_outside(visible, areas):
+            outside.append(mark)
+
+    if any(boxes_outside(box, areas) for box in other_painting):
+        return None
+
+    if not transparency:
+        # white on white paper can't be seen
+        outside = [mark for mark in outside if not mark.white]
+
+    if not outside:
+        return False
+
+    if transparency or (clips := _rectangular_clips(drawings)) is None:
+        return None
+
+    if any(_definitely_visible(mark, areas, page_box, marks, clips, other_painting) for mark in outside):
+        return True
+
+    return None
@@ -0,0 +1,349 @@
+import struct
+from functools import lru_cache
+from io import BytesIO
+
+import sentry_sdk
+from flask import current_app
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ContentStream, FloatObject, IndirectObject, NameObject
+
+# Ghostscript converts RGB text, graphics and images with this device link (see app/ghostscript/control.txt), which
+# maps RGB black and greys to K only
+DEVICE_LINK_PATH = "app/ghostscript/rgb_to_cmyk.icc"
+
+# Content stream operators that don't involve colour, so can be kept as they are. Anything not in here or handled
+# explicitly below (colour operators and `Do`) means the PDF needs Ghostscript.
+UNCOLOURED_OPERATORS = {
+    # graphics state
+    b"w", b"J", b"j", b"M", b"d", b"ri", b"i", b"gs", b"q", b"Q", b"cm",
+    # paths
+    b"m", b"l", b"c", b"v", b"y", b"h", b"re", b"S", b"s", b"f", b"F", b"f*", b"B", b"B*", b"b", b"b*", b"n", b"W",
+    b"W*",
+    # text
+    b"BT", b"ET", b"Tc", b"Tw", b"Tz", b"TL", b"Tf", b"Tr", b"Ts", b"Td", b"TD", b"Tm", b"T*", b"Tj", b"TJ", b"'", b'"',
+    # marked content and compatibility sections
+    b"BMC", b"BDC", b"EMC", b"MP", b"DP", b"BX", b"EX",
+}  # fmt: skip
+
+# colour space names we can convert, by the number of components they take
+DEVICE_COLOUR_SPACES = {"/DeviceGray": 1, "/DeviceRGB": 3, "/DeviceCMYK": 4}
+
+# blend modes that give the same result whichever colour space they're done in
+SEPARABLE_SAFE_BLEND_MODES = {"/Normal", "/Compatible"}
+
+
+class UnsupportedContent(Exception):
+    pass
+
+
+def _resolve(obj, default=None):
+    if obj is None:
+        return default
+    return obj.get_object() if isinstance(obj, IndirectObject) else obj
+
+
+class _DeviceLink:
+    """
+    Evaluates an RGB to CMYK device link profile stored as an ICC lut16Type (`mft2`) A2B0 tag: input curves, a colour
+    lookup table with tetrahedral interpolation (as littleCMS, which Ghostscript uses, does for 3 inputs), then
+    output curves.
+    """
+
+    def __init__(self, profile: bytes):
+        tag_count = struct.unpack_from(">I", profile, 128)[0]
+        tags = {
+            signature: offset
+            for signature, offset, _ in (struct.unpack_from(">4sII", profile, 132 + 12 * i) for i in range(tag_count))
+        }
+        offset = tags[b"A2B0"]
+        if profile[offset : offset + 4] != b"mft2":
+            raise ValueError("device link A2B0 tag must be a lut16Type")
+
+        inputs, self.outputs, self.grid_points = profile[offset + 8], profile[offset + 9], profile[offset + 10]
+        if inputs != 3 or self.outputs != 4:
+            raise ValueError("device link must be RGB to CMYK")
+
+        input_entries, output_entries = struct.unpack_from(">HH", profile, offset + 48)
+        position = offset + 52
+
+        self.input_curves = []
+        for _ in range(inputs):
+            self.input_curves.append(struct.unpack_from(f">{input_entries}H", profile, position))
+            position += 2 * input_entries
+
+        clut_entries = self.grid_points**inputs * self.outputs
+        self.clut = struct.unpack_from(f">{clut_entries}H", profile, position)
+        position += 2 * clut_entries
+
+        self.output_curves = []
+        for _ in range(self.outputs):
+            self.output_curves.append(struct.unpack_from(f">{output_entries}H", profile, position))
+            position += 2 * output_entries
+
+    @staticmethod
+    def _curve(table, value):
+        position = min(max(value, 0.0), 1.0) * (len(table) - 1)
+        index = min(int(position), len(table) - 2)
+        fraction = position - index
+        return (table[index] + (table[index + 1] - table[index]) * fraction) / 65535
+
+    def _node(self, r, g, b):
+        start = ((r * self.grid_points + g) * self.grid_points + b) * self.outputs
+        return self.clut[start : start + self.outputs]
+
+    def __call__(self, r, g, b):
+        coordinates = []
+        for curve, value in zip(self.input_curves, (r, g, b), strict=True):
+            position = self._curve(curve, value) * (self.grid_points - 1)
+            index = min(int(position), self.grid_points - 2)
+            coordinates.append((index, position - index))
+        (x, rx), (y, ry), (z, rz) = coordinates
+
+        def node(dx, dy, dz):
+            return self._node(x + dx, y + dy, z + dz)
+
+        c0 = node(0, 0, 0)
+        if rx >= ry >= rz:
+            c1, c2, c3 = (node(1, 0, 0), c0), (node(1, 1, 0), node(1, 0, 0)), (node(1, 1, 1), node(1, 1, 0))
+        elif rx >= rz >= ry:
+            c1, c2, c3 = (node(1, 0, 0), c0), (node(1, 1, 1), node(1, 0, 1)), (node(1, 0, 1), node(1, 0, 0))
+        elif rz >= rx >= ry:
+            c1, c2, c3 = (node(1, 0, 1), node(0, 0, 1)), (node(1, 1, 1), node(1, 0, 1)), (node(0, 0, 1), c0)
+        elif ry >= rx >= rz:
+            c1, c2, c3 = (node(1, 1, 0), node(0, 1, 0)), (node(0, 1, 0), c0), (node(1, 1, 1), node(1, 1, 0))
+        elif ry >= rz >= rx:
+            c1, c2, c3 = (node(1, 1, 1), node(0, 1, 1)), (node(0, 1, 0), c0), (node(0, 1, 1), node(0, 1, 0))
+        else:
+            c1, c2, c3 = (node(1, 1, 1), node(0, 1, 1)), (node(0, 1, 1), node(0, 0, 1)), (node(0, 0, 1), c0)
+
+        return tuple(
+            self._curve(
+                curve,
+                (c0[i] + (c1[0][i] - c1[1][i]) * rx + (c2[0][i] - c2[1][i]) * ry + (c3[0][i] - c3[1][i]) * rz) / 65535,
+            )
+            for i, curve in enumerate(self.output_curves)
+        )
+
+
+@lru_cache
+def _device_link():
+    with open(DEVICE_LINK_PATH, "rb") as f:
+        return _DeviceLink(f.read())
+
+
+@lru_cache(maxsize=1024)
+def rgb_to_cmyk(r, g, b):
+    return tuple(round(value, 4) for value in _device_link()(r, g, b))
+
+
+def gray_to_cmyk(gray):
+    # Ghostscript maps DeviceGray straight to K (its DeviceGrayToK default)
+    return (0.0, 0.0, 0.0, round(1 - min(max(gray, 0.0), 1.0), 4))
+
+
+def _to_cmyk(colour_space, operands):
+    components = [float(operand) for operand in operands]
+    if colour_space == "/DeviceGray":
+        return gray_to_cmyk(*components)
+    if colour_space == "/DeviceRGB":
+        return rgb_to_cmyk(*components)
+    return tuple(components)
+
+
+class _Converter:
+    """
+    Rewrites the colours of one PDF's pages and form XObjects to DeviceCMYK in place, raising `UnsupportedContent`
+    as soon as it finds anything it can't convert the way Ghostscript would.
+
+    With `cmyk_only`, nothing is rewritten, and any colour that isn't already DeviceCMYK is unsupported.
+    """
+
+    def __init__(self, *, cmyk_only=False):
+        self.cmyk_only = cmyk_only
+        self._converted_forms = set()
+
+    def convert_page(self, page):
+        if any("/AP" in _resolve(annotation) for annotation in _resolve(page.get("/Annots"), [])):
+            raise UnsupportedContent("annotation appearance streams")
+
+        resources = _resolve(page.get("/Resources"), {})
+        content = page.get_contents()
+        if content is not None:
+            # the initial colour space of a page is DeviceGray for both stroking and filling
+            operations = self._convert_operations(content.operations, resources, "/DeviceGray")
+            if not self.cmyk_only:
+                content.operations = operations
+                page.replace_contents(content)
+
+        self._convert_group(page)
+
+    def _convert_form(self, reference):
+        if reference.idnum in self._converted_forms:
+            return
+        self._converted_forms.add(reference.idnum)
+
+        xobject = reference.get_object()
+        resources = _resolve(xobject.get("/Resources"), {})
+        content = ContentStream(xobject, reference.pdf)
+        # a form inherits the colour space of wherever it's drawn, so it must set its own before using `sc` or `SC`
+        operations = self._convert_operations(content.operations, resources, None)
+
+        if not self.cmyk_only:
+            self._replace_form_contents(xobject, content, operations)
+
+        self._convert_group(xobject)
+
+    @staticmethod
+    def _replace_form_contents(xobject, content, operations):
+        content.operations = operations
+        if "/Filter" in xobject:
+            # pypdf can only re-encode Flate streams, so store the new content with just that filter
+            xobject[NameObject("/Filter")] = NameObject("/FlateDecode")
+            xobject.pop("/DecodeParms", None)
+        xobject.set_data(content.get_data())
+
+    def _convert_group(self, obj):
+        if group := _resolve(obj.get("/Group")):
+            if group.get("/CS") in ("/DeviceRGB", "/DeviceGray") and not self.cmyk_only:
+                group[NameObject("/CS")] = NameObject("/DeviceCMYK")
+            elif "/CS" in group and group["/CS"] != "/DeviceCMYK":
+                raise UnsupportedContent("transparency group colour space")
+
+    def _check_resources(self, resources):
+        for font in _resolve(resources.get("/Font"), {}).values():
+            if _resolve(font).get("/Subtype") == "/Type3":
+                raise UnsupportedContent("Type3 fonts")
+
+        for ext_g_state in _resolve(resources.get("/ExtGState"), {}).values():
+            ext_g_state = _resolve(ext_g_state)
+            if ext_g_state.get("/SMask", "/None") != "/None":
+                raise UnsupportedContent("soft masks")
+            blend_mode = ext_g_state.get("/BM", "/Normal")
+            if isinstance(blend_mode, list):
+                # readers use the first blend mode in the list that they support, and everything supports /Normal
+                blend_mode = blend_mode[0] if blend_mode else "/Normal"
+            if blend_mode not in SEPARABLE_SAFE_BLEND_MODES:
+                raise UnsupportedContent("blend modes")
+
+    def _convert_operations(self, operations, resources, initial_colour_space):  # noqa: C901 (too complex)
+        self._check_resources(resources)
+
+        # [fill, stroke] colour space of the original PDF, saved and restored with q and Q
+        colour_spaces = [initial_colour_space, initial_colour_space]
+        saved_colour_spaces = []
+        converted = []
+
+        def use_colour_space(colour_space, stroke):
+            if self.cmyk_only and colour_space != "/DeviceCMYK":
+                raise UnsupportedContent(f"colour space {colour_space}")
+            colour_spaces[stroke] = colour_space
+
+        for operands, operator in operations:
+            if operator in UNCOLOURED_OPERATORS:
+                if operator == b"q":
+                    saved_colour_spaces.append(list(colour_spaces))
+                elif operator == b"Q" and saved_colour_spaces:
+                    colour_spaces = saved_colour_spaces.pop()
+                converted.append((operands, operator))
+                continue
+
+            stroke = operator.isupper()
+            lower = operator.lower()
+
+            if lower in (b"g", b"rg", b"k"):
+                colour_space = {b"g": "/DeviceGray", b"rg": "/DeviceRGB", b"k": "/DeviceCMYK"}[lower]
+                if len(operands) != DEVICE_COLOUR_SPACES[colour_space]:
+                    raise UnsupportedContent(f"{operator} with {len(operands)} operands")
+                use_colour_space(colour_space, stroke)
+                cmyk = _to_cmyk(colour_space, operands)
+                converted.append(([FloatObject(value) for value in cmyk], b"K" if stroke else b"k"))
+
+            elif lower == b"cs":
+                colour_space = operands[0] if operands else None
+                if colour_space not in DEVICE_COLOUR_SPACES:
+                    raise UnsupportedContent(f"colour space {colour_space}")
+                use_colour_space(colour_space, stroke)
+                converted.append(([NameObject("/DeviceCMYK")], operator))
+
+            elif lower in (b"sc", b"scn"):
+                colour_space = colour_spaces[stroke]
+                if colour_space is None or len(operands) != DEVICE_COLOUR_SPACES[colour_space]:
+                    raise UnsupportedContent(f"{operator} in colour space {colour_space}")
+                cmyk = _to_cmyk(colour_space, operands)
+                converted.append(([FloatObject(value) for value in cmyk], operator))
+
+            elif operator == b"Do":
+                xobject_reference = _resolve(resources.get("/XObject"), {}).get(operands[0])
+                if not isinstance(xobject_reference, IndirectObject):
+                    raise UnsupportedContent(f"XObject {operands[0]}")
+                if (subtype := xobject_reference.get_object().get("/Subtype")) != "/Form":
+                    raise UnsupportedContent(f"{subtype} XObjects")
+                self._convert_form(xobject_reference)
+                converted.append((operands, operator))
+
+            else:
+                raise UnsupportedContent(f"{operator!r} operator")
+
+        return converted
+
+
+@sentry_sdk.trace
+def convert_vector_pdf_to_cmyk(pdf_data):
+    """
+    Converts a PDF that only contains text and vector graphics to CMYK without Ghostscript, by rewriting the colours
+    in its content streams. RGB colours go through the same device link Ghostscript uses.
+
+    Returns None if the PDF contains images, shadings, patterns, soft masks or anything else we don't convert
+    ourselves, so that the caller can use Ghostscript instead. `pdf_data` is rewound either way.
+
+    :param BytesIO pdf_data: a file-like object containing the pdf
+    :return BytesIO | None: New file-like containing the CMYK pdf
+    """
+    try:
+        reader = PdfReader(pdf_data)
+        writer = PdfWriter()
+        writer.append(reader)
+        if reader.metadata:
+            writer.add_metadata(reader.metadata)
+        converter = _Converter()
+        for page in writer.pages:
+            converter.convert_page(page)
+    except UnsupportedContent:
+        return None
+    except Exception:
+        current_app.logger.exception("Couldn't convert PDF to CMYK without Ghostscript")
+        return None
+    finally:
+        pdf_data.seek(0)
+
+    # DVLA require PDF v1.7 (see edaad254)
+    writer.pdf_header = b"%PDF-1.7"
+    output = BytesIO()
+    writer.write(output)
+    output.seek(0)
+    return output
+
+
+@sentry_sdk.trace
+def is_pdf_device_cmyk(pdf_data):
+    """
+    Returns True if every colour in a text and vector graphics PDF is already DeviceCMYK, so it doesn't need
+    converting. Anything `convert_vector_pdf_to_cmyk` couldn't convert, such as an image, counts as not CMYK.
+    `pdf_data` is rewound either way.
+
+    :param BytesIO pdf_data: a file-like object containing the pdf
+    :return bool:
+    """
+    try:
+        converter = _Converter(cmyk_only=True)
+        for page in PdfReader(pdf_data).pages:
+            converter.convert_page(page)
+    except UnsupportedContent:
+        return False
+    except Exception:
+        current_app.logger.exception("Couldn't check whether PDF is CMYK")
+        return False
+    finally:
+        pdf_data.seek(0)
+
+    return True
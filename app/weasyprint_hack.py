@@ -1,6 +1,8 @@
 import logging
 
-from weasyprint.logger import LOGGER as weasyprint_logs
+# This is the same logger as `weasyprint.logger.LOGGER`, but fetching it by name means we don't have to import
+# weasyprint (and everything it loads) just to start the app.
+weasyprint_logs = logging.getLogger("weasyprint")
 
 
 class WeasyprintError(Exception):
@@ -0,0 +1,119 @@
+import math
+import os
+from functools import lru_cache
+
+# Read by gunicorn_config.py in the gunicorn master as well as by the app, so this only imports from the standard
+# library. Importing the app there would load it into the master before it forks the workers.
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# cgroup v1 reports "no limit" as a very large number rather than "max"
+UNLIMITED_MEMORY_THRESHOLD = 2**60
+
+MiB = 1024 * 1024
+
+# Roughly what one gunicorn worker or celery child needs for itself. Celery recycles children above this size (see
+# `worker_max_memory_per_child` in app/config.py).
+PROCESS_MEMORY = 256 * MiB
+
+# Ghostscript asks for 100MB of buffer space (see app/transformation.py), and pdftoppm and ImageMagick can use as much
+# on a large page.
+SUBPROCESS_MEMORY = 150 * MiB
+
+# What we ran before worker counts were derived from the container's limits, and still run where it has no CPU quota
+DEFAULT_WEB_WORKERS = 5
+DEFAULT_CELERY_CONCURRENCY = 4
+
+
+def _read_cgroup_file(*path):
+    try:
+        with open(os.path.join(CGROUP_ROOT, *path)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def get_cpu_limit() -> float | None:
+    """
+    The number of CPUs the cgroup's quota lets this process use, which may be fractional, or None if there isn't a
+    quota.
+    """
+    if cpu_max := _read_cgroup_file("cpu.max"):  # cgroup v2, eg "150000 100000" or "max 100000"
+        quota, period = cpu_max.split()
+    else:  # cgroup v1
+        quota, period = _read_cgroup_file("cpu", "cpu.cfs_quota_us"), _read_cgroup_file("cpu", "cpu.cfs_period_us")
+
+    if quota and period and quota != "max" and int(quota) > 0:
+        return min(len(os.sched_getaffinity(0)), int(quota) / int(period))
+
+    return None
+
+
+def get_memory_limit() -> int | None:
+    """
+    The memory limit for this container in bytes, or None if there isn't one.
+    """
+    limit = _read_cgroup_file("memory.max") or _read_cgroup_file("memory", "memory.limit_in_bytes")
+
+    if not limit or limit == "max" or int(limit) >= UNLIMITED_MEMORY_THRESHOLD:
+        return None
+
+    return int(limit)
+
+
+def _override(env_var):
+    # anything less than 1 would leave no workers, or no subprocess slots to wait for
+    if value := os.environ.get(env_var):
+        return max(1, int(value))
+    return None
+
+
+def _cap_by_memory(count, memory_per_unit):
+    if (memory := get_memory_limit()) is None:
+        return max(1, count)
+    return max(1, min(count, memory // memory_per_unit))
+
+
+# Worker counts are derived from the CPU and memory limits the container's cgroup gives us, so that they suit whatever
+# size of container we're deployed to. Each can still be set explicitly with an environment variable.
+
+
+def web_worker_count() -> int:
+    """
+    Gunicorn's recommended 2 x CPUs + 1 workers, or `DEFAULT_WEB_WORKERS` without a CPU quota, as long as each has
+    room to run a subprocess. Set WEB_WORKERS to override.
+    """
+    if (workers := _override("WEB_WORKERS")) is not None:
+        return workers
+
+    if (cpus := get_cpu_limit()) is None:
+        return _cap_by_memory(DEFAULT_WEB_WORKERS, PROCESS_MEMORY + SUBPROCESS_MEMORY)
+
+    return _cap_by_memory(math.floor(2 * cpus) + 1, PROCESS_MEMORY + SUBPROCESS_MEMORY)
+
+
+def celery_concurrency() -> int:
+    """
+    Tasks are CPU bound (WeasyPrint and Ghostscript), so one child per CPU, or `DEFAULT_CELERY_CONCURRENCY` without a
+    CPU quota, as long as each has room to run a subprocess. Set CONCURRENCY to override.
+    """
+    if (concurrency := _override("CONCURRENCY")) is not None:
+        return concurrency
+
+    if (cpus := get_cpu_limit()) is None:
+        return _cap_by_memory(DEFAULT_CELERY_CONCURRENCY, PROCESS_MEMORY + SUBPROCESS_MEMORY)
+
+    return _cap_by_memory(math.floor(cpus), PROCESS_MEMORY + SUBPROCESS_MEMORY)
+
+
+@lru_cache
+def subprocess_concurrency() -> int:
+    """
+    How many Ghostscript, pdftoppm or ImageMagick processes may run at once across the whole container. One per CPU,
+    but never more than half the memory limit's worth. Set MAX_SUBPROCESSES to override.
+    """
+    if (max_subprocesses := _override("MAX_SUBPROCESSES")) is not None:
+        return max_subprocesses
+
+    cpus = get_cpu_limit() or len(os.sched_getaffinity(0))
+    return _cap_by_memory(math.ceil(cpus), 2 * SUBPROCESS_MEMORY)
@@ -2,8 +2,6 @@
 
 set -eu
 
-CONCURRENCY=${CONCURRENCY:-4}
-
 case "$@" in
   web)
     exec gunicorn --error-logfile - -c /home/vcap/app/gunicorn_config.py wsgi
@@ -12,7 +10,8 @@ case "$@" in
     exec flask run --host=0.0.0.0 -p $PORT
     ;;
   worker)
-    exec celery --quiet -A run_celery.notify_celery worker --concurrency="$CONCURRENCY"
+    # concurrency is set from CONCURRENCY or the container's limits, see container_limits.py
+    exec celery --quiet -A run_celery.notify_celery worker
     ;;
   *)
     echo "Running custom command"
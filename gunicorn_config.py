@@ -2,10 +2,12 @@ import os
 
 from notifications_utils.gunicorn.defaults import set_gunicorn_defaults
 
+from container_limits import web_worker_count
+
 set_gunicorn_defaults(globals())
 
 
-workers = 5
+workers = web_worker_count()
 timeout = int(os.getenv("HTTP_SERVE_TIMEOUT_SECONDS", 30))
 
 max_requests = 10
@@ -17,6 +17,17 @@ from app import notify_celery, create_app  # noqa
 application = create_app()
 celery_logging.set_up_logging(application.config)
 
+# The app imports most PDF libraries lazily, the first time a request needs them, so web workers only pay for what they
+# use. Celery forks its pool from this process, so import everything the tasks need here once and let the children
+# inherit it rather than each child importing it again after every restart.
+import pdf2image  # noqa
+import pymupdf  # noqa
+import reportlab.lib.colors  # noqa
+import reportlab.pdfbase.ttfonts  # noqa
+import weasyprint  # noqa
+
+import app.canvas  # noqa
+
 
 @worker_process_init.connect
 def init_worker(**_) -> None:
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+Compares the time and peak memory of converting a PDF to CMYK with Ghostscript when the PDF is piped through gs's
+stdin and stdout (how we used to run it) and when it's passed as files in a Ghostscript workspace (how we run it now).
+
+Each approach runs in a fresh interpreter, so peak RSS is only affected by that approach. We report the peak RSS of
+the Python process and of the largest gs process. Files in a memory-backed workspace count towards the container's
+memory but not towards either RSS figure - they're at most the size of the input and output PDFs.
+
+    python scripts/benchmark_ghostscript_io.py --runs 5 --pdf tests/test_pdfs/public_guardian_sample.pdf
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETUP = """
+import json, resource, subprocess, time
+from io import BytesIO
+
+from app import create_app
+from app.transformation import CMYK_GHOSTSCRIPT_ARGS, CMYK_GHOSTSCRIPT_POSTSCRIPT, convert_pdf_to_cmyk
+
+application = create_app()
+application.config["GHOSTSCRIPT_ENGINE"] = "subprocess"
+
+with open({pdf!r}, "rb") as f:
+    pdf = f.read()
+"""
+
+PIPE = (
+    SETUP
+    + """
+def convert(input_data):
+    gs_process = subprocess.Popen(
+        ["gs", "-q", "-o", "-", *CMYK_GHOSTSCRIPT_ARGS, "-c", CMYK_GHOSTSCRIPT_POSTSCRIPT, "-f", "-"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    stdout, _ = gs_process.communicate(input=input_data.read())
+    assert gs_process.returncode == 0
+    return BytesIO(stdout)
+"""
+)
+
+FILE = (
+    SETUP
+    + """
+convert = convert_pdf_to_cmyk
+"""
+)
+
+MEASURE = """
+with application.app_context():
+    start = time.perf_counter()
+    for _ in range({conversions}):
+        output = convert(BytesIO(pdf)).read()
+    finished = time.perf_counter()
+
+ok = output.startswith(b"%PDF")
+python_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+gs_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+print(json.dumps({{"time": (finished - start) / {conversions}, "python": python_rss, "gs": gs_rss, "ok": ok}}))
+"""
+
+APPROACHES = {
+    "pipe": PIPE,
+    "file": FILE,
+}
+
+
+def _run_once(template, pdf, conversions):
+    env = {
+        "NOTIFY_ENVIRONMENT": "test",
+        "NOTIFICATION_QUEUE_PREFIX": "benchmark",
+        **os.environ,
+    }
+    code = (template + MEASURE).format(pdf=pdf, conversions=conversions)
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    # the app may log to stdout as well, our result is always the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to start per approach")
+    parser.add_argument("--conversions", type=int, default=3, help="conversions per interpreter")
+    parser.add_argument(
+        "--pdf",
+        default=os.path.join(REPO_ROOT, "tests", "test_pdfs", "public_guardian_sample.pdf"),
+        help="PDF to convert to CMYK",
+    )
+    args = parser.parse_args()
+
+    out = sys.stdout
+    out.write(f"{'approach':<10}{'time (median/min)':>22}{'python peak RSS':>18}{'gs peak RSS':>14}\n")
+
+    for name, template in APPROACHES.items():
+        runs = [_run_once(template, args.pdf, args.conversions) for _ in range(args.runs)]
+
+        if not all(run["ok"] for run in runs):
+            raise SystemExit(f"{name}: conversion did not produce a PDF")
+
+        times = [run["time"] for run in runs]
+        # ru_maxrss is in kilobytes on Linux
+        python_rss = statistics.median(run["python"] for run in runs) / 1024
+        gs_rss = statistics.median(run["gs"] for run in runs) / 1024
+        out.write(
+            f"{name:<10}"
+            f"{statistics.median(times):>13.3f}s / {min(times):.3f}s"
+            f"{python_rss:>15.1f}MiB"
+            f"{gs_rss:>11.1f}MiB\n"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Measures how long the web app (wsgi.py) and the celery worker (run_celery.py) take to start, and how long the first
+piece of real work takes afterwards - which is when any lazily imported dependencies get loaded.
+
+Every run happens in a fresh interpreter, so nothing is shared between runs. We report the median and the fastest run
+for each entry point, as well as which of the heavy PDF libraries had already been imported once start-up finished.
+
+    python scripts/benchmark_startup.py --runs 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["boto3", "pdf2image", "pymupdf", "reportlab.pdfgen", "wand", "weasyprint"]
+
+BENCHMARK_SECRET = "benchmark-secret"
+
+WEB = """
+import json, sys, time
+
+start = time.perf_counter()
+import wsgi
+imported = time.perf_counter()
+loaded = [module for module in {heavy_modules!r} if module in sys.modules]
+
+with open({pdf!r}, "rb") as f:
+    response = wsgi.application.test_client().post(
+        "/precompiled/sanitise", data=f.read(), headers={{"Authorization": "Token {secret}"}}
+    )
+finished = time.perf_counter()
+ok = response.status_code == 200
+
+print(json.dumps({{"import": imported - start, "first": finished - imported, "loaded": loaded, "ok": ok}}))
+"""
+
+WORKER = """
+import json, sys, time
+
+start = time.perf_counter()
+import run_celery
+imported = time.perf_counter()
+loaded = [module for module in {heavy_modules!r} if module in sys.modules]
+
+from app.precompiled import sanitise_letter
+
+with open({pdf!r}, "rb") as f, run_celery.application.app_context():
+    result = sanitise_letter(f.read(), allow_international_letters=False, filename="benchmark")
+finished = time.perf_counter()
+ok = not result.message
+
+print(json.dumps({{"import": imported - start, "first": finished - imported, "loaded": loaded, "ok": ok}}))
+"""
+
+ENTRY_POINTS = {
+    "wsgi.py": WEB,
+    "run_celery.py": WORKER,
+}
+
+
+def _run_once(template, pdf):
+    env = {
+        "NOTIFY_ENVIRONMENT": "test",
+        "NOTIFICATION_QUEUE_PREFIX": "benchmark",
+        **os.environ,
+        "TEMPLATE_PREVIEW_INTERNAL_SECRETS": json.dumps([BENCHMARK_SECRET]),
+    }
+    code = template.format(heavy_modules=HEAVY_MODULES, pdf=pdf, secret=BENCHMARK_SECRET)
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    # the app may log to stdout as well, our result is always the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to start per entry point")
+    parser.add_argument(
+        "--pdf",
+        default=os.path.join(REPO_ROOT, "tests", "test_pdfs", "blank_with_address.pdf"),
+        help="precompiled letter to sanitise as the first piece of work",
+    )
+    args = parser.parse_args()
+
+    out = sys.stdout
+    out.write(f"{'entry point':<16}{'import (median/min)':>24}{'first request (median/min)':>32}  loaded at start-up\n")
+
+    for name, template in ENTRY_POINTS.items():
+        runs = [_run_once(template, args.pdf) for _ in range(args.runs)]
+
+        if not all(run["ok"] for run in runs):
+            raise SystemExit(f"{name}: first request did not succeed, so its timings would be misleading")
+
+        import_times = [run["import"] for run in runs]
+        first_times = [run["first"] for run in runs]
+        out.write(
+            f"{name:<16}"
+            f"{statistics.median(import_times):>15.3f}s / {min(import_times):.3f}s"
+            f"{statistics.median(first_times):>23.3f}s / {min(first_times):.3f}s"
+            f"  {', '.join(runs[0]['loaded']) or '-'}\n"
+        )
+
+
+if __name__ == "__main__":
+    main()
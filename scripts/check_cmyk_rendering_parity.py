@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""
+Checks that templated letters rendered in CMYK by WeasyPrint (WEASYPRINT_CMYK_RENDERING) look the same as letters
+rendered in RGB and converted to CMYK by Ghostscript, which is how we used to make every print letter.
+
+Each letter is made both ways and rasterised in CMYK by Ghostscript, then we report the biggest difference in any
+ink channel. Letters are made from the templates the tests use, with and without each branding logo given.
+
+    python scripts/check_cmyk_rendering_parity.py --logo hm-government --logo nhs
+"""
+
+import argparse
+import copy
+import os
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LETTER = {
+    "letter_contact_block": "Department for Work and Pensions\nCaxton House\nLondon\nSW1H 9NA",
+    "template": {
+        "id": 1,
+        "template_type": "letter",
+        "letter_languages": "english",
+        "subject": "Your ((benefit)) payments",
+        "content": (
+            "Dear ((name)),\n\n"
+            "# Changes to your payments\n\n"
+            "Your payments will go up on ((date)).\n\n"
+            "* first point\n* second point\n\n"
+            "---\n\n"
+            "^ Read this carefully.\n\n"
+            "1. one\n2. two\n\n"
+            "Yours sincerely"
+        ),
+        "letter_welsh_subject": None,
+        "letter_welsh_content": None,
+        "updated_at": "2017-08-01",
+        "version": 1,
+        "service": "1234",
+    },
+    "values": {
+        "address_line_1": "A. Person",
+        "address_line_2": "1 Street",
+        "postcode": "SW1A 1AA",
+        "name": "A. Person",
+        "benefit": "pension",
+        "date": "1 April",
+    },
+    "logo_filename": None,
+    "letter_filename": "PARITY.PDF",
+    "notification_id": "parity",
+    "key_type": "normal",
+}
+
+
+def _letters(logos):
+    for logo in [None, *logos]:
+        for languages in ("english", "welsh_then_english"):
+            letter = copy.deepcopy(LETTER)
+            letter["logo_filename"] = logo
+            letter["template"]["letter_languages"] = languages
+            if languages == "welsh_then_english":
+                letter["template"]["letter_welsh_subject"] = "Eich taliadau ((benefit))"
+                letter["template"]["letter_welsh_content"] = LETTER["template"]["content"]
+            yield f"{logo or 'no logo'}, {languages}", letter
+
+
+def _rasterise(pdf, directory, name, dpi):
+    pdf_path = os.path.join(directory, f"{name}.pdf")
+    with open(pdf_path, "wb") as f:
+        f.write(pdf.read())
+
+    subprocess.run(
+        ["gs", "-q", "-o", os.path.join(directory, f"{name}-%03d.tif"), "-sDEVICE=tiff32nc", f"-r{dpi}", pdf_path],
+        check=True,
+    )
+    return sorted(
+        os.path.join(directory, filename)
+        for filename in os.listdir(directory)
+        if filename.startswith(f"{name}-") and filename.endswith(".tif")
+    )
+
+
+def _max_ink_difference(expected_pages, actual_pages):
+    from PIL import Image, ImageChops
+
+    if len(expected_pages) != len(actual_pages):
+        raise SystemExit(f"page counts differ: {len(expected_pages)} != {len(actual_pages)}")
+
+    difference = 0
+    for expected_page, actual_page in zip(expected_pages, actual_pages, strict=True):
+        with Image.open(expected_page) as expected, Image.open(actual_page) as actual:
+            extrema = ImageChops.difference(expected, actual).getextrema()
+            difference = max(difference, *(channel_max for _, channel_max in extrema))
+    return difference
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logo", action="append", default=[], help="letter branding to include, as on the logo host")
+    parser.add_argument("--dpi", type=int, default=150, help="resolution to compare pages at")
+    parser.add_argument(
+        "--tolerance", type=int, default=3, help="largest difference in any ink channel (0-255) we accept"
+    )
+    args = parser.parse_args()
+
+    os.environ.setdefault("NOTIFY_ENVIRONMENT", "test")
+    os.environ.setdefault("NOTIFICATION_QUEUE_PREFIX", "parity")
+    os.chdir(REPO_ROOT)
+    sys.path.insert(0, REPO_ROOT)
+
+    from app import create_app
+    from app.celery.tasks import _prepare_pdf
+
+    application = create_app()
+    out = sys.stdout
+    out.write(f"{'letter':<40}{'max ink difference':>20}\n")
+
+    failed = False
+    with application.app_context(), tempfile.TemporaryDirectory() as directory:
+        for name, letter in _letters(args.logo):
+            # the old pipeline: RGB rendering, then Ghostscript
+            application.config["WEASYPRINT_CMYK_RENDERING"] = False
+            application.config["CMYK_VECTOR_CONVERSION"] = False
+            expected = _prepare_pdf(letter, self=None)
+
+            application.config["WEASYPRINT_CMYK_RENDERING"] = True
+            application.config["CMYK_VECTOR_CONVERSION"] = True
+            actual = _prepare_pdf(letter, self=None)
+
+            slug = name.replace(" ", "-").replace(",", "")
+            difference = _max_ink_difference(
+                _rasterise(expected, directory, f"{slug}-expected", args.dpi),
+                _rasterise(actual, directory, f"{slug}-actual", args.dpi),
+            )
+            failed = failed or difference > args.tolerance
+            out.write(f"{name:<40}{difference:>20}{'' if difference <= args.tolerance else '  FAILED'}\n")
+
+    if failed:
+        raise SystemExit(f"some letters differ by more than {args.tolerance}")
+
+
+if __name__ == "__main__":
+    main()
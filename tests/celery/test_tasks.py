@@ -1,4 +1,3 @@
-import base64
 import logging
 import uuid
 from contextlib import contextmanager
@@ -27,7 +26,9 @@ from app.celery.tasks import (
 )
 from app.config import QueueNames
 from app.utils import get_transient_letter_file_location
+from app.vector_cmyk import is_pdf_device_cmyk
 from app.weasyprint_hack import WeasyprintError
+from tests.conftest import set_config
 from tests.pdf_consts import bad_postcode, blank_with_address, multi_page_pdf, no_colour
 
 
@@ -485,7 +486,7 @@ def test_recreate_pdf_for_precompiled_letter(mocker, client):
         Body=valid_file.read(),
     )
 
-    sanitise_spy = mocker.spy(app.celery.tasks, "sanitise_file_contents")
+    sanitise_spy = mocker.spy(app.celery.tasks, "sanitise_letter")
 
     recreate_pdf_for_precompiled_letter("1234-abcd", "2021-10-10/NOTIFY.REF.D.2.C.202110101330.PDF", True)
 
@@ -494,7 +495,7 @@ def test_recreate_pdf_for_precompiled_letter(mocker, client):
     # the final letters bucket contains the recreated PDF
     assert [o.key for o in final_letters_bucket.objects.all()] == ["2021-10-10/NOTIFY.REF.D.2.C.202110101330.PDF"]
 
-    # Check that the file in the final letters bucket has been through the `sanitise_file_contents` function
+    # Check that the file in the final letters bucket has been through the `sanitise_letter` function
     sanitised_file_contents = (
         conn.Object(
             current_app.config["LETTERS_PDF_BUCKET_NAME"],
@@ -503,7 +504,7 @@ def test_recreate_pdf_for_precompiled_letter(mocker, client):
         .get()["Body"]
         .read()
     )
-    assert base64.b64decode(sanitise_spy.spy_return["file"].encode()) == sanitised_file_contents
+    assert sanitise_spy.spy_return.file == sanitised_file_contents
 
 
 @mock_aws
@@ -585,6 +586,50 @@ def test_create_pdf_for_letter_notify_tagging(client, includes_first_page):
     assert ("NOTIFY" in PdfReader(pdf).pages[0].extract_text()) is includes_first_page
 
 
+@pytest.mark.parametrize("cmyk_rendering", (True, False))
+def test_create_pdf_for_letter_can_render_in_cmyk(client, cmyk_rendering):
+    with set_config(client.application, "WEASYPRINT_CMYK_RENDERING", cmyk_rendering):
+        pdf = _create_pdf_for_letter(
+            task=None,
+            letter_details={
+                "template": {"template_type": "letter", "subject": "subject", "content": "content"},
+                "values": {},
+                "letter_contact_block": "",
+                "logo_filename": "",
+            },
+            language="english",
+        )
+
+    assert is_pdf_device_cmyk(pdf) is cmyk_rendering
+
+
+def test_prepare_pdf_does_not_convert_letters_rendered_in_cmyk(
+    client, mocker, welsh_data_for_create_pdf_for_templated_letter_task
+):
+    mock_convert_pdf_to_cmyk = mocker.patch("app.templated.convert_pdf_to_cmyk")
+
+    pdf = _prepare_pdf(welsh_data_for_create_pdf_for_templated_letter_task, self=None)
+
+    mock_convert_pdf_to_cmyk.assert_not_called()
+    assert pdf.read(9) == b"%PDF-1.7\n"
+    pdf.seek(0)
+    assert is_pdf_device_cmyk(pdf)
+
+
+def test_prepare_pdf_converts_letters_without_checking_them_if_not_rendered_in_cmyk(
+    client, mocker, welsh_data_for_create_pdf_for_templated_letter_task
+):
+    mock_is_pdf_device_cmyk = mocker.patch("app.templated.is_pdf_device_cmyk")
+    mock_convert_pdf_to_cmyk = mocker.patch("app.templated.convert_pdf_to_cmyk", return_value=BytesIO(b"cmyk pdf"))
+
+    with set_config(client.application, "WEASYPRINT_CMYK_RENDERING", False):
+        pdf = _prepare_pdf(welsh_data_for_create_pdf_for_templated_letter_task, self=None)
+
+    mock_is_pdf_device_cmyk.assert_not_called()
+    mock_convert_pdf_to_cmyk.assert_called_once()
+    assert pdf.read() == b"cmyk pdf"
+
+
 @pytest.mark.parametrize(
     "letter_content",
     [
@@ -649,7 +694,7 @@ def test_recreate_pdf_for_template_letter_attachments(mocker, client):
         Body=valid_file.read(),
     )
 
-    sanitise_spy = mocker.spy(app.celery.tasks, "sanitise_file_contents")
+    sanitise_spy = mocker.spy(app.celery.tasks, "sanitise_letter")
 
     recreate_pdf_for_template_letter_attachments(service_id, attachment_id, "1234-abcd.pdf")
 
@@ -660,7 +705,7 @@ def test_recreate_pdf_for_template_letter_attachments(mocker, client):
         get_transient_letter_file_location(service_id, attachment_id)
     ]
 
-    # Check that the file in the final letters bucket has been through the `sanitise_file_contents` function
+    # Check that the file in the final letters bucket has been through the `sanitise_letter` function
     sanitised_file_contents = (
         conn.Object(
             current_app.config["LETTER_ATTACHMENT_BUCKET_NAME"],
@@ -669,7 +714,7 @@ def test_recreate_pdf_for_template_letter_attachments(mocker, client):
         .get()["Body"]
         .read()
     )
-    assert base64.b64decode(sanitise_spy.spy_return["file"].encode()) == sanitised_file_contents
+    assert sanitise_spy.spy_return.file == sanitised_file_contents
 
 
 @mock_aws
@@ -124,6 +124,16 @@ def mocked_cache_set(mocker):
     return mocker.patch("app.s3upload")
 
 
+@pytest.fixture(autouse=True)
+def mocked_letter_cache_get(mocker):
+    return mocker.patch("app.letter_cache.s3download", side_effect=S3ObjectNotFound({}, ""))
+
+
+@pytest.fixture(autouse=True)
+def mocked_letter_cache_set(mocker):
+    return mocker.patch("app.letter_cache.s3upload")
+
+
 @contextmanager
 def set_config(app, name, value):
     old_val = app.config.get(name)
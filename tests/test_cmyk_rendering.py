@@ -0,0 +1,145 @@
+import base64
+from io import BytesIO
+
+import pytest
+from pypdf import PdfReader
+from pypdf.generic import ContentStream
+from weasyprint import CSS, HTML
+from weasyprint.urls import URLFetcher, URLFetcherResponse
+
+from app.cmyk_rendering import (
+    CMYKURLFetcher,
+    default_colour_css,
+    device_cmyk_css,
+    device_cmyk_html,
+    device_cmyk_svg,
+)
+from app.vector_cmyk import convert_vector_pdf_to_cmyk, is_pdf_device_cmyk
+
+BLACK = "device-cmyk(0.0 0.0 0.0 1.0)"
+RED = "device-cmyk(0.0 0.9665 0.9227 0.0)"
+
+LOGO_SVG = (
+    b'<svg xmlns="http://www.w3.org/2000/svg" width="40" height="40">'
+    b'<circle cx="20" cy="20" r="10" fill="#00703c" /><rect width="5" height="5" /></svg>'
+)
+
+LETTER_HTML = f"""
+<html>
+  <head>
+    <style>
+      h1 {{ color: #0b0c0c; border-bottom: 2px solid rgb(212, 53, 28); }}
+      .panel {{ background: #1d70b8; color: white; }}
+    </style>
+  </head>
+  <body>
+    <h1>Your letter</h1>
+    <p class="panel">Some text on a coloured background</p>
+    <p style="color: #505a5f">Some grey text</p>
+    <p>Some text in the default colour</p>
+    <img src="data:image/svg+xml;base64,{base64.b64encode(LOGO_SVG).decode()}">
+  </body>
+</html>
+"""
+
+
+@pytest.mark.parametrize(
+    "css, expected_css",
+    [
+        ("p { color: red }", f"p {{ color: {RED} ;}}"),
+        ("p { border: 1px solid #000 !important }", f"p {{ border: 1px solid {BLACK} !important;}}"),
+        ("@media print { .red { color: rgb(255, 0, 0) } }", f"@media print {{ .red {{ color: {RED} ;}} }}"),
+        ("@page { @top-left { color: red } }", f"@page {{ @top-left {{ color: {RED} ;}} }}"),
+        # things that aren't colours, or colours we leave for Ghostscript
+        ("p { font-family: Red }", "p { font-family: Red ;}"),
+        ("p { color: rgba(255, 0, 0, 0.5) }", "p { color: rgba(255, 0, 0, 0.5) ;}"),
+        (
+            "p { color: transparent; border-color: currentcolor }",
+            "p { color: transparent; border-color: currentcolor ;}",
+        ),
+        ("p { background: linear-gradient(red, blue) }", "p { background: linear-gradient(red, blue) ;}"),
+    ],
+)
+def test_device_cmyk_css(css, expected_css):
+    assert device_cmyk_css(css) == expected_css
+
+
+def test_device_cmyk_html_converts_stylesheets_and_style_attributes():
+    html = (
+        "<html><head><style>p { color: red }</style></head>"
+        '<body><p style="color: #000">style="color: red" &lt;b style="color: red"&gt;</p></body></html>'
+    )
+
+    assert device_cmyk_html(html) == (
+        f"<html><head><style>p {{ color: {RED} ;}}</style></head>"
+        f'<body><p style="color: {BLACK};">style="color: red" &lt;b style="color: red"&gt;</p></body></html>'
+    )
+
+
+def test_device_cmyk_svg():
+    svg = (
+        b'<svg xmlns="http://www.w3.org/2000/svg" fill-rule="evenodd">'
+        b"<style><![CDATA[.a { fill: red }]]></style>"
+        b'<path fill="#000" stroke=\'none\' d="M0 0"/><rect style="stroke: red" class="a"/></svg>'
+    )
+
+    assert (
+        device_cmyk_svg(svg)
+        == (
+            f'<svg xmlns="http://www.w3.org/2000/svg" fill-rule="evenodd" fill="{BLACK}">'
+            f"<style><![CDATA[.a {{ fill: {RED} ;}}]]></style>"
+            f'<path fill="{BLACK}" stroke="none" d="M0 0"/><rect style="stroke: {RED};" class="a"/></svg>'
+        ).encode()
+    )
+
+
+def test_device_cmyk_svg_keeps_existing_default_fill():
+    assert device_cmyk_svg(b'<svg fill="red"></svg>') == f'<svg fill="{RED}"></svg>'.encode()
+
+
+def test_cmyk_url_fetcher_converts_svgs(mocker):
+    mocker.patch.object(
+        URLFetcher,
+        "fetch",
+        return_value=URLFetcherResponse("https://example.com/hm-government.svg", b'<svg fill="red"></svg>'),
+    )
+
+    response = CMYKURLFetcher().fetch("https://example.com/hm-government.svg")
+
+    assert response.read() == f'<svg fill="{RED}"></svg>'.encode()
+
+
+def test_cmyk_url_fetcher_leaves_other_files_alone(mocker):
+    png = URLFetcherResponse("https://example.com/logo.png", b"\x89PNG", {"Content-Type": "image/png"})
+    mocker.patch.object(URLFetcher, "fetch", return_value=png)
+
+    assert CMYKURLFetcher().fetch("https://example.com/logo.png") is png
+
+
+def _colours(pdf):
+    colours = set()
+    reader = PdfReader(pdf)
+
+    def add_colours(content, resources):
+        for operands, operator in content.operations:
+            if operator.lower() in (b"k", b"sc", b"scn") and len(operands) == 4:
+                colours.add(tuple(round(float(operand), 4) for operand in operands))
+        for xobject in resources.get("/XObject", {}).values():
+            xobject = xobject.get_object()
+            if xobject["/Subtype"] == "/Form":
+                add_colours(ContentStream(xobject, reader), xobject.get("/Resources", {}))
+
+    for page in reader.pages:
+        add_colours(page.get_contents(), page["/Resources"])
+    return colours
+
+
+def test_cmyk_rendering_matches_converting_rgb_rendering(client):
+    # What we'd have got by rendering in RGB and converting to CMYK afterwards, as Ghostscript would
+    converted = convert_vector_pdf_to_cmyk(BytesIO(HTML(string=LETTER_HTML).write_pdf()))
+
+    html = HTML(string=device_cmyk_html(LETTER_HTML), url_fetcher=CMYKURLFetcher())
+    rendered = BytesIO(html.write_pdf(stylesheets=[CSS(string=default_colour_css())]))
+
+    assert is_pdf_device_cmyk(rendered)
+    assert _colours(rendered) == _colours(converted)
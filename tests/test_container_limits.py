@@ -0,0 +1,128 @@
+import pytest
+
+from container_limits import (
+    celery_concurrency,
+    get_cpu_limit,
+    get_memory_limit,
+    subprocess_concurrency,
+    web_worker_count,
+)
+
+GiB = 1024 * 1024 * 1024
+
+
+@pytest.fixture
+def cgroup(tmp_path, mocker):
+    mocker.patch("container_limits.CGROUP_ROOT", str(tmp_path))
+    mocker.patch("os.sched_getaffinity", return_value=set(range(8)))
+
+    def write(path, contents):
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text(contents + "\n")
+
+    return write
+
+
+@pytest.fixture(autouse=True)
+def no_overrides(monkeypatch):
+    for env_var in ("WEB_WORKERS", "CONCURRENCY", "MAX_SUBPROCESSES"):
+        monkeypatch.delenv(env_var, raising=False)
+    subprocess_concurrency.cache_clear()
+    yield
+    subprocess_concurrency.cache_clear()
+
+
+@pytest.mark.parametrize(
+    "files, expected_cpus",
+    [
+        ({}, None),
+        ({"cpu.max": "max 100000"}, None),
+        ({"cpu.max": "150000 100000"}, 1.5),
+        ({"cpu.max": "2000000 100000"}, 8),
+        ({"cpu/cpu.cfs_quota_us": "-1", "cpu/cpu.cfs_period_us": "100000"}, None),
+        ({"cpu/cpu.cfs_quota_us": "200000", "cpu/cpu.cfs_period_us": "100000"}, 2),
+    ],
+    ids=["no-cgroup", "v2-unlimited", "v2-quota", "v2-quota-above-available", "v1-unlimited", "v1-quota"],
+)
+def test_get_cpu_limit(cgroup, files, expected_cpus):
+    for path, contents in files.items():
+        cgroup(path, contents)
+
+    assert get_cpu_limit() == expected_cpus
+
+
+@pytest.mark.parametrize(
+    "files, expected_memory",
+    [
+        ({}, None),
+        ({"memory.max": "max"}, None),
+        ({"memory.max": str(2 * GiB)}, 2 * GiB),
+        ({"memory/memory.limit_in_bytes": "9223372036854771712"}, None),
+        ({"memory/memory.limit_in_bytes": str(GiB)}, GiB),
+    ],
+    ids=["no-cgroup", "v2-unlimited", "v2-limit", "v1-unlimited", "v1-limit"],
+)
+def test_get_memory_limit(cgroup, files, expected_memory):
+    for path, contents in files.items():
+        cgroup(path, contents)
+
+    assert get_memory_limit() == expected_memory
+
+
+@pytest.mark.parametrize(
+    "cpus, memory, expected_web_workers, expected_celery_concurrency, expected_subprocesses",
+    [
+        ("200000 100000", "max", 5, 2, 2),
+        ("200000 100000", str(1 * GiB), 2, 2, 2),
+        ("50000 100000", str(8 * GiB), 2, 1, 1),
+        ("400000 100000", str(256 * 1024 * 1024), 1, 1, 1),
+    ],
+)
+def test_worker_counts_are_derived_from_limits(
+    cgroup, cpus, memory, expected_web_workers, expected_celery_concurrency, expected_subprocesses
+):
+    cgroup("cpu.max", cpus)
+    cgroup("memory.max", memory)
+
+    assert web_worker_count() == expected_web_workers
+    assert celery_concurrency() == expected_celery_concurrency
+    assert subprocess_concurrency() == expected_subprocesses
+
+
+def test_worker_counts_can_be_overridden(cgroup, monkeypatch):
+    cgroup("cpu.max", "100000 100000")
+    monkeypatch.setenv("WEB_WORKERS", "7")
+    monkeypatch.setenv("CONCURRENCY", "3")
+    monkeypatch.setenv("MAX_SUBPROCESSES", "9")
+
+    assert web_worker_count() == 7
+    assert celery_concurrency() == 3
+    assert subprocess_concurrency() == 9
+
+
+@pytest.mark.parametrize(
+    "memory, expected_web_workers, expected_celery_concurrency, expected_subprocesses",
+    [
+        ("max", 5, 4, 8),
+        (str(1 * GiB), 2, 2, 3),
+    ],
+)
+def test_worker_counts_without_a_cpu_quota(
+    cgroup, memory, expected_web_workers, expected_celery_concurrency, expected_subprocesses
+):
+    cgroup("cpu.max", "max 100000")
+    cgroup("memory.max", memory)
+
+    assert web_worker_count() == expected_web_workers
+    assert celery_concurrency() == expected_celery_concurrency
+    assert subprocess_concurrency() == expected_subprocesses
+
+
+@pytest.mark.parametrize("value", ["0", "-2"])
+def test_worker_count_overrides_are_at_least_one(cgroup, monkeypatch, value):
+    for env_var in ("WEB_WORKERS", "CONCURRENCY", "MAX_SUBPROCESSES"):
+        monkeypatch.setenv(env_var, value)
+
+    assert web_worker_count() == 1
+    assert celery_concurrency() == 1
+    assert subprocess_concurrency() == 1
@@ -0,0 +1,134 @@
+import errno
+import hashlib
+import os
+from unittest.mock import Mock
+
+import pytest
+
+from app.document_store import DocumentStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return DocumentStore(str(tmp_path))
+
+
+@pytest.fixture
+def mock_time(mocker):
+    return mocker.patch("app.document_store.time.time", return_value=1000)
+
+
+def test_add_returns_a_hash_of_the_document(store):
+    handle = store.add(b"pdf", page_count=2, ttl=60, max_size=100)
+
+    assert handle == hashlib.sha256(b"pdf").hexdigest()
+    assert store.get(handle, ttl=60)[:2] == (b"pdf", 2)
+
+
+def test_documents_are_shared_by_every_store_using_the_same_directory(tmp_path):
+    handle = DocumentStore(str(tmp_path)).add(b"pdf", page_count=2, ttl=60, max_size=100)
+
+    assert DocumentStore(str(tmp_path)).get(handle, ttl=60)[:2] == (b"pdf", 2)
+    assert DocumentStore(str(tmp_path / "other")).get(handle, ttl=60) is None
+
+
+def test_add_does_not_keep_documents_bigger_than_the_store(store, tmp_path):
+    assert store.add(b"pdf", page_count=1, ttl=60, max_size=2) is None
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize("handle", ["../pdf", f"../{'a' * 64}", "a" * 63, "A" * 64])
+def test_get_only_looks_for_handles_that_could_be_hashes(store, handle):
+    assert store.get(handle, ttl=60) is None
+
+
+def test_get_forgets_documents_that_have_not_been_used_for_the_ttl(store, mock_time):
+    handle = store.add(b"pdf", page_count=1, ttl=60, max_size=100)
+
+    mock_time.return_value = 1059
+    assert store.get(handle, ttl=60)
+    # using it keeps it for longer
+    mock_time.return_value = 1118
+    assert store.get(handle, ttl=60)
+    mock_time.return_value = 1178
+    assert store.get(handle, ttl=60) is None
+
+
+def test_add_forgets_documents_that_have_not_been_used_for_the_ttl(store, tmp_path, mock_time):
+    store.add(b"first", page_count=1, ttl=60, max_size=100)
+
+    mock_time.return_value = 1060
+    second = store.add(b"second", page_count=1, ttl=60, max_size=100)
+
+    assert os.listdir(tmp_path) == [f"{second}.1.pdf"]
+
+
+def test_add_forgets_least_recently_used_documents_when_full(store, mock_time):
+    first = store.add(b"first", page_count=1, ttl=60, max_size=10)
+    mock_time.return_value = 1001
+    second = store.add(b"secnd", page_count=1, ttl=60, max_size=10)
+    mock_time.return_value = 1002
+    store.get(first, ttl=60)
+
+    mock_time.return_value = 1003
+    third = store.add(b"third", page_count=1, ttl=60, max_size=10)
+
+    assert store.get(first, ttl=60)
+    assert store.get(second, ttl=60) is None
+    assert store.get(third, ttl=60)
+
+
+def test_store_only_uses_a_share_of_the_free_space(store, mocker, mock_time):
+    # documents can only use a quarter of the space that is free or already theirs, which is 10 to 12 bytes here
+    mocker.patch("app.document_store.os.statvfs", return_value=Mock(f_bavail=40, f_frsize=1))
+
+    assert store.add(b"eleven byte", page_count=1, ttl=60, max_size=100) is None
+    first = store.add(b"first", page_count=1, ttl=60, max_size=100)
+    mock_time.return_value = 1001
+    second = store.add(b"secnd", page_count=1, ttl=60, max_size=100)
+    mock_time.return_value = 1002
+    third = store.add(b"third", page_count=1, ttl=60, max_size=100)
+
+    assert store.get(first, ttl=60) is None
+    assert store.get(second, ttl=60)
+    assert store.get(third, ttl=60)
+
+
+def test_add_returns_none_if_the_document_cant_be_written(client, store, tmp_path, mocker):
+    mocker.patch("app.document_store.os.fdopen", side_effect=OSError(errno.ENOSPC, "No space left on device"))
+
+    assert store.add(b"pdf", page_count=1, ttl=60, max_size=100) is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_add_writes_the_document_again_if_another_worker_removes_it(store, tmp_path, mocker):
+    handle = store.add(b"pdf", page_count=1, ttl=60, max_size=100)
+    utime = os.utime
+
+    def removed_by_another_worker(path, times):
+        os.unlink(path)
+        mock_utime.side_effect = utime
+        raise FileNotFoundError
+
+    mock_utime = mocker.patch("app.document_store.os.utime", side_effect=removed_by_another_worker)
+
+    assert store.add(b"pdf", page_count=1, ttl=60, max_size=100) == handle
+    assert store.get(handle, ttl=60)[:2] == (b"pdf", 1)
+
+
+def test_adding_a_document_again_does_not_count_it_twice(store):
+    handle = store.add(b"pdf", page_count=1, ttl=60, max_size=5)
+    store.add(b"pdf", page_count=1, ttl=60, max_size=5)
+    other = store.add(b"pd", page_count=1, ttl=60, max_size=5)
+
+    assert store.get(handle, ttl=60)
+    assert store.get(other, ttl=60)
+
+
+def test_clear(store, tmp_path):
+    handle = store.add(b"pdf", page_count=1, ttl=60, max_size=100)
+
+    store.clear()
+
+    assert store.get(handle, ttl=60) is None
+    assert os.listdir(tmp_path) == []
@@ -29,7 +29,7 @@ def test_contains_unembedded_fonts(client, pdf_file, has_unembedded_fonts):
     assert bool(contains_unembedded_fonts(pdf_file)) == has_unembedded_fonts
 
 
-def test_embed_fonts():
+def test_embed_fonts(client):
     input_pdf = BytesIO(multi_page_pdf)
     assert contains_unembedded_fonts(input_pdf)
 
@@ -38,7 +38,7 @@ def test_embed_fonts():
     assert not contains_unembedded_fonts(new_pdf)
 
 
-def test_embed_fonts_does_not_rotate_pages():
+def test_embed_fonts_does_not_rotate_pages(client):
     file_with_rotated_text = BytesIO(portrait_rotated_page)
 
     new_pdf = PdfReader(embed_fonts(file_with_rotated_text))
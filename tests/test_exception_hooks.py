@@ -7,7 +7,7 @@ from pypdf.errors import PdfStreamError
 from weasyprint import HTML
 
 from app import InvalidRequest, configure_global_logging
-from app.precompiled import does_pdf_contain_cmyk
+from app.transformation import does_pdf_contain_cmyk
 from app.weasyprint_hack import WeasyprintError
 
 
@@ -0,0 +1,149 @@
+import os
+from io import BytesIO
+from unittest.mock import Mock
+
+import pytest
+from botocore.exceptions import ClientError as BotoClientError
+
+from app.embedded_fonts import embed_fonts
+from app.ghostscript_cache import (
+    GHOSTSCRIPT_RESOURCES_DIR,
+    cached_ghostscript_output,
+    ghostscript_resources_dir,
+    letter_cache,
+)
+from app.transformation import convert_pdf_to_cmyk
+from tests.conftest import set_config
+
+
+@pytest.fixture(autouse=True)
+def ghostscript_cache(client, mocker):
+    mocker.patch("app.ghostscript_cache.ghostscript_version", return_value="10.02.1")
+    letter_cache.local_tier.clear()
+    with set_config(client.application, "GHOSTSCRIPT_CACHE", True):
+        yield
+    letter_cache.local_tier.clear()
+
+
+def test_cached_ghostscript_output_only_runs_ghostscript_once(mocked_letter_cache_get, mocked_letter_cache_set):
+    run_ghostscript = Mock(return_value=BytesIO(b"output"))
+
+    for _ in range(3):
+        input_data = BytesIO(b"input")
+        assert cached_ghostscript_output(input_data, ["-sDEVICE=pdfwrite"], "", run_ghostscript).read() == b"output"
+        assert input_data.tell() == 0
+
+    assert run_ghostscript.call_count == 1
+    # after the first conversion, outputs come from memory
+    cache_key = mocked_letter_cache_get.call_args.args[1]
+    mocked_letter_cache_get.assert_called_once_with("test-template-preview-cache", cache_key)
+    mocked_letter_cache_set.assert_called_once_with(
+        filedata=b"output",
+        region="eu-west-1",
+        bucket_name="test-template-preview-cache",
+        file_location=cache_key,
+    )
+    assert cache_key.startswith("ghostscript/")
+
+
+def test_cached_ghostscript_output_uses_output_from_letter_cache(mocked_letter_cache_get, mocked_letter_cache_set):
+    mocked_letter_cache_get.side_effect = None
+    mocked_letter_cache_get.return_value = BytesIO(b"cached output")
+    run_ghostscript = Mock()
+
+    assert cached_ghostscript_output(BytesIO(b"input"), [], "", run_ghostscript).read() == b"cached output"
+
+    run_ghostscript.assert_not_called()
+    mocked_letter_cache_set.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "input_bytes, args, postscript, version",
+    [
+        (b"other input", ["-sDEVICE=pdfwrite"], "", "10.02.1"),
+        (b"input", ["-sDEVICE=pdfwrite", "-dAutoRotatePages=/None"], "", "10.02.1"),
+        (b"input", ["-sDEVICE=pdfwrite"], "<</NeverEmbed [ ]>> setdistillerparams", "10.02.1"),
+        (b"input", ["-sDEVICE=pdfwrite"], "", "10.03.0"),
+    ],
+)
+def test_cached_ghostscript_output_is_keyed_on_input_version_and_arguments(
+    mocker, mocked_letter_cache_get, mocked_letter_cache_set, input_bytes, args, postscript, version
+):
+    cached_ghostscript_output(BytesIO(b"input"), ["-sDEVICE=pdfwrite"], "", Mock(return_value=BytesIO(b"output")))
+
+    mocker.patch("app.ghostscript_cache.ghostscript_version", return_value=version)
+    run_ghostscript = Mock(return_value=BytesIO(b"other output"))
+
+    assert cached_ghostscript_output(BytesIO(input_bytes), args, postscript, run_ghostscript).read() == b"other output"
+    assert run_ghostscript.call_count == 1
+    assert (
+        mocked_letter_cache_set.call_args_list[0].kwargs["file_location"]
+        != mocked_letter_cache_set.call_args_list[1].kwargs["file_location"]
+    )
+
+
+def test_cached_ghostscript_output_converts_if_cache_is_unavailable(mocked_letter_cache_get, mocked_letter_cache_set):
+    error = BotoClientError({"Error": {"Code": "500", "Message": "Internal Error"}}, "GetObject")
+    mocked_letter_cache_get.side_effect = error
+    mocked_letter_cache_set.side_effect = error
+
+    output = cached_ghostscript_output(BytesIO(b"input"), [], "", Mock(return_value=BytesIO(b"output")))
+
+    assert output.read() == b"output"
+
+
+def test_cached_ghostscript_output_can_be_switched_off(client, mocked_letter_cache_get, mocked_letter_cache_set):
+    run_ghostscript = Mock(side_effect=lambda: BytesIO(b"output"))
+
+    with set_config(client.application, "GHOSTSCRIPT_CACHE", False):
+        for _ in range(2):
+            cached_ghostscript_output(BytesIO(b"input"), [], "", run_ghostscript)
+
+    assert run_ghostscript.call_count == 2
+    mocked_letter_cache_get.assert_not_called()
+    mocked_letter_cache_set.assert_not_called()
+
+
+def test_convert_pdf_to_cmyk_uses_cached_output(mocker, mocked_letter_cache_get):
+    mocked_letter_cache_get.side_effect = None
+    mocked_letter_cache_get.return_value = BytesIO(b"cached cmyk pdf")
+    mock_run_cmyk_ghostscript = mocker.patch("app.transformation._run_cmyk_ghostscript")
+
+    assert convert_pdf_to_cmyk(BytesIO(b"pdf"), embed_all_fonts=True).read() == b"cached cmyk pdf"
+
+    mock_run_cmyk_ghostscript.assert_not_called()
+
+
+def test_embed_fonts_uses_cached_output(mocker, mocked_letter_cache_get):
+    mocked_letter_cache_get.side_effect = None
+    mocked_letter_cache_get.return_value = BytesIO(b"cached pdf")
+    mock_popen = mocker.patch("subprocess.Popen")
+
+    assert embed_fonts(BytesIO(b"pdf")).read() == b"cached pdf"
+
+    mock_popen.assert_not_called()
+
+
+def test_ghostscript_resources_dir_names_profiles_absolutely(mocker, tmp_path):
+    mocker.patch("app.ghostscript_cache.tempfile.gettempdir", return_value=str(tmp_path))
+    ghostscript_resources_dir.cache_clear()
+
+    try:
+        resources_dir = ghostscript_resources_dir()
+        # another process finds the same copy
+        ghostscript_resources_dir.cache_clear()
+        assert ghostscript_resources_dir() == resources_dir
+    finally:
+        ghostscript_resources_dir.cache_clear()
+
+    assert resources_dir.startswith(str(tmp_path))
+    assert sorted(os.listdir(resources_dir)) == ["control.txt", "rgb_to_cmyk.icc"]
+    with open(os.path.join(resources_dir, "control.txt")) as f:
+        assert f.read().splitlines() == [
+            f"{colour}\t{resources_dir}/rgb_to_cmyk.icc\t0\t1\t0" for colour in ("Text_RGB", "Graphic_RGB", "Image_RGB")
+        ]
+    with (
+        open(os.path.join(resources_dir, "rgb_to_cmyk.icc"), "rb") as copy,
+        open(os.path.join(GHOSTSCRIPT_RESOURCES_DIR, "rgb_to_cmyk.icc"), "rb") as original,
+    ):
+        assert copy.read() == original.read()
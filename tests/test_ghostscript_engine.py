@@ -0,0 +1,149 @@
+import shutil
+from io import BytesIO
+
+import pymupdf
+import pytest
+from weasyprint import HTML
+
+from app import ghostscript_engine
+from app.ghostscript_engine import (
+    GhostscriptEngineError,
+    GhostscriptPool,
+    run_on_ghostscript_server,
+)
+from app.ghostscript_workspace import ghostscript_workspace
+from app.transformation import (
+    CMYK_GHOSTSCRIPT_POSTSCRIPT,
+    _run_cmyk_ghostscript,
+    cmyk_ghostscript_args,
+    convert_pdf_to_cmyk,
+)
+from tests.conftest import set_config
+from tests.pdf_consts import multi_page_pdf
+
+
+def test_server_converts_several_pdfs_with_one_process():
+    pool = GhostscriptPool()
+    try:
+        for pdf in (HTML(string="<html></html>").write_pdf(), multi_page_pdf):
+            output, _ = pool.run(cmyk_ghostscript_args(), CMYK_GHOSTSCRIPT_POSTSCRIPT, pdf, timeout=60)
+            assert output.startswith(b"%PDF-1.7\n")
+
+        [servers] = pool._idle_servers.values()
+        assert len(servers) == 1
+        assert servers[0].jobs_run == 2
+    finally:
+        pool.close()
+
+
+def _cmyk_pixels(pdf):
+    with pymupdf.open(stream=pdf, filetype="pdf") as doc:
+        return [page.get_pixmap(dpi=50, colorspace=pymupdf.csCMYK).samples for page in doc]
+
+
+@pytest.mark.skipif(not shutil.which("gs"), reason="needs Ghostscript")
+def test_server_converts_to_cmyk_with_the_same_colour_mappings_as_a_subprocess(client):
+    # RGB black text and graphics are mapped to black only by app/ghostscript/control.txt
+    pdf = HTML(
+        string="""
+            <p style="color: #000; font-size: 48px">Black text</p>
+            <div style="background: #000; height: 100px"></div>
+            <div style="background: #f00; height: 100px"></div>
+        """
+    ).write_pdf()
+
+    pool = GhostscriptPool()
+    try:
+        server_output, messages = pool.run(cmyk_ghostscript_args(), CMYK_GHOSTSCRIPT_POSTSCRIPT, pdf, timeout=60)
+    finally:
+        pool.close()
+
+    with ghostscript_workspace(BytesIO(pdf)) as workspace:
+        _run_cmyk_ghostscript(workspace.input_path, workspace.output_path, CMYK_GHOSTSCRIPT_POSTSCRIPT)
+        subprocess_output = workspace.read_output().read()
+
+    assert b"Error" not in messages
+    assert _cmyk_pixels(server_output) == _cmyk_pixels(subprocess_output)
+
+
+def test_server_is_discarded_if_a_job_fails():
+    pool = GhostscriptPool()
+    try:
+        with pytest.raises(GhostscriptEngineError):
+            pool.run(cmyk_ghostscript_args(), CMYK_GHOSTSCRIPT_POSTSCRIPT, b"not a pdf", timeout=60)
+
+        assert pool._idle_servers == {(tuple(cmyk_ghostscript_args()), CMYK_GHOSTSCRIPT_POSTSCRIPT): []}
+    finally:
+        pool.close()
+
+
+def test_server_is_killed_if_a_job_times_out(mocker):
+    server = mocker.Mock(spec=ghostscript_engine.GhostscriptServer)
+    server.run.side_effect = GhostscriptEngineError("ghostscript server timed out")
+    mocker.patch("app.ghostscript_engine.GhostscriptServer", return_value=server)
+
+    with pytest.raises(GhostscriptEngineError, match="timed out"):
+        GhostscriptPool().run(["-sDEVICE=pdfwrite"], "", b"%PDF", timeout=1)
+
+    server.close.assert_called_once_with()
+
+
+def test_server_is_restarted_after_max_jobs(mocker):
+    mocker.patch("app.ghostscript_engine.MAX_JOBS_PER_SERVER", 1)
+    server = mocker.Mock(spec=ghostscript_engine.GhostscriptServer, jobs_run=1)
+    server.run.return_value = (b"%PDF", b"")
+    mock_server = mocker.patch("app.ghostscript_engine.GhostscriptServer", return_value=server)
+    pool = GhostscriptPool()
+
+    pool.run(["-sDEVICE=pdfwrite"], "", b"%PDF", timeout=1)
+    pool.run(["-sDEVICE=pdfwrite"], "", b"%PDF", timeout=1)
+
+    assert mock_server.call_count == 2
+    assert server.close.call_count == 2
+
+
+def test_pool_forgets_servers_started_by_parent_process(mocker):
+    server = mocker.Mock(spec=ghostscript_engine.GhostscriptServer, jobs_run=1)
+    server.run.return_value = (b"%PDF", b"")
+    mock_server = mocker.patch("app.ghostscript_engine.GhostscriptServer", return_value=server)
+    pool = GhostscriptPool()
+    pool.run(["-sDEVICE=pdfwrite"], "", b"%PDF", timeout=1)
+
+    mocker.patch("os.getpid", return_value=pool._pid + 1)
+    pool.run(["-sDEVICE=pdfwrite"], "", b"%PDF", timeout=1)
+
+    assert mock_server.call_count == 2
+    server.close.assert_not_called()
+
+
+def test_run_on_ghostscript_server_does_nothing_if_disabled(app, mocker):
+    mock_run = mocker.patch("app.ghostscript_engine.ghostscript_servers.run")
+
+    with set_config(app, "GHOSTSCRIPT_ENGINE", "subprocess"), app.app_context():
+        assert run_on_ghostscript_server([], "", BytesIO(b"%PDF")) is None
+
+    mock_run.assert_not_called()
+
+
+def test_convert_pdf_to_cmyk_falls_back_to_subprocess_if_server_fails(client, mocker):
+    mocker.patch(
+        "app.ghostscript_engine.ghostscript_servers.run",
+        side_effect=GhostscriptEngineError("ghostscript server timed out"),
+    )
+    mock_popen = mocker.patch("subprocess.Popen")
+    mock_popen.return_value.returncode = 0
+
+    def write_output():
+        *_, input_path = mock_popen.call_args.args[0]
+        with open(input_path, "rb") as f:
+            assert f.read() == b"%PDF-1.7\nsome pdf"
+        with open(mock_popen.call_args.args[0][3], "wb") as f:
+            f.write(b"%PDF-1.7\n")
+        return b"", b""
+
+    mock_popen.return_value.communicate.side_effect = write_output
+
+    with set_config(client.application, "GHOSTSCRIPT_ENGINE", "server"):
+        output = convert_pdf_to_cmyk(BytesIO(b"%PDF-1.7\nsome pdf"))
+
+    assert output.read() == b"%PDF-1.7\n"
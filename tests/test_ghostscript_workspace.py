@@ -0,0 +1,49 @@
+import os
+import tempfile
+from io import BytesIO
+
+import pytest
+
+from app.ghostscript_workspace import ghostscript_workspace
+from tests.conftest import set_config
+
+
+@pytest.mark.parametrize("file_class", [BytesIO, tempfile.TemporaryFile])
+def test_ghostscript_workspace_writes_rest_of_input(client, tmp_path, file_class):
+    pdf_data = file_class()
+    pdf_data.write(b"already read%PDF-1.7")
+    pdf_data.seek(len(b"already read"))
+
+    with set_config(client.application, "GHOSTSCRIPT_WORKSPACE_DIR", str(tmp_path)):
+        with ghostscript_workspace(pdf_data) as workspace:
+            assert os.path.dirname(workspace.path) == str(tmp_path)
+            with open(workspace.input_path, "rb") as f:
+                assert f.read() == b"%PDF-1.7"
+
+            with open(workspace.output_path, "wb") as f:
+                f.write(b"%PDF-1.7 output")
+            assert workspace.read_output().read() == b"%PDF-1.7 output"
+
+    assert not os.path.exists(workspace.path)
+
+
+def test_ghostscript_workspace_is_removed_if_ghostscript_fails(client, tmp_path):
+    with set_config(client.application, "GHOSTSCRIPT_WORKSPACE_DIR", str(tmp_path)):
+        with pytest.raises(ValueError), ghostscript_workspace(BytesIO(b"%PDF-1.7")) as workspace:
+            raise ValueError
+
+    assert not os.path.exists(workspace.path)
+
+
+def test_ghostscript_workspace_uses_temp_dir_if_configured_dir_missing(client, tmp_path):
+    with set_config(client.application, "GHOSTSCRIPT_WORKSPACE_DIR", str(tmp_path / "missing")):
+        with ghostscript_workspace(BytesIO(b"%PDF-1.7")) as workspace:
+            assert os.path.dirname(workspace.path) == tempfile.gettempdir()
+
+
+def test_ghostscript_workspace_uses_temp_dir_if_configured_dir_is_full(client, tmp_path, mocker):
+    mocker.patch("os.statvfs", return_value=mocker.Mock(f_bavail=1, f_frsize=4096))
+
+    with set_config(client.application, "GHOSTSCRIPT_WORKSPACE_DIR", str(tmp_path)):
+        with ghostscript_workspace(BytesIO(b"%PDF-1.7" * 1024)) as workspace:
+            assert os.path.dirname(workspace.path) == tempfile.gettempdir()
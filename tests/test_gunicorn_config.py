@@ -1,7 +1,40 @@
-from gunicorn_config import max_requests, timeout, workers
+import importlib
+import json
+import subprocess
+import sys
 
+import gunicorn_config
 
-def test_gunicorn_config():
-    assert max_requests == 10
-    assert timeout == 30
-    assert workers == 5
+
+def test_gunicorn_config(tmp_path, monkeypatch, mocker):
+    # no cgroup limits
+    mocker.patch("container_limits.CGROUP_ROOT", str(tmp_path))
+    monkeypatch.delenv("WEB_WORKERS", raising=False)
+
+    importlib.reload(gunicorn_config)
+
+    assert gunicorn_config.max_requests == 10
+    assert gunicorn_config.timeout == 30
+    assert gunicorn_config.workers == 5
+
+
+def test_gunicorn_workers_can_be_overridden(monkeypatch):
+    monkeypatch.setenv("WEB_WORKERS", "3")
+
+    assert importlib.reload(gunicorn_config).workers == 3
+
+    monkeypatch.undo()
+    importlib.reload(gunicorn_config)
+
+
+def test_gunicorn_config_does_not_import_the_app():
+    # Run in a fresh interpreter, as the test session has already imported the app. The gunicorn master reads its
+    # config, and anything it imports is copied into every worker it forks.
+    result = subprocess.run(
+        [sys.executable, "-c", "import json, sys, gunicorn_config; print(json.dumps(sorted(sys.modules)))"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    assert "app" not in json.loads(result.stdout.strip().splitlines()[-1])
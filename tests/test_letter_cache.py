@@ -0,0 +1,16 @@
+from app.letter_cache import LocalTier
+
+
+def test_local_tier_evicts_least_recently_used_outputs():
+    tier = LocalTier()
+    tier.set("a", b"aaa", max_size=6)
+    tier.set("b", b"bbb", max_size=6)
+    assert tier.get("a") == b"aaa"
+
+    tier.set("c", b"ccc", max_size=6)
+    tier.set("too big", b"1234567", max_size=6)
+
+    assert tier.get("a") == b"aaa"
+    assert tier.get("b") is None
+    assert tier.get("c") == b"ccc"
+    assert tier.get("too big") is None
@@ -0,0 +1,160 @@
+from unittest.mock import Mock
+
+import pymupdf
+import pytest
+
+from app.page_memo import PageMemo, page_memo, remember_results, remembered_invalid_pages, unchecked_pages
+from app.pdf_document import PdfDocument
+from app.precompiled import _validate_page_ranges_in_parallel, get_invalid_pages_with_message
+from tests.conftest import set_config
+from tests.pdf_consts import multi_page_pdf, notify_tags_on_page_2_and_4
+
+
+@pytest.fixture(autouse=True)
+def memo(client):
+    page_memo.clear()
+    with set_config(client.application, "PAGE_VALIDATION_MEMO_SIZE", 100):
+        yield
+    page_memo.clear()
+
+
+def _first_pages_of(pdf, page_count):
+    doc = pymupdf.open(stream=pdf, filetype="pdf")
+    doc.select(range(page_count))
+    return PdfDocument(doc.tobytes(garbage=1))
+
+
+def test_remembered_invalid_pages_only_checks_pages_it_has_not_seen():
+    find_invalid_pages = Mock(side_effect=lambda pages: [page for page in pages if page % 2])
+
+    assert remembered_invalid_pages(
+        _first_pages_of(multi_page_pdf, 2),
+        [1, 2],
+        check="check",
+        is_an_attachment=False,
+        find_invalid_pages=find_invalid_pages,
+    ) == [1]
+    assert remembered_invalid_pages(
+        PdfDocument(multi_page_pdf),
+        list(range(1, 11)),
+        check="check",
+        is_an_attachment=False,
+        find_invalid_pages=find_invalid_pages,
+    ) == [1, 3, 5, 7, 9]
+
+    assert find_invalid_pages.call_args_list[0].args == ([1, 2],)
+    assert find_invalid_pages.call_args_list[1].args == ([3, 4, 5, 6, 7, 8, 9, 10],)
+
+
+def test_remembered_invalid_pages_keeps_first_pages_and_checks_apart():
+    document = PdfDocument(multi_page_pdf)
+    find_invalid_pages = Mock(return_value=[])
+
+    remembered_invalid_pages(
+        document, [1], check="check", is_an_attachment=False, find_invalid_pages=find_invalid_pages
+    )
+    remembered_invalid_pages(document, [1], check="check", is_an_attachment=True, find_invalid_pages=find_invalid_pages)
+    remembered_invalid_pages(
+        document, [1], check="other check", is_an_attachment=False, find_invalid_pages=find_invalid_pages
+    )
+    remembered_invalid_pages(
+        document, [1], check="check", is_an_attachment=False, find_invalid_pages=find_invalid_pages
+    )
+
+    assert find_invalid_pages.call_count == 3
+
+
+def test_remembered_invalid_pages_does_nothing_if_switched_off(client):
+    find_invalid_pages = Mock(return_value=[2])
+
+    with set_config(client.application, "PAGE_VALIDATION_MEMO_SIZE", 0):
+        for _ in range(2):
+            assert remembered_invalid_pages(
+                PdfDocument(multi_page_pdf),
+                [1, 2],
+                check="check",
+                is_an_attachment=False,
+                find_invalid_pages=find_invalid_pages,
+            ) == [2]
+
+    assert find_invalid_pages.call_count == 2
+
+
+def test_page_memo_forgets_least_recently_used_results():
+    memo = PageMemo()
+    memo.set("a", True, max_size=2)
+    memo.set("b", False, max_size=2)
+    assert memo.get("a") is True
+    memo.set("c", True, max_size=2)
+
+    assert memo.get("a") is True
+    assert memo.get("b") is None
+    assert memo.get("c") is True
+
+
+def test_get_invalid_pages_with_message_only_checks_new_pages(mocker):
+    mock_check_boundaries = mocker.patch(
+        "app.precompiled._get_pages_with_content_outside_printable_area", return_value=[]
+    )
+    mock_find_notify_tags = mocker.patch("app.precompiled._get_pages_with_notify_tag", return_value=[2, 4])
+
+    for _ in range(2):
+        assert get_invalid_pages_with_message(PdfDocument(notify_tags_on_page_2_and_4)) == (
+            "notify-tag-found-in-content",
+            [2, 4],
+        )
+
+    mock_check_boundaries.assert_called_once()
+    mock_find_notify_tags.assert_called_once()
+
+
+def test_remember_results_are_used_by_remembered_invalid_pages():
+    document = PdfDocument(multi_page_pdf)
+    find_invalid_pages = Mock(return_value=[])
+
+    remember_results(document, {1: False, 2: True}, check="check", is_an_attachment=False)
+
+    assert unchecked_pages(document, [1, 2, 3], checks=["check"], is_an_attachment=False) == [3]
+    assert unchecked_pages(document, [1, 2, 3], checks=["check", "other check"], is_an_attachment=False) == [1, 2, 3]
+    assert remembered_invalid_pages(
+        document, [1, 2, 3], check="check", is_an_attachment=False, find_invalid_pages=find_invalid_pages
+    ) == [2]
+    find_invalid_pages.assert_called_once_with([3])
+
+
+def test_validate_page_ranges_in_parallel_remembers_results_from_each_process(mocker):
+    mock_executor = mocker.patch("concurrent.futures.ProcessPoolExecutor")
+    mock_executor.return_value.__enter__.return_value.submit.return_value.result.side_effect = [
+        {"content-outside-printable-area": {1: False, 2: False}, "notify-tag-found-in-content": {1: False, 2: True}},
+        {"content-outside-printable-area": {3: False, 4: False}, "notify-tag-found-in-content": {3: False, 4: True}},
+    ]
+    document = PdfDocument(notify_tags_on_page_2_and_4)
+
+    assert _validate_page_ranges_in_parallel(document, [(1, 2), (3, 4)], False) == ([], [2, 4])
+
+    mock_check_boundaries = mocker.patch("app.precompiled._get_pages_with_content_outside_printable_area")
+    mock_find_notify_tags = mocker.patch("app.precompiled._get_pages_with_notify_tag")
+
+    assert get_invalid_pages_with_message(PdfDocument(notify_tags_on_page_2_and_4)) == (
+        "notify-tag-found-in-content",
+        [2, 4],
+    )
+    mock_check_boundaries.assert_not_called()
+    mock_find_notify_tags.assert_not_called()
+
+
+def test_pages_already_checked_are_not_validated_in_parallel(client, mocker):
+    mocker.patch("app.precompiled.free_subprocess_slots", return_value=4)
+    mocker.patch("app.precompiled.PARALLEL_VALIDATION_MIN_PAGES_PER_PROCESS", 1)
+    mocker.patch("app.precompiled._get_pages_with_content_outside_printable_area", return_value=[])
+    mocker.patch("app.precompiled._get_pages_with_notify_tag", return_value=[2, 4])
+    mock_validate_in_parallel = mocker.patch("app.precompiled._validate_page_ranges_in_parallel")
+
+    get_invalid_pages_with_message(PdfDocument(notify_tags_on_page_2_and_4))
+    with set_config(client.application, "PARALLEL_VALIDATION_MIN_PAGES", 2):
+        assert get_invalid_pages_with_message(PdfDocument(notify_tags_on_page_2_and_4)) == (
+            "notify-tag-found-in-content",
+            [2, 4],
+        )
+
+    mock_validate_in_parallel.assert_not_called()
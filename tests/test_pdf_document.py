@@ -0,0 +1,201 @@
+from io import BytesIO
+
+import pymupdf
+import pytest
+from pypdf import PdfReader
+
+from app.pdf_document import PYMUPDF, PYPDF, STREAM_LENGTH, PdfDocument
+from tests.pdf_consts import blank_page, multi_page_pdf, no_resources_on_last_page
+
+
+@pytest.fixture
+def mock_pdf_reader(mocker):
+    return mocker.patch("app.pdf_document.PdfReader", wraps=PdfReader)
+
+
+@pytest.fixture
+def mock_pymupdf_open(mocker):
+    return mocker.patch("pymupdf.open", wraps=pymupdf.open)
+
+
+def test_pdf_document_of_reads_file_from_current_position():
+    file_data = BytesIO(b"xx" + blank_page)
+    file_data.seek(2)
+
+    document = PdfDocument.of(file_data)
+
+    assert document.data == blank_page
+    assert file_data.tell() == 2
+    assert PdfDocument.of(document) is document
+
+
+def test_pdf_document_parses_with_each_library_once(mock_pdf_reader, mock_pymupdf_open):
+    document = PdfDocument(multi_page_pdf)
+
+    mock_pdf_reader.assert_not_called()
+    mock_pymupdf_open.assert_not_called()
+
+    assert document.page_count == 10
+    assert len(document.page_boxes()) == 10
+    assert document.reader.metadata is not None
+    assert document.words(0) == document.pymupdf_document[0].get_text_words()
+    document.words(1)
+
+    assert mock_pdf_reader.call_count == 1
+    assert mock_pymupdf_open.call_count == 1
+
+
+def test_pdf_document_caches_facts_until_it_is_edited(mocker):
+    document = PdfDocument(blank_page)
+    compute = mocker.Mock(side_effect=["first", "second"])
+
+    assert document.cached("fact", compute) == "first"
+    assert document.cached("fact", compute) == "first"
+
+    document.edited_with(PYPDF)
+
+    assert document.cached("fact", compute) == "second"
+    assert compute.call_count == 2
+
+
+def test_pdf_document_is_not_written_out_unless_edited():
+    document = PdfDocument(multi_page_pdf)
+
+    document.reader.pages[0].extract_text()
+    document.pymupdf_document[0].get_text()
+
+    assert document.data is multi_page_pdf
+    assert document.file().read() == multi_page_pdf
+
+
+def test_pdf_document_writes_out_pypdf_edits(mock_pymupdf_open):
+    document = PdfDocument(multi_page_pdf)
+    assert document.pymupdf_document[0].rotation == 0
+
+    document.reader.pages[0].rotate(90)
+    document.edited_with(PYPDF)
+
+    assert PdfReader(BytesIO(document.data)).pages[0].rotation == 90
+    # pymupdf's copy is out of date, so it reads the document again
+    assert document.pymupdf_document[0].rotation == 90
+    assert mock_pymupdf_open.call_count == 2
+
+
+def test_pdf_document_writes_out_pymupdf_edits(mock_pdf_reader):
+    document = PdfDocument(multi_page_pdf)
+    assert document.page_count == 10
+
+    document.pymupdf_document.delete_page(9)
+    document.edited_with(PYMUPDF)
+
+    assert pymupdf.open(stream=document.data, filetype="pdf").page_count == 9
+    # pypdf's copy is out of date, so it reads the document again
+    assert document.page_count == 9
+    assert mock_pdf_reader.call_count == 2
+
+
+def _pages_of(pdf, page_numbers):
+    source = pymupdf.open(stream=pdf, filetype="pdf")
+    doc = pymupdf.open()
+    for page_number in page_numbers:
+        doc.insert_pdf(source, from_page=page_number, to_page=page_number)
+    return PdfDocument(doc.tobytes(garbage=1))
+
+
+def test_page_fingerprint_is_the_same_for_the_same_page_in_different_documents():
+    document = PdfDocument(multi_page_pdf)
+    other_document = _pages_of(multi_page_pdf, [5, 3])
+
+    assert other_document.page_fingerprint(0) == document.page_fingerprint(5)
+    assert other_document.page_fingerprint(1) == document.page_fingerprint(3)
+    assert len({document.page_fingerprint(page_number) for page_number in range(10)}) == 10
+
+
+def test_page_fingerprint_changes_with_rotation():
+    document = PdfDocument(multi_page_pdf)
+    fingerprint = document.page_fingerprint(0)
+
+    document.pymupdf_document[0].set_rotation(90)
+    document.edited_with(PYMUPDF)
+
+    assert document.page_fingerprint(0) != fingerprint
+
+
+def test_page_fingerprint_includes_resources_inherited_from_the_page_tree():
+    document = PdfDocument(no_resources_on_last_page)
+    fingerprint = document.page_fingerprint(2)
+
+    doc = document.pymupdf_document
+    page_tree = int(doc.xref_get_key(doc[2].xref, "Parent")[1].split()[0])
+    doc.xref_set_key(page_tree, "Resources", doc.xref_get_key(doc[0].xref, "Resources")[1])
+    document.edited_with(PYMUPDF)
+
+    assert document.page_fingerprint(2) != fingerprint
+
+
+def _pages_that_link_to_each_other(link_right=200, blank_pages_before=0):
+    doc = pymupdf.open()
+    for _ in range(blank_pages_before + 2):
+        doc.new_page()
+    first, second = blank_pages_before, blank_pages_before + 1
+    doc[first].insert_text((72, 72), "Page 1")
+    doc[second].insert_text((72, 72), "Page 2")
+    # each link refers to the page it goes to, and each page to its links
+    doc[first].insert_link({"kind": pymupdf.LINK_GOTO, "from": pymupdf.Rect(72, 72, link_right, 90), "page": second})
+    doc[second].insert_link({"kind": pymupdf.LINK_GOTO, "from": pymupdf.Rect(72, 72, 200, 90), "page": first})
+    return doc.tobytes(garbage=1)
+
+
+@pytest.mark.parametrize("first_page_fingerprinted", [0, 1])
+def test_page_fingerprint_includes_every_object_in_a_loop(first_page_fingerprinted):
+    document = PdfDocument(_pages_that_link_to_each_other())
+    other_document = PdfDocument(_pages_that_link_to_each_other(link_right=180))
+
+    # however the loop was first come across
+    document.page_fingerprint(first_page_fingerprinted)
+    other_document.page_fingerprint(first_page_fingerprinted)
+
+    assert document.page_fingerprint(0) != other_document.page_fingerprint(0)
+    assert document.page_fingerprint(1) != other_document.page_fingerprint(1)
+
+
+def test_page_fingerprint_of_a_loop_is_the_same_in_different_documents():
+    document = PdfDocument(_pages_that_link_to_each_other())
+    # so that every object has a different number
+    other_document = PdfDocument(_pages_that_link_to_each_other(blank_pages_before=3))
+    other_document.page_fingerprint(4)
+
+    assert other_document.page_fingerprint(3) == document.page_fingerprint(0)
+    assert other_document.page_fingerprint(4) == document.page_fingerprint(1)
+    assert document.page_fingerprint(0) != document.page_fingerprint(1)
+
+
+def _page_with_optional_content(shown):
+    doc = pymupdf.open()
+    doc.new_page()
+    layer = doc.add_ocg("Layer", on=shown)
+    doc[0].insert_text((72, 72), "Only shown with the layer", oc=layer)
+    return doc.tobytes(garbage=1)
+
+
+def test_page_fingerprint_includes_which_optional_content_is_shown():
+    document = PdfDocument(_page_with_optional_content(shown=True))
+    other_document = PdfDocument(_page_with_optional_content(shown=False))
+
+    assert document.page_fingerprint(0) != other_document.page_fingerprint(0)
+    assert document.page_fingerprint(0) == PdfDocument(_page_with_optional_content(shown=True)).page_fingerprint(0)
+
+
+@pytest.mark.parametrize(
+    "definition, expected",
+    [
+        ("<</Filter/FlateDecode/Length 12>>", "<</Filter/FlateDecode>>"),
+        ("<</Filter/FlateDecode/Length 9 0 R>>", "<</Filter/FlateDecode>>"),
+        ("<</Length 12 /Filter/FlateDecode>>", "<< /Filter/FlateDecode>>"),
+        # font files also say how long each part of the font is, which is part of the font rather than the stream
+        ("<</Length1 1200/Length2 300/Length 9 0 R>>", "<</Length1 1200/Length2 300>>"),
+        ("<</Length1 10 0 R/Length 12>>", "<</Length1 10 0 R>>"),
+    ],
+)
+def test_stream_length(definition, expected):
+    assert STREAM_LENGTH.sub("", definition, count=1) == expected
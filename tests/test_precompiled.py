@@ -1,31 +1,55 @@
 import base64
 import io
+import json
 import logging
+import zipfile
 from io import BytesIO
-from unittest.mock import ANY, MagicMock, call
+from unittest.mock import ANY, MagicMock, Mock, PropertyMock, call
 
 import pymupdf
 import pypdf
 import pytest
 from flask import url_for
+from PIL import Image
 from pypdf.errors import PdfReadError
 from reportlab.lib.colors import black, grey, white
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
 from reportlab.pdfgen import canvas
 
+from app import InvalidRequest
+from app.canvas import NotifyCanvas
+from app.pdf_document import PdfDocument
 from app.precompiled import (
-    NotifyCanvas,
+    PrecompiledPostalAddress,
+    _colour_no_print_areas_of_pdf_in_red,
+    _get_out_of_bounds_pages,
+    _get_page_ranges_for_parallel_validation,
+    _get_pages_with_content_outside_printable_area,
+    _overlay_printable_areas_with_white,
+    _page_ranges,
+    _png_with_no_print_areas_in_red,
+    _rasterise_pages,
+    _red_overlay,
+    _unmodified_page_pngs,
+    _validate_page_range,
+    _validate_page_ranges_in_parallel,
     _warn_if_filesize_has_grown,
+    _white_overlay,
     add_address_to_precompiled_letter,
     add_notify_tag_to_letter,
+    bytesio_from_pdf,
     extract_address_block,
     get_invalid_pages_with_message,
     is_notify_tag_present,
     log_metadata_for_letter,
+    normalise_fonts_and_colours,
     redact_precompiled_letter_address_block,
     rewrite_address_block,
+    sanitise_letter,
 )
+from app.sanitise_cache import SanitiseResult
+from tests.conftest import set_config
 from tests.pdf_consts import (
     a3_size,
     a5_size,
@@ -60,6 +84,7 @@ from tests.pdf_consts import (
     notify_tags_on_page_2_and_4,
     pdf_with_no_metadata,
     portrait_rotated_page,
+    public_guardian_sample,
     repeated_address_block,
     valid_letter,
 )
@@ -73,6 +98,7 @@ from tests.pdf_consts import (
             "precompiled_blueprint.overlay_template_png_for_page",
             {"is_first_page": "true"},
         ),
+        ("precompiled_blueprint.overlay_template_pngs_for_pages", {}),
         ("precompiled_blueprint.overlay_template_pdf", {}),
     ],
 )
@@ -89,7 +115,7 @@ def test_add_notify_tag_to_letter(mocker):
 
     pdf_page = add_notify_tag_to_letter(BytesIO(multi_page_pdf))
 
-    pdf_new = pypdf.PdfReader(BytesIO(pdf_page.read()))
+    pdf_new = pypdf.PdfReader(BytesIO(pdf_page.data))
 
     assert len(pdf_new.pages) == len(pdf_original.pages)
     assert pdf_new.pages[0].extract_text() != pdf_original.pages[0].extract_text()
@@ -105,7 +131,7 @@ def test_add_notify_tag_to_letter_correct_margins(mocker):
     can = NotifyCanvas(white)
     can.drawString = MagicMock(return_value=3)
 
-    mocker.patch("app.precompiled.NotifyCanvas", return_value=can)
+    mocker.patch("app.canvas.NotifyCanvas", return_value=can)
 
     # It fails because we are mocking but by that time the drawString method has been called so just carry on
     try:
@@ -346,6 +372,364 @@ def test_get_invalid_pages_rejects_later_pages_with_notify_tags(client):
     assert invalid_pages == [2, 4]
 
 
+def test_get_invalid_pages_only_rasterises_pages_it_cannot_check_from_geometry(client, mocker):
+    mock_rasterise = mocker.patch("app.precompiled._rasterise_pages_to_check_boundaries", return_value=[3])
+    mocker.patch(
+        "app.vector_bounds.content_outside_areas",
+        side_effect=[False, True, None, False],
+    )
+    packet = io.BytesIO()
+    cv = canvas.Canvas(packet, pagesize=A4)
+    for _ in range(4):
+        cv.drawString(200, 400, "Page content")
+        cv.showPage()
+    cv.save()
+    packet.seek(0)
+
+    assert get_invalid_pages_with_message(packet) == ("content-outside-printable-area", [2, 3])
+    mock_rasterise.assert_called_once_with(ANY, [3], False)
+
+
+def test_get_invalid_pages_rasterises_every_page_if_vector_bounds_check_is_off(client, mocker):
+    mock_rasterise = mocker.patch("app.precompiled._rasterise_pages_to_check_boundaries", return_value=[])
+    mock_content_outside_areas = mocker.patch("app.vector_bounds.content_outside_areas")
+
+    with set_config(client.application, "VECTOR_BOUNDS_CHECK", False):
+        assert _get_pages_with_content_outside_printable_area(BytesIO(multi_page_pdf)) == []
+
+    assert list(mock_rasterise.call_args.args[1]) == list(range(1, 11))
+    mock_content_outside_areas.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "is_an_attachment, expected_invalid_pages",
+    [
+        (False, [1, 3]),
+        # without an address page, the logo on page 1 is in the body
+        (True, [3]),
+    ],
+)
+def test_get_pages_with_content_in_margins(client, is_an_attachment, expected_invalid_pages):
+    packet = io.BytesIO()
+    cv = canvas.Canvas(packet, pagesize=A4)
+    # a logo to the left of the service address, below the logo area
+    cv.rect(20 * mm, (297 - 80) * mm, 5 * mm, 5 * mm, stroke=0, fill=1)
+    cv.showPage()
+    cv.drawString(200, 400, "Page content")
+    cv.showPage()
+    cv.drawString(200, 400, "Page content")
+    cv.rect(200, 5, 5, 5, stroke=0, fill=1)
+    cv.save()
+    document = PdfDocument(packet.getvalue())
+
+    with set_config(client.application, "VECTOR_BOUNDS_CHECK", False):
+        assert (
+            _get_pages_with_content_outside_printable_area(document, is_an_attachment=is_an_attachment)
+            == expected_invalid_pages
+        )
+
+
+def _page_with_mark_in_left_margin(draw):
+    packet = io.BytesIO()
+    cv = canvas.Canvas(packet, pagesize=A4)
+    draw(cv)
+    cv.save()
+    return PdfDocument(packet.getvalue())
+
+
+@pytest.mark.parametrize(
+    "draw, expected_invalid_pages",
+    [
+        pytest.param(lambda cv: cv.rect(5 * mm, 400, 5 * mm, 5 * mm, stroke=0, fill=0), [], id="nothing"),
+        pytest.param(
+            lambda cv: (cv.setFillGray(1), cv.rect(5 * mm, 400, 5 * mm, 5 * mm, stroke=0, fill=1)), [], id="white"
+        ),
+        pytest.param(
+            lambda cv: (cv.setFillGray(254 / 255), cv.rect(5 * mm, 400, 5 * mm, 5 * mm, stroke=0, fill=1)),
+            [1],
+            id="near-white",
+        ),
+        pytest.param(
+            lambda cv: (
+                cv.setFillColorRGB(254 / 255, 254 / 255, 254 / 255),
+                cv.rect(5 * mm, 400, 5 * mm, 5 * mm, stroke=0, fill=1),
+            ),
+            [1],
+            id="near-white-rgb",
+        ),
+        pytest.param(lambda cv: (cv.setLineWidth(0), cv.line(5 * mm, 300, 5 * mm, 500)), [1], id="thinnest-line"),
+        pytest.param(lambda cv: (cv.setLineWidth(0.01), cv.line(5 * mm, 300, 5 * mm, 500)), [1], id="hairline"),
+    ],
+)
+def test_get_pages_with_content_in_margins_at_default_dpi(client, draw, expected_invalid_pages):
+    # the default, rather than the resolution poppler renders whole pages at
+    assert client.application.config["MARGIN_RASTER_DPI"] == 100
+
+    with set_config(client.application, "VECTOR_BOUNDS_CHECK", False):
+        assert (
+            _get_pages_with_content_outside_printable_area(_page_with_mark_in_left_margin(draw), is_an_attachment=True)
+            == expected_invalid_pages
+        )
+
+
+def test_get_pages_with_content_in_margins_of_rotated_page(client):
+    packet = io.BytesIO()
+    cv = canvas.Canvas(packet, pagesize=(A4[1], A4[0]))
+    # just to the right of the body on the unrotated page, which is where the overlays are drawn, but inside the body
+    # if the printable areas weren't rotated with the page
+    cv.rect(563, 290, 4, 4, stroke=0, fill=1)
+    cv.save()
+    document = PdfDocument(packet.getvalue())
+    document.pymupdf_document[0].set_rotation(90)
+
+    with set_config(client.application, "VECTOR_BOUNDS_CHECK", False):
+        assert _get_pages_with_content_outside_printable_area(document, is_an_attachment=True) == [1]
+
+
+def test_rasterise_pages_renders_cropped_pages_whole(client, mocker):
+    mock_get_out_of_bounds_pages = mocker.patch("app.precompiled._get_out_of_bounds_pages", return_value=[2])
+    document = PdfDocument(multi_page_pdf)
+    document.pymupdf_document[1].set_cropbox(pymupdf.Rect(10, 10, 500, 800))
+
+    with set_config(client.application, "VECTOR_BOUNDS_CHECK", False):
+        assert _get_pages_with_content_outside_printable_area(document) == [2]
+
+    assert mock_get_out_of_bounds_pages.call_args.kwargs == {"page_numbers": [2]}
+
+
+def test_rasterise_pages_overlays_whole_pages_if_margin_raster_bounds_check_is_off(client, mocker):
+    mock_get_out_of_bounds_pages = mocker.patch("app.precompiled._get_out_of_bounds_pages", return_value=[])
+
+    with (
+        set_config(client.application, "VECTOR_BOUNDS_CHECK", False),
+        set_config(client.application, "MARGIN_RASTER_BOUNDS_CHECK", False),
+    ):
+        assert _get_pages_with_content_outside_printable_area(BytesIO(multi_page_pdf)) == []
+
+    assert mock_get_out_of_bounds_pages.call_args.kwargs == {"page_numbers": list(range(1, 11))}
+
+
+@pytest.mark.parametrize(
+    "min_pages, free_slots, page_count, expected_page_ranges",
+    [
+        (0, 4, 40, None),
+        (6, 1, 40, None),
+        (6, 4, 5, None),
+        (6, 4, 6, [(1, 3), (4, 6)]),
+        (6, 4, 7, [(1, 4), (5, 7)]),
+        (6, 4, 40, [(1, 10), (11, 20), (21, 30), (31, 40)]),
+        (6, 3, 40, [(1, 14), (15, 27), (28, 40)]),
+        (6, 0, 40, None),
+        (2, 4, 5, None),
+    ],
+)
+def test_get_page_ranges_for_parallel_validation(
+    client, mocker, min_pages, free_slots, page_count, expected_page_ranges
+):
+    mocker.patch("app.precompiled.free_subprocess_slots", return_value=free_slots)
+
+    with set_config(client.application, "PARALLEL_VALIDATION_MIN_PAGES", min_pages):
+        assert _get_page_ranges_for_parallel_validation(Mock(page_count=page_count), False) == expected_page_ranges
+
+
+def _letter_with_content_outside_printable_area_on_pages(page_count, pages_outside_printable_area):
+    packet = io.BytesIO()
+    cv = canvas.Canvas(packet, pagesize=A4)
+    for page_number in range(1, page_count + 1):
+        cv.drawString(200, 400, f"Page {page_number}")
+        if page_number in pages_outside_printable_area:
+            cv.rect(0, 0, 10, 10, stroke=0, fill=1)
+        cv.showPage()
+    cv.save()
+    return packet.getvalue()
+
+
+@pytest.mark.parametrize("is_an_attachment", [False, True])
+@pytest.mark.parametrize(
+    "pdf, expected_message",
+    [
+        (multi_page_pdf, ("", [])),
+        (notify_tags_on_page_2_and_4, ("notify-tag-found-in-content", [2, 4])),
+        (example_dwp_pdf, ("content-outside-printable-area", [1])),
+        (
+            _letter_with_content_outside_printable_area_on_pages(8, [3, 7]),
+            ("content-outside-printable-area", [3, 7]),
+        ),
+    ],
+    ids=["multi_page_pdf", "notify_tags_on_page_2_and_4", "example_dwp_pdf", "content_outside_on_pages_3_and_7"],
+)
+def test_get_invalid_pages_in_parallel(client, mocker, pdf, is_an_attachment, expected_message):
+    mocker.patch("app.precompiled.free_subprocess_slots", return_value=4)
+    mocker.patch("app.precompiled.PARALLEL_VALIDATION_MIN_PAGES_PER_PROCESS", 1)
+    mock_validate_in_parallel = mocker.patch(
+        "app.precompiled._validate_page_ranges_in_parallel", wraps=_validate_page_ranges_in_parallel
+    )
+
+    assert get_invalid_pages_with_message(BytesIO(pdf), is_an_attachment=is_an_attachment) == expected_message
+    mock_validate_in_parallel.assert_not_called()
+
+    with set_config(client.application, "PARALLEL_VALIDATION_MIN_PAGES", 2):
+        assert get_invalid_pages_with_message(BytesIO(pdf), is_an_attachment=is_an_attachment) == expected_message
+
+    mock_validate_in_parallel.assert_called_once()
+
+
+def test_validate_page_ranges_in_parallel_doesnt_fork_this_process(client, mocker):
+    mock_executor = mocker.patch("concurrent.futures.ProcessPoolExecutor")
+    mock_executor.return_value.__enter__.return_value.submit.return_value.result.return_value = {}
+
+    _validate_page_ranges_in_parallel(Mock(page_count=6, data=b"pdf"), [(1, 3), (4, 6)], False)
+
+    assert mock_executor.call_args.kwargs["max_workers"] == 2
+    assert mock_executor.call_args.kwargs["mp_context"].get_start_method() == "forkserver"
+    assert mock_executor.call_args.kwargs["initargs"] == (dict(client.application.config),)
+
+
+def test_validate_page_range_holds_a_subprocess_slot(mocker):
+    calls = Mock()
+    calls.attach_mock(mocker.patch("app.precompiled.process_slot"), "process_slot")
+    calls.attach_mock(mocker.patch("app.precompiled._validate_pages", return_value=([], [3])), "validate_pages")
+
+    assert _validate_page_range(multi_page_pdf, (2, 4), False) == {
+        "content-outside-printable-area": {2: False, 3: False, 4: False},
+        "notify-tag-found-in-content": {2: False, 3: True, 4: False},
+    }
+
+    assert [name for name, _, _ in calls.mock_calls] == [
+        "process_slot",
+        "process_slot().__enter__",
+        "validate_pages",
+        "process_slot().__exit__",
+    ]
+    assert calls.validate_pages.call_args.kwargs == {"page_numbers": range(2, 5)}
+
+
+def test_validate_page_range_only_returns_checks_it_did(mocker):
+    mocker.patch("app.precompiled.process_slot")
+    mocker.patch("app.precompiled._validate_pages", return_value=([4], []))
+
+    assert _validate_page_range(multi_page_pdf, (3, 4), False) == {
+        "content-outside-printable-area": {3: False, 4: True},
+    }
+
+
+@pytest.mark.parametrize(
+    "page_numbers, max_length, expected_ranges",
+    [
+        ([1, 2, 3, 5], 10, [(1, 3), (5, 5)]),
+        ([1, 2, 3, 5], 2, [(1, 2), (3, 3), (5, 5)]),
+        ([1, 2, 3, 5], 1, [(1, 1), (2, 2), (3, 3), (5, 5)]),
+        ([], 1, []),
+    ],
+)
+def test_page_ranges(page_numbers, max_length, expected_ranges):
+    assert _page_ranges(page_numbers, max_length) == expected_ranges
+
+
+@pytest.mark.parametrize(
+    "pages_at_a_time, expected_calls",
+    [
+        (1, [call(ANY, first_page=page_number, last_page=page_number) for page_number in [1, 2, 3, 5]]),
+        (
+            2,
+            [
+                call(ANY, first_page=1, last_page=2),
+                call(ANY, first_page=3, last_page=3),
+                call(ANY, first_page=5, last_page=5),
+            ],
+        ),
+    ],
+)
+def test_get_out_of_bounds_pages_rasterises_a_few_pages_at_a_time(client, mocker, pages_at_a_time, expected_calls):
+    images = []
+
+    def convert_from_bytes(pdf_data, first_page, last_page):
+        # every page rasterised before has been checked and let go of
+        assert all(image.close.called for image in images)
+        rasterised = [
+            mocker.Mock(wraps=Image.new("RGB", (10, 10), "black" if page_number == 3 else "white"))
+            for page_number in range(first_page, last_page + 1)
+        ]
+        images.extend(rasterised)
+        return rasterised
+
+    mock_convert_from_bytes = mocker.patch("pdf2image.convert_from_bytes", side_effect=convert_from_bytes)
+
+    with set_config(client.application, "RASTER_BOUNDS_CHECK_PAGES_AT_A_TIME", pages_at_a_time):
+        assert list(_get_out_of_bounds_pages(BytesIO(b"pdf"), page_numbers=[1, 2, 3, 5])) == [3]
+
+    assert mock_convert_from_bytes.call_args_list == expected_calls
+    assert all(image.close.called for image in images)
+
+
+@pytest.mark.parametrize(
+    "page_numbers, subprocesses, expected_ranges",
+    [
+        ([1, 2, 3, 5], 2, [(1, 2), (3, 3), (5, 5)]),
+        ([1, 2, 3, 5], 8, [(1, 1), (2, 2), (3, 3), (5, 5)]),
+        (list(range(1, 31)), 1, [(1, 10), (11, 20), (21, 30)]),
+    ],
+)
+def test_rasterise_pages_splits_pages_between_subprocesses_by_default(
+    client, mocker, page_numbers, subprocesses, expected_ranges
+):
+    mocker.patch("app.precompiled.subprocess_concurrency", return_value=subprocesses)
+    mock_convert_from_bytes = mocker.patch(
+        "pdf2image.convert_from_bytes",
+        side_effect=lambda pdf_data, first_page, last_page: [Mock() for _ in range(first_page, last_page + 1)],
+    )
+
+    with set_config(client.application, "RASTER_BOUNDS_CHECK_PAGES_AT_A_TIME", 0):
+        assert [page_number for page_number, _ in _rasterise_pages(b"pdf", page_numbers)] == page_numbers
+
+    assert mock_convert_from_bytes.call_args_list == [
+        call(ANY, first_page=first_page, last_page=last_page) for first_page, last_page in expected_ranges
+    ]
+
+
+@pytest.mark.parametrize(
+    "vector_bounds_check, margin_raster_bounds_check",
+    [(True, False), (False, True), (True, True)],
+)
+@pytest.mark.parametrize("is_an_attachment", [False, True])
+@pytest.mark.parametrize(
+    "pdf",
+    [
+        address_margin,
+        blank_with_address,
+        content_up_to_boundary_edges,
+        example_dwp_pdf,
+        hackney_sample,
+        multi_page_pdf,
+        no_colour,
+        no_resources_on_last_page,
+        non_uk_address,
+        notify_tags_on_page_2_and_4,
+        portrait_rotated_page,
+        public_guardian_sample,
+        repeated_address_block,
+        valid_letter,
+    ],
+)
+def test_get_pages_with_content_outside_printable_area_agrees_with_rasterising(
+    client, pdf, is_an_attachment, vector_bounds_check, margin_raster_bounds_check
+):
+    with (
+        set_config(client.application, "VECTOR_BOUNDS_CHECK", False),
+        set_config(client.application, "MARGIN_RASTER_BOUNDS_CHECK", False),
+    ):
+        rasterised = _get_pages_with_content_outside_printable_area(BytesIO(pdf), is_an_attachment=is_an_attachment)
+
+    with (
+        set_config(client.application, "VECTOR_BOUNDS_CHECK", vector_bounds_check),
+        set_config(client.application, "MARGIN_RASTER_BOUNDS_CHECK", margin_raster_bounds_check),
+    ):
+        assert (
+            _get_pages_with_content_outside_printable_area(BytesIO(pdf), is_an_attachment=is_an_attachment)
+            == rasterised
+        )
+
+
 def test_overlay_template_png_for_page_not_encoded(client, auth_header):
     response = client.post(
         url_for("precompiled_blueprint.overlay_template_png_for_page", is_first_page="true"),
@@ -369,8 +753,7 @@ def test_overlay_template_png_for_page_not_encoded(client, auth_header):
     ],
 )
 def test_overlay_template_png_for_page_checks_if_first_page(client, auth_header, mocker, params, expected_first_page):
-    mock_png_from_pdf = mocker.patch("app.precompiled.png_from_pdf", return_value=BytesIO(b"\x00"))
-    mock_colour = mocker.patch("app.precompiled._colour_no_print_areas_of_single_page_pdf_in_red")
+    mock_png = mocker.patch("app.precompiled._png_with_no_print_areas_in_red", return_value=BytesIO(b"\x00"))
 
     response = client.post(
         url_for("precompiled_blueprint.overlay_template_png_for_page", **params),
@@ -379,8 +762,91 @@ def test_overlay_template_png_for_page_checks_if_first_page(client, auth_header,
     )
 
     assert response.status_code == 200
-    mock_colour.assert_called_once_with(ANY, is_first_page=expected_first_page)
-    mock_png_from_pdf.assert_called_once_with(mock_colour.return_value, page_number=1)
+    mock_png.assert_called_once_with(ANY, is_first_page=expected_first_page)
+
+
+def _white_png(size):
+    output = BytesIO()
+    Image.new("RGB", size, "white").save(output, format="png")
+    output.seek(0)
+    return output
+
+
+@pytest.mark.parametrize(
+    "is_first_page, expected_colour_above_address",
+    [
+        (True, (255, 204, 204)),
+        (False, (255, 255, 255)),
+    ],
+)
+def test_png_with_no_print_areas_in_red_colours_the_rasterised_page(
+    client, mocker, is_first_page, expected_colour_above_address
+):
+    # A4 at 150dpi
+    mock_pngs_from_pdf = mocker.patch("app.precompiled.pngs_from_pdf", return_value=[_white_png((1240, 1754))])
+
+    png = _png_with_no_print_areas_in_red(BytesIO(blank_page), is_first_page=is_first_page)
+
+    # the page is rasterised as it is
+    mock_pngs_from_pdf.assert_called_once_with(blank_page)
+    with Image.open(png) as image:
+        assert image.size == (1240, 1754)
+        # the left margin
+        assert image.getpixel((10, 800)) == (255, 204, 204)
+        # the body
+        assert image.getpixel((620, 1000)) == (255, 255, 255)
+        # between the logo and the address block, 35mm from the top
+        assert image.getpixel((300, 207)) == expected_colour_above_address
+
+
+def test_png_with_no_print_areas_in_red_rotates_the_red_with_the_page(client, mocker):
+    # an A4 portrait page, rotated 90 degrees clockwise
+    mocker.patch("app.precompiled.pngs_from_pdf", return_value=[_white_png((1754, 1240))])
+
+    png = _png_with_no_print_areas_in_red(BytesIO(landscape_rotated_page), is_first_page=False)
+
+    with Image.open(png) as image:
+        assert image.size == (1754, 1240)
+        # the page's 15mm left margin is along the top
+        assert image.getpixel((877, 20)) == (255, 204, 204)
+        assert image.getpixel((877, 120)) == (255, 255, 255)
+        # and its 5mm top margin down the right hand side
+        assert image.getpixel((1750, 620)) == (255, 204, 204)
+        assert image.getpixel((1700, 620)) == (255, 255, 255)
+
+
+def test_unmodified_page_pngs_rasterises_uncached_pages_together(client, mocker):
+    pngs = [BytesIO(f"page {page_number}".encode()) for page_number in range(1, 11)]
+    mock_pngs_from_pdf = mocker.patch("app.precompiled.pngs_from_pdf", return_value=pngs)
+    document = PdfDocument(multi_page_pdf)
+
+    assert _unmodified_page_pngs(document, [1, 2, 3]) == {1: pngs[0], 2: pngs[1], 3: pngs[2]}
+
+    mock_pngs_from_pdf.assert_called_once_with(multi_page_pdf)
+
+
+@pytest.mark.parametrize("image_count", [9, 11])
+def test_unmodified_page_pngs_errors_if_rasterising_doesnt_give_an_image_per_page(client, mocker, image_count):
+    mocker.patch("app.precompiled.pngs_from_pdf", return_value=[BytesIO(b"page")] * image_count)
+
+    with pytest.raises(InvalidRequest) as exc:
+        _unmodified_page_pngs(PdfDocument(multi_page_pdf), [1, 2, 3])
+
+    assert exc.value.message == f"Unable to rasterise the PDF: got {image_count} images for 10 pages"
+
+
+def test_unmodified_page_pngs_caches_pages_on_their_fingerprint(client, mocker):
+    mock_cache = mocker.patch.object(client.application, "cache")
+    document = PdfDocument(multi_page_pdf)
+
+    pngs = _unmodified_page_pngs(document, [1, 2])
+
+    assert mock_cache.call_args_list == [
+        call(document.page_fingerprint(0), folder="precompiled-pngs", extension="png"),
+        call(document.page_fingerprint(1), folder="precompiled-pngs", extension="png"),
+    ]
+    cached_png = mock_cache.return_value.return_value.return_value
+    assert pngs == {1: cached_png, 2: cached_png}
 
 
 def test_overlay_template_png_for_page_errors_if_not_a_pdf(client, auth_header):
@@ -401,6 +867,69 @@ def test_overlay_template_png_for_page_errors_if_multi_page_pdf(client, auth_hea
     assert resp.status_code == 400
 
 
+@pytest.mark.parametrize(
+    "params, expected_first_pages",
+    [
+        ({}, [True] + [False] * 9),
+        ({"is_an_attachment": "true"}, [False] * 10),
+    ],
+)
+def test_overlay_template_pngs_for_pages_returns_a_png_for_each_page(
+    client, auth_header, mocker, params, expected_first_pages
+):
+    mock_pngs = mocker.patch(
+        "app.precompiled._unmodified_page_pngs",
+        return_value={page_number: BytesIO(b"unmodified") for page_number in range(1, 11)},
+    )
+    mock_colour = mocker.patch(
+        "app.precompiled._colour_png_in_red",
+        side_effect=lambda png, page, is_first_page: BytesIO(f"page {page.page_number + 1}".encode()),
+    )
+
+    resp = client.post(
+        url_for("precompiled_blueprint.overlay_template_pngs_for_pages", **params),
+        data=multi_page_pdf,
+        headers=auth_header,
+    )
+
+    assert resp.status_code == 200
+    assert resp.mimetype == "application/zip"
+    with zipfile.ZipFile(BytesIO(resp.get_data())) as zip_file:
+        assert zip_file.namelist() == [f"{page_number}.png" for page_number in range(1, 11)]
+        assert [zip_file.read(f"{page_number}.png") for page_number in range(1, 11)] == [
+            f"page {page_number}".encode() for page_number in range(1, 11)
+        ]
+
+    assert mock_pngs.call_args.args[0].data == multi_page_pdf
+    assert list(mock_pngs.call_args.args[1]) == list(range(1, 11))
+    assert [call.args[2] for call in mock_colour.call_args_list] == expected_first_pages
+
+
+@pytest.mark.parametrize("data", [b"", not_pdf])
+def test_overlay_template_pngs_for_pages_errors_if_not_a_pdf(client, auth_header, data):
+    resp = client.post(
+        url_for("precompiled_blueprint.overlay_template_pngs_for_pages"),
+        data=data,
+        headers=auth_header,
+    )
+    assert resp.status_code == 400
+
+
+def test_overlay_template_pngs_for_pages_errors_if_too_many_pages(client, auth_header, mocker):
+    mocker.patch("app.precompiled.is_letter_too_long", return_value=True)
+    mock_pngs = mocker.patch("app.precompiled._unmodified_page_pngs")
+
+    resp = client.post(
+        url_for("precompiled_blueprint.overlay_template_pngs_for_pages"),
+        data=multi_page_pdf,
+        headers=auth_header,
+    )
+
+    assert resp.status_code == 400
+    assert resp.json["message"] == "Too many pages to overlay at once (10)"
+    mock_pngs.assert_not_called()
+
+
 def test_overlay_template_pdf_errors_if_no_content(client, auth_header):
     resp = client.post(url_for("precompiled_blueprint.overlay_template_pdf"), headers=auth_header)
     assert resp.status_code == 400
@@ -418,15 +947,57 @@ def test_overlay_template_pdf_errors_if_request_args_provided(client, auth_heade
 
 
 def test_overlay_template_pdf_colours_pages_in_red(client, auth_header, mocker):
-    mock_colour = mocker.patch("app.precompiled._colour_no_print_areas_of_page_in_red")
+    mock_colour = mocker.patch(
+        "app.precompiled._colour_no_print_areas_of_pdf_in_red", return_value=BytesIO(b"overlaid pdf")
+    )
     resp = client.post(
         url_for("precompiled_blueprint.overlay_template_pdf"),
         data=multi_page_pdf,
         headers=auth_header,
     )
     assert resp.status_code == 200
+    assert resp.get_data() == b"overlaid pdf"
+
+    assert mock_colour.call_args.args[0].read() == multi_page_pdf
+
+
+@pytest.mark.parametrize("pdf", [multi_page_pdf, no_resources_on_last_page, portrait_rotated_page])
+def test_colour_no_print_areas_of_pdf_in_red_looks_like_colouring_each_page(pdf):
+    reader = pypdf.PdfReader(BytesIO(pdf))
+    for page_number, page in enumerate(reader.pages):
+        page.merge_page(_red_overlay(is_first_page=page_number == 0))
+    expected = pymupdf.open(stream=bytesio_from_pdf(reader).read(), filetype="pdf")
+
+    overlaid = pymupdf.open(stream=_colour_no_print_areas_of_pdf_in_red(BytesIO(pdf)).read(), filetype="pdf")
+
+    assert overlaid.page_count == expected.page_count
+    for page, expected_page in zip(overlaid, expected, strict=True):
+        assert page.get_pixmap(dpi=50).samples == expected_page.get_pixmap(dpi=50).samples
 
-    assert mock_colour.call_args_list == [call(ANY, is_first_page=True)] + [call(ANY, is_first_page=False)] * 9
+
+def test_colour_no_print_areas_of_pdf_in_red_shares_overlays_between_pages():
+    overlaid = pymupdf.open(stream=_colour_no_print_areas_of_pdf_in_red(BytesIO(multi_page_pdf)).read())
+
+    forms = [page.get_xobjects() for page in overlaid]
+    first_page_overlays = {xref for xref, name, *_ in forms[0] if name == "NotifyRedOverlayFirstPage"}
+    overlays = {xref for page_forms in forms[1:] for xref, name, *_ in page_forms if name == "NotifyRedOverlay"}
+
+    assert len(first_page_overlays) == 1
+    assert len(overlays) == 1
+    assert all(any(name == "NotifyRedOverlay" for _, name, *_ in page_forms) for page_forms in forms[1:])
+
+
+def test_overlays_are_only_drawn_once(mocker):
+    _white_overlay.cache_clear()
+    _red_overlay.cache_clear()
+    mock_canvas = mocker.patch("app.canvas.NotifyCanvas", wraps=NotifyCanvas)
+
+    for _ in range(2):
+        _overlay_printable_areas_with_white(BytesIO(multi_page_pdf))
+        _colour_no_print_areas_of_pdf_in_red(BytesIO(multi_page_pdf))
+
+    # white and red, for first and other pages
+    assert mock_canvas.call_count == 4
 
 
 def test_precompiled_sanitise_pdf_without_notify_tag(client, auth_header):
@@ -451,6 +1022,64 @@ def test_precompiled_sanitise_pdf_without_notify_tag(client, auth_header):
     assert extract_address_block(pdf).normalised == ("Queen Elizabeth\nBuckingham Palace\nLondon\nSW1 1AA")
 
 
+def test_precompiled_sanitise_pdf_returns_the_raw_file_if_asked(client, auth_header, mocker):
+    mocker.patch(
+        "app.precompiled.sanitise_letter",
+        return_value=SanitiseResult(
+            message=None,
+            file=b"sanitised pdf",
+            page_count=1,
+            recipient_address="Queen Élisabeth\nBuckingham Palace\nLondon\nSW1 1AA",
+            invalid_pages=None,
+        ),
+    )
+
+    response = client.post(
+        url_for("precompiled_blueprint.sanitise_precompiled_letter", raw_file="true"),
+        data=blank_with_address,
+        headers=auth_header,
+    )
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/pdf"
+    assert response.get_data() == b"sanitised pdf"
+    assert json.loads(response.headers["X-Sanitise-Result"]) == {
+        "message": None,
+        "page_count": 1,
+        "recipient_address": "Queen Élisabeth\nBuckingham Palace\nLondon\nSW1 1AA",
+        "invalid_pages": None,
+    }
+
+
+def test_precompiled_sanitise_pdf_returns_json_if_raw_file_asked_for_but_invalid(client, auth_header, mocker):
+    mocker.patch(
+        "app.precompiled.sanitise_letter",
+        return_value=SanitiseResult(
+            message="letter-too-long",
+            file=None,
+            page_count=11,
+            recipient_address=None,
+            invalid_pages=None,
+        ),
+    )
+
+    response = client.post(
+        url_for("precompiled_blueprint.sanitise_precompiled_letter", raw_file="true"),
+        data=blank_with_address,
+        headers=auth_header,
+    )
+
+    assert response.status_code == 400
+    assert response.json == {
+        "message": "letter-too-long",
+        "file": None,
+        "page_count": 11,
+        "recipient_address": None,
+        "invalid_pages": None,
+    }
+    assert "X-Sanitise-Result" not in response.headers
+
+
 def test_precompiled_sanitise_pdf_for_an_attachment(client, auth_header, mocker):
     response = client.post(
         url_for("precompiled_blueprint.sanitise_precompiled_letter") + "?is_an_attachment=true",
@@ -558,7 +1187,7 @@ def test_precompiled_sanitise_pdf_with_colour_in_address_margin_ok_for_attachmen
     ),
 )
 def test_precompiled_sanitise_pdf_that_is_too_long_returns_400(client, auth_header, mocker, is_an_attachment):
-    mocker.patch("app.precompiled.pdf_page_count", return_value=11)
+    mocker.patch("app.precompiled.PdfDocument.page_count", new_callable=PropertyMock, return_value=11)
     mocker.patch("app.precompiled.is_letter_too_long", return_value=True)
     response = client.post(
         url_for("precompiled_blueprint.sanitise_precompiled_letter") + is_an_attachment,
@@ -841,7 +1470,7 @@ def test_redact_address_block_preserves_addresses_elsewhere_on_page():
     )
     assert extract_address_block(new_pdf).raw_address == ""
 
-    doc = pymupdf.open("pdf", new_pdf)
+    doc = pymupdf.open("pdf", new_pdf.data)
     new_page_text = doc[0].get_text()
     assert address.raw_address in new_page_text
 
@@ -858,13 +1487,51 @@ def test_redact_precompiled_letter_address_block_only_touches_first_page():
     )
     assert extract_address_block(new_pdf).raw_address == ""
 
-    doc = pymupdf.open("pdf", new_pdf)
+    doc = pymupdf.open("pdf", new_pdf.data)
     new_second_page_text = doc[1].get_text()
 
     assert len(doc) == 2
     assert new_second_page_text == second_page_text
 
 
+def test_sanitise_letter_rejects_invalid_address_without_rasterising(client, mocker):
+    mock_rasterise = mocker.patch("app.precompiled._rasterise_pages_to_check_boundaries")
+    mock_convert_pdf_to_cmyk = mocker.patch("app.precompiled.convert_pdf_to_cmyk")
+    packet = io.BytesIO()
+    cv = canvas.Canvas(packet, pagesize=A4)
+    cv.drawString(200, 400, "A letter with no address")
+    cv.save()
+
+    result = sanitise_letter(
+        packet.getvalue(), allow_international_letters=False, filename="file", is_an_attachment=False
+    )
+
+    assert (result.message, result.invalid_pages) == ("address-is-empty", [1])
+    mock_rasterise.assert_not_called()
+    mock_convert_pdf_to_cmyk.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "pdf, letter_too_long, expected_message, expected_invalid_pages",
+    [
+        (multi_page_pdf, True, "letter-too-long", None),
+        (a3_size, False, "letter-not-a4-portrait-oriented", [1]),
+        (example_dwp_pdf, False, "content-outside-printable-area", [1]),
+        (notify_tags_on_page_2_and_4, False, "notify-tag-found-in-content", [2, 4]),
+    ],
+    ids=["letter_too_long", "a3_size", "example_dwp_pdf", "notify_tags_on_page_2_and_4"],
+)
+def test_sanitise_letter_checks_take_precedence_over_address(
+    client, mocker, pdf, letter_too_long, expected_message, expected_invalid_pages
+):
+    mocker.patch("app.precompiled.is_letter_too_long", return_value=letter_too_long)
+    mocker.patch("app.precompiled.extract_address_block", return_value=PrecompiledPostalAddress(""))
+
+    result = sanitise_letter(pdf, allow_international_letters=False, filename="file", is_an_attachment=False)
+
+    assert (result.message, result.invalid_pages) == (expected_message, expected_invalid_pages)
+
+
 def test_sanitise_file_contents_on_pdf_with_no_resources_on_one_of_the_pages_content_outside_bounds(
     client, auth_header
 ):
@@ -890,6 +1557,50 @@ def test_sanitise_file_contents_on_pdf_with_no_resources_on_one_of_the_pages_con
     }
 
 
+@pytest.mark.parametrize(
+    "colour_spaces, unembedded_fonts, expected_cmyk_calls, expected_embed_calls",
+    [
+        (set(), set(), 1, 0),
+        ({"Gray"}, set(), 1, 0),
+        ({"CMYK", "RGB"}, set(), 1, 0),
+        (set(), {"/Helvetica"}, 1, 0),
+        ({"CMYK"}, {"/Helvetica"}, 0, 1),
+        ({"CMYK", "Gray"}, set(), 0, 0),
+    ],
+)
+def test_normalise_fonts_and_colours_runs_ghostscript_at_most_once(
+    client,
+    mocker,
+    colour_spaces,
+    unembedded_fonts,
+    expected_cmyk_calls,
+    expected_embed_calls,
+):
+    mock_get_document_colour_spaces = mocker.patch(
+        "app.precompiled.get_document_colour_spaces", return_value=colour_spaces
+    )
+    mocker.patch("app.precompiled.get_unembedded_fonts", return_value=unembedded_fonts)
+    mock_convert_pdf_to_cmyk = mocker.patch("app.precompiled.convert_pdf_to_cmyk", return_value=BytesIO(b"cmyk"))
+    mock_embed_fonts = mocker.patch("app.precompiled.embed_fonts", return_value=BytesIO(b"embedded"))
+    document = PdfDocument(blank_page)
+
+    normalised = normalise_fonts_and_colours(document, "foo.pdf")
+
+    assert mock_convert_pdf_to_cmyk.call_args_list == [call(ANY, embed_all_fonts=True)] * expected_cmyk_calls
+    assert mock_embed_fonts.call_count == expected_embed_calls
+    for mock_ghostscript in (mock_convert_pdf_to_cmyk, mock_embed_fonts):
+        for ghostscript_call in mock_ghostscript.call_args_list:
+            assert ghostscript_call.args[0].read() == blank_page
+    mock_get_document_colour_spaces.assert_called_once_with(document.pymupdf_document)
+
+    if expected_cmyk_calls:
+        assert normalised.data == b"cmyk"
+    elif expected_embed_calls:
+        assert normalised.data == b"embedded"
+    else:
+        assert normalised is document
+
+
 @pytest.mark.parametrize(
     "orig_filesize, new_filesize, expected_lvl, expected_msg",
     [
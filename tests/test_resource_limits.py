@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+from app.resource_limits import free_subprocess_slots, process_slot, subprocess_slot
+from container_limits import subprocess_concurrency
+
+
+@pytest.fixture(autouse=True)
+def no_cached_subprocess_concurrency():
+    # tests set MAX_SUBPROCESSES for themselves
+    subprocess_concurrency.cache_clear()
+    yield
+    subprocess_concurrency.cache_clear()
+
+
+def test_subprocess_slot_blocks_once_all_slots_are_taken(tmp_path, mocker, monkeypatch):
+    mocker.patch("app.resource_limits.SUBPROCESS_SLOTS_DIR", str(tmp_path))
+    monkeypatch.setenv("MAX_SUBPROCESSES", "2")
+    mock_sleep = mocker.patch("app.resource_limits.time.sleep", side_effect=RuntimeError("would block"))
+
+    with subprocess_slot(), subprocess_slot():
+        assert sorted(os.listdir(tmp_path)) == ["0.lock", "1.lock"]
+
+        with pytest.raises(RuntimeError), subprocess_slot():
+            pass
+
+    assert mock_sleep.call_count == 1
+
+    # both slots are free again
+    with subprocess_slot(), subprocess_slot():
+        pass
+
+
+def test_subprocess_slot_is_released_if_the_block_raises(tmp_path, mocker, monkeypatch):
+    mocker.patch("app.resource_limits.SUBPROCESS_SLOTS_DIR", str(tmp_path))
+    monkeypatch.setenv("MAX_SUBPROCESSES", "1")
+    mocker.patch("app.resource_limits.time.sleep", side_effect=RuntimeError("would block"))
+
+    with pytest.raises(ValueError), subprocess_slot():
+        raise ValueError
+
+    with subprocess_slot():
+        pass
+
+
+def test_free_subprocess_slots(tmp_path, mocker, monkeypatch):
+    mocker.patch("app.resource_limits.SUBPROCESS_SLOTS_DIR", str(tmp_path))
+    monkeypatch.setenv("MAX_SUBPROCESSES", "3")
+
+    assert free_subprocess_slots() == 3
+
+    with subprocess_slot():
+        assert free_subprocess_slots() == 2
+
+        with subprocess_slot():
+            assert free_subprocess_slots() == 1
+
+    assert free_subprocess_slots() == 3
+
+
+def test_subprocesses_started_while_holding_a_process_slot_run_in_it(tmp_path, mocker, monkeypatch):
+    mocker.patch("app.resource_limits.SUBPROCESS_SLOTS_DIR", str(tmp_path))
+    monkeypatch.setenv("MAX_SUBPROCESSES", "1")
+    mocker.patch("app.resource_limits.time.sleep", side_effect=RuntimeError("would block"))
+
+    with process_slot():
+        assert free_subprocess_slots() == 0
+
+        with subprocess_slot():
+            pass
+
+    # the slot is free again, and subprocesses wait for it as usual
+    with subprocess_slot(), pytest.raises(RuntimeError), subprocess_slot():
+        pass
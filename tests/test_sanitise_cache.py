@@ -0,0 +1,176 @@
+from io import BytesIO
+from unittest.mock import Mock
+
+import pytest
+
+from app.precompiled import sanitise_letter
+from app.sanitise_cache import SanitiseResult, _serialise, cached_sanitise_result, letter_cache
+from tests.conftest import set_config
+from tests.pdf_consts import multi_page_pdf
+
+PASSED = SanitiseResult(
+    recipient_address="Queen Elizabeth\nBuckingham Palace\nLondon\nSW1 1AA",
+    page_count=1,
+    message=None,
+    invalid_pages=None,
+    file=b"%PDF sanitised\n",
+)
+
+FAILED = SanitiseResult(
+    recipient_address=None,
+    page_count=2,
+    message="content-outside-printable-area",
+    invalid_pages=[1, 2],
+    file=None,
+)
+
+
+@pytest.fixture(autouse=True)
+def sanitise_cache(client, mocker):
+    mocker.patch("app.sanitise_cache._app_version", return_value="abc123")
+    mocker.patch("app.sanitise_cache.ghostscript_version", return_value="10.02.1")
+    letter_cache.local_tier.clear()
+    with set_config(client.application, "SANITISE_CACHE", True):
+        yield
+    letter_cache.local_tier.clear()
+
+
+def _cached_sanitise_result(pdf_data, sanitise, allow_international_letters=False, is_an_attachment=False):
+    return cached_sanitise_result(
+        pdf_data,
+        allow_international_letters=allow_international_letters,
+        is_an_attachment=is_an_attachment,
+        filename="file.pdf",
+        sanitise=sanitise,
+    )
+
+
+@pytest.mark.parametrize("result", [PASSED, FAILED])
+def test_cached_sanitise_result_only_sanitises_once(mocked_letter_cache_get, mocked_letter_cache_set, result):
+    sanitise = Mock(return_value=result)
+
+    for _ in range(3):
+        assert _cached_sanitise_result(b"pdf", sanitise) == result
+
+    assert sanitise.call_count == 1
+    # after the first letter, results come from memory
+    cache_key = mocked_letter_cache_get.call_args.args[1]
+    mocked_letter_cache_get.assert_called_once_with("test-template-preview-cache", cache_key)
+    mocked_letter_cache_set.assert_called_once_with(
+        filedata=_serialise(result),
+        region="eu-west-1",
+        bucket_name="test-template-preview-cache",
+        file_location=cache_key,
+    )
+    assert cache_key.startswith("sanitise/")
+
+
+def test_cached_sanitise_result_uses_result_from_letter_cache(mocked_letter_cache_get, mocked_letter_cache_set):
+    mocked_letter_cache_get.side_effect = None
+    mocked_letter_cache_get.return_value = BytesIO(_serialise(PASSED))
+    sanitise = Mock()
+
+    assert _cached_sanitise_result(b"pdf", sanitise) == PASSED
+
+    sanitise.assert_not_called()
+    mocked_letter_cache_set.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "pdf_data, allow_international_letters, is_an_attachment, app_version",
+    [
+        (b"other pdf", False, False, "abc123"),
+        (b"pdf", True, False, "abc123"),
+        (b"pdf", False, True, "abc123"),
+        (b"pdf", False, False, "def456"),
+    ],
+)
+def test_cached_sanitise_result_is_keyed_on_input_flags_and_version(
+    mocker,
+    mocked_letter_cache_get,
+    mocked_letter_cache_set,
+    pdf_data,
+    allow_international_letters,
+    is_an_attachment,
+    app_version,
+):
+    _cached_sanitise_result(b"pdf", Mock(return_value=PASSED))
+
+    mocker.patch("app.sanitise_cache._app_version", return_value=app_version)
+    sanitise = Mock(return_value=FAILED)
+
+    assert _cached_sanitise_result(pdf_data, sanitise, allow_international_letters, is_an_attachment) == FAILED
+    assert sanitise.call_count == 1
+    assert (
+        mocked_letter_cache_set.call_args_list[0].kwargs["file_location"]
+        != mocked_letter_cache_set.call_args_list[1].kwargs["file_location"]
+    )
+
+
+@pytest.mark.parametrize(
+    "setting, value",
+    [
+        ("VECTOR_BOUNDS_CHECK", False),
+        ("MARGIN_RASTER_BOUNDS_CHECK", False),
+        ("MARGIN_RASTER_DPI", 200),
+    ],
+)
+def test_cached_sanitise_result_is_keyed_on_validation_settings(
+    client, mocked_letter_cache_get, mocked_letter_cache_set, setting, value
+):
+    _cached_sanitise_result(b"pdf", Mock(return_value=PASSED))
+    sanitise = Mock(return_value=FAILED)
+
+    with set_config(client.application, setting, value):
+        assert _cached_sanitise_result(b"pdf", sanitise) == FAILED
+
+    assert sanitise.call_count == 1
+    assert (
+        mocked_letter_cache_set.call_args_list[0].kwargs["file_location"]
+        != mocked_letter_cache_set.call_args_list[1].kwargs["file_location"]
+    )
+
+
+def test_cached_sanitise_result_sanitises_every_time_without_app_version(
+    mocker, mocked_letter_cache_get, mocked_letter_cache_set
+):
+    mocker.patch("app.sanitise_cache._app_version", return_value=None)
+    sanitise = Mock(return_value=PASSED)
+
+    for _ in range(2):
+        assert _cached_sanitise_result(b"pdf", sanitise) == PASSED
+
+    assert sanitise.call_count == 2
+    mocked_letter_cache_get.assert_not_called()
+    mocked_letter_cache_set.assert_not_called()
+
+
+def test_sanitise_letter_uses_cached_result(mocker, mocked_letter_cache_get):
+    mocked_letter_cache_get.side_effect = None
+    mocked_letter_cache_get.return_value = BytesIO(_serialise(FAILED))
+    mock_get_invalid_pages = mocker.patch("app.precompiled.get_invalid_pages_with_message")
+
+    assert sanitise_letter(multi_page_pdf, allow_international_letters=False, filename="file.pdf") == FAILED
+
+    mock_get_invalid_pages.assert_not_called()
+
+
+def test_sanitise_letter_returns_cached_file(mocked_letter_cache_get):
+    mocked_letter_cache_get.side_effect = None
+    mocked_letter_cache_get.return_value = BytesIO(_serialise(PASSED))
+
+    assert sanitise_letter(multi_page_pdf, allow_international_letters=False, filename="file.pdf") == PASSED
+
+
+def test_sanitise_letter_does_not_cache_unexpected_errors(mocker, mocked_letter_cache_get, mocked_letter_cache_set):
+    mocker.patch("app.precompiled.get_invalid_pages_with_message", side_effect=Exception("something went wrong"))
+
+    assert sanitise_letter(multi_page_pdf, allow_international_letters=False, filename="file.pdf") == SanitiseResult(
+        page_count=None,
+        recipient_address=None,
+        message="unable-to-read-the-file",
+        invalid_pages=None,
+        file=None,
+    )
+
+    mocked_letter_cache_set.assert_not_called()
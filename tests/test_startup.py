@@ -0,0 +1,40 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+
+def _modules_imported_by(entry_point):
+    # Run in a fresh interpreter, as the test session has already imported everything
+    result = subprocess.run(
+        [sys.executable, "-c", f"import json, sys, {entry_point}; print(json.dumps(sorted(sys.modules)))"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return set(json.loads(result.stdout.strip().splitlines()[-1]))
+
+
+@pytest.fixture(scope="module")
+def web_modules():
+    return _modules_imported_by("wsgi")
+
+
+@pytest.fixture(scope="module")
+def worker_modules():
+    return _modules_imported_by("run_celery")
+
+
+@pytest.mark.parametrize("module", ["pdf2image", "pymupdf", "reportlab", "wand", "weasyprint"])
+def test_web_app_imports_pdf_libraries_lazily(web_modules, module):
+    assert module not in web_modules
+
+
+@pytest.mark.parametrize("module", ["pdf2image", "pymupdf", "reportlab.pdfgen", "weasyprint"])
+def test_worker_imports_task_dependencies_before_forking(worker_modules, module):
+    assert module in worker_modules
+
+
+def test_worker_does_not_import_preview_only_libraries(worker_modules):
+    assert "wand" not in worker_modules
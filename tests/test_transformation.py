@@ -4,17 +4,23 @@ from io import BytesIO
 import pymupdf
 import pytest
 from PIL import Image, ImageChops
-from pypdf import PdfReader
+from pypdf import PdfReader, PdfWriter
 from reportlab.lib.units import mm
 from weasyprint import HTML
 
+from app.embedded_fonts import contains_unembedded_fonts
 from app.precompiled import _is_page_A4_portrait
 from app.transformation import (
+    _get_page_ranges_for_parallel_conversion,
+    _run_cmyk_ghostscript,
     convert_pdf_to_cmyk,
     does_pdf_contain_cmyk,
     does_pdf_contain_rgb,
+    get_pdf_colour_spaces,
 )
+from tests.conftest import set_config
 from tests.pdf_consts import (
+    blank_with_address,
     cmyk_and_rgb_images_in_one_pdf,
     cmyk_image_pdf,
     file,
@@ -31,11 +37,69 @@ from tests.pdf_consts import (
     [HTML(string="<html></html>").write_pdf(), multi_page_pdf],
     ids=["templated", "precompiled"],
 )
-def test_convert_pdf_to_cmyk_outputs_valid_pdf(pdf):
+def test_convert_pdf_to_cmyk_outputs_valid_pdf(client, pdf):
     data = convert_pdf_to_cmyk(BytesIO(pdf))
     assert data.read(9) == b"%PDF-1.7\n"
 
 
+def test_convert_pdf_to_cmyk_can_embed_fonts_in_the_same_pass(client):
+    assert contains_unembedded_fonts(BytesIO(multi_page_pdf))
+
+    data = convert_pdf_to_cmyk(BytesIO(multi_page_pdf), embed_all_fonts=True)
+
+    assert not contains_unembedded_fonts(data)
+    assert not does_pdf_contain_rgb(data)
+
+
+@pytest.mark.parametrize(
+    "min_pages, concurrency, page_count, expected_page_ranges",
+    [
+        (0, 4, 40, None),
+        (10, 1, 40, None),
+        (10, 4, 9, None),
+        (10, 4, 10, [(1, 5), (6, 10)]),
+        (10, 4, 11, [(1, 6), (7, 11)]),
+        (10, 4, 40, [(1, 10), (11, 20), (21, 30), (31, 40)]),
+        (10, 3, 10, [(1, 5), (6, 10)]),
+        (2, 4, 9, None),
+    ],
+)
+def test_get_page_ranges_for_parallel_conversion(
+    client, mocker, min_pages, concurrency, page_count, expected_page_ranges
+):
+    mocker.patch("app.transformation.subprocess_concurrency", return_value=concurrency)
+    writer = PdfWriter()
+    for _ in range(page_count):
+        writer.add_blank_page(width=595, height=842)
+    pdf = BytesIO()
+    writer.write(pdf)
+    pdf.seek(0)
+
+    with set_config(client.application, "CMYK_PARALLEL_MIN_PAGES", min_pages):
+        assert _get_page_ranges_for_parallel_conversion(pdf) == expected_page_ranges
+
+    assert pdf.tell() == 0
+
+
+def test_parallel_convert_pdf_to_cmyk_matches_serial_conversion_page_by_page(client, mocker):
+    serial = pymupdf.open(stream=convert_pdf_to_cmyk(BytesIO(multi_page_pdf)), filetype="pdf")
+
+    mocker.patch("app.transformation.subprocess_concurrency", return_value=2)
+    mock_run = mocker.patch("app.transformation._run_cmyk_ghostscript", wraps=_run_cmyk_ghostscript)
+    with set_config(client.application, "CMYK_PARALLEL_MIN_PAGES", 10):
+        data = convert_pdf_to_cmyk(BytesIO(multi_page_pdf))
+
+    assert sorted(call.args[3] for call in mock_run.call_args_list) == [(1, 5), (6, 10)]
+    assert data.read(9) == b"%PDF-1.7\n"
+    parallel = pymupdf.open(stream=data, filetype="pdf")
+    assert len(parallel) == len(serial) == 10
+    for serial_page, parallel_page in zip(serial, parallel, strict=True):
+        assert parallel_page.rect == serial_page.rect
+        assert parallel_page.rotation == serial_page.rotation
+        assert parallel_page.get_text() == serial_page.get_text()
+        assert parallel_page.get_pixmap().samples == serial_page.get_pixmap().samples
+
+
 def test_subprocess_fails(client, mocker):
     mock_popen = mocker.patch("subprocess.Popen")
     mock_popen.return_value.returncode = 1
@@ -66,7 +130,7 @@ def test_subprocess_includes_output_error(client, mocker):
         assert "ghostscript cmyk transformation failed to read all content streams" in str(excinfo.value)
 
 
-def test_convert_pdf_to_cmyk_does_not_rotate_pages():
+def test_convert_pdf_to_cmyk_does_not_rotate_pages(client):
     file_with_rotated_text = BytesIO(portrait_rotated_page)
 
     transformed_pdf = PdfReader(convert_pdf_to_cmyk(file_with_rotated_text))
@@ -117,7 +181,7 @@ def test_convert_pdf_to_cmyk_preserves_black(client):
 # so that's what we look for here - it's unclear if it's actually the
 # cause of the fault. At the very least, a failure of this test should
 # prompt you to go and manually check the output still looks OK.
-def test_convert_pdf_to_cmyk_does_not_strip_images():
+def test_convert_pdf_to_cmyk_does_not_strip_images(client):
     result = convert_pdf_to_cmyk(BytesIO(public_guardian_sample))
     first_page = PdfReader(result).pages[0]
 
@@ -151,6 +215,79 @@ def test_does_pdf_contain_rgb(client, data, result):
     assert does_pdf_contain_rgb(BytesIO(data)) == result
 
 
+def _pdf_with_image(content, *, image_colour_space=None, resource_colour_spaces=None):
+    doc = pymupdf.open()
+    page = doc.new_page()
+    resources_xref = int(doc.xref_get_key(page.xref, "Resources")[1].split()[0])
+
+    contents_xref = doc.get_new_xref()
+    doc.update_object(contents_xref, "<<>>")
+    doc.update_stream(contents_xref, content)
+    doc.xref_set_key(page.xref, "Contents", f"{contents_xref} 0 R")
+
+    if image_colour_space:
+        image_xref = doc.get_new_xref()
+        doc.update_object(
+            image_xref,
+            "<< /Type /XObject /Subtype /Image /Width 1 /Height 1 /BitsPerComponent 8 "
+            f"/ColorSpace {image_colour_space} >>",
+        )
+        doc.update_stream(image_xref, b"\x00\x00\x00\x00")
+        doc.xref_set_key(resources_xref, "XObject", f"<< /Im0 {image_xref} 0 R >>")
+
+    if resource_colour_spaces:
+        doc.xref_set_key(resources_xref, "ColorSpace", resource_colour_spaces)
+
+    return doc.tobytes()
+
+
+SEPARATION = "[/Separation /Spot /DeviceCMYK << /FunctionType 2 /Domain [0 1] /N 1 >>]"
+
+
+@pytest.mark.parametrize(
+    "data, expected_colour_spaces",
+    [
+        (blank_with_address, set()),
+        (rgb_image_pdf, {"RGB"}),
+        (cmyk_image_pdf, {"CMYK"}),
+        (cmyk_and_rgb_images_in_one_pdf, {"CMYK", "RGB"}),
+        (_pdf_with_image(b"q /Im0 Do Q", image_colour_space="/DeviceGray"), {"Gray"}),
+        (_pdf_with_image(b"q /Im0 Do Q", image_colour_space="[/Indexed /DeviceRGB 0 <000000>]"), {"RGB"}),
+        (_pdf_with_image(b"q /Im0 Do Q", image_colour_space=SEPARATION), {"CMYK"}),
+        (_pdf_with_image(b"q /Im0 Do Q", image_colour_space="[/Lab << /WhitePoint [0.95 1 1.09] >>]"), {"RGB"}),
+        (_pdf_with_image(b"q BI /W 1 /H 1 /BPC 8 /CS /RGB ID \xff\x00\x00 EI Q"), {"RGB"}),
+        (_pdf_with_image(b"q BI /W 1 /H 1 /BPC 8 /ColorSpace /DeviceCMYK ID \x00\x00\x00\xff EI Q"), {"CMYK"}),
+        (
+            _pdf_with_image(
+                b"q BI /W 1 /H 1 /BPC 8 /CS /Cs1 ID \xff EI Q", resource_colour_spaces=f"<< /Cs1 {SEPARATION} >>"
+            ),
+            {"CMYK"},
+        ),
+    ],
+    ids=[
+        "no images",
+        "ICC RGB image",
+        "ICC CMYK image",
+        "ICC CMYK and RGB images",
+        "gray image",
+        "indexed RGB image",
+        "separation image",
+        "lab image",
+        "inline RGB image",
+        "inline CMYK image",
+        "inline image with colour space from resources",
+    ],
+)
+def test_get_pdf_colour_spaces(client, mocker, data, expected_colour_spaces):
+    mock_pixmap = mocker.patch("pymupdf.Pixmap")
+    pdf = BytesIO(data)
+
+    assert get_pdf_colour_spaces(pdf) == expected_colour_spaces
+
+    assert pdf.tell() == 0
+    mock_pixmap.assert_not_called()
+
+
 def detect_color_space(page):
     if does_pdf_contain_cmyk(page):  # CMYK images have 4 color channels
         return "CMYK"
@@ -169,7 +306,7 @@ def are_images_different(page1, page2):
 
 
 @pytest.mark.skipif(os.environ.get("SKIP_TEST_CMYK_PDF", True), reason="CMYK PDF test is not enabled.")
-def test_cmyk_pdf_transformation():
+def test_cmyk_pdf_transformation(client):
     input_files = "tests/test_pdfs/input_pdfs/"
     expected_files = "tests/test_pdfs/expected_pdfs/"
     test_output_files = "tests/test_pdfs/test_output_pdfs/"
@@ -0,0 +1,136 @@
+import io
+
+import pymupdf
+import pytest
+from reportlab.lib.colors import black, white
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from app.vector_bounds import content_outside_areas, uses_transparency
+
+# A box in the middle of the page, in pymupdf coordinates (from the top left)
+AREAS = [(100, 100, 500, 700)]
+
+
+def _page(draw, pagesize=A4):
+    packet = io.BytesIO()
+    cv = canvas.Canvas(packet, pagesize=pagesize)
+    draw(cv)
+    cv.showPage()
+    cv.save()
+    return pymupdf.open(stream=packet.getvalue(), filetype="pdf")
+
+
+def _content_outside_areas(draw, **kwargs):
+    doc = _page(draw, **kwargs)
+    return content_outside_areas(doc[0], AREAS, transparency=uses_transparency(doc))
+
+
+def test_content_outside_areas_blank_page():
+    assert _content_outside_areas(lambda cv: None) is False
+
+
+@pytest.mark.parametrize("colour", [black, white])
+def test_content_outside_areas_text_inside(colour):
+    def draw(cv):
+        cv.setFillColor(colour)
+        cv.drawString(150, 400, "This is inside the printable area")
+
+    assert _content_outside_areas(draw) is False
+
+
+def test_content_outside_areas_black_rectangle_outside():
+    def draw(cv):
+        cv.setFillColor(black)
+        cv.rect(0, 0, 20, 20, stroke=0, fill=1)
+
+    assert _content_outside_areas(draw) is True
+
+
+def test_content_outside_areas_black_text_outside():
+    def draw(cv):
+        cv.setFillColor(black)
+        cv.drawString(10, 400, "x")
+
+    assert _content_outside_areas(draw) is True
+
+
+def test_content_outside_areas_ignores_white_outside():
+    def draw(cv):
+        cv.setFillColor(white)
+        cv.setStrokeColor(white)
+        cv.rect(0, 0, 1000, 1000, stroke=1, fill=1)
+        cv.drawString(10, 400, "white text")
+
+    assert _content_outside_areas(draw) is False
+
+
+def test_content_outside_areas_black_painted_over_in_white_needs_rasterising():
+    def draw(cv):
+        cv.setFillColor(black)
+        cv.rect(0, 0, 20, 20, stroke=0, fill=1)
+        cv.setFillColor(white)
+        cv.rect(0, 0, 20, 20, stroke=0, fill=1)
+
+    assert _content_outside_areas(draw) is None
+
+
+def test_content_outside_areas_content_at_edge_of_area_needs_rasterising():
+    def draw(cv):
+        cv.setFillColor(black)
+        # ends half a point below the area, which could leave a grey line when rasterised
+        cv.rect(200, A4[1] - 700.5, 100, 100, stroke=0, fill=1)
+
+    assert _content_outside_areas(draw) is None
+
+
+def test_content_outside_areas_clipped_content_needs_rasterising():
+    def draw(cv):
+        path = cv.beginPath()
+        path.circle(300, 400, 50)
+        cv.clipPath(path, stroke=0, fill=0)
+        cv.setFillColor(black)
+        cv.rect(0, 0, 1000, 1000, stroke=0, fill=1)
+
+    assert _content_outside_areas(draw) is None
+
+
+def test_content_outside_areas_image_outside_needs_rasterising():
+    doc = pymupdf.open()
+    page = doc.new_page(width=A4[0], height=A4[1])
+    pixmap = pymupdf.Pixmap(pymupdf.csRGB, pymupdf.IRect(0, 0, 2, 2), False)
+    pixmap.clear_with(255)
+    page.insert_image((0, 0, 20, 20), pixmap=pixmap)
+
+    assert content_outside_areas(page, AREAS, transparency=False) is None
+
+
+def test_content_outside_areas_rotated_page_needs_rasterising():
+    doc = _page(lambda cv: cv.drawString(150, 400, "inside"))
+    doc[0].set_rotation(90)
+
+    assert content_outside_areas(doc[0], AREAS, transparency=False) is None
+
+
+def test_content_outside_areas_white_content_with_transparency_needs_rasterising():
+    def draw(cv):
+        cv.setFillColor(white)
+        cv.rect(0, 0, 20, 20, stroke=0, fill=1)
+
+    doc = _page(draw)
+
+    assert content_outside_areas(doc[0], AREAS, transparency=True) is None
+
+
+def test_uses_transparency():
+    def draw(cv):
+        cv.setFillColor(black)
+        cv.drawString(150, 400, "inside")
+
+    assert uses_transparency(_page(draw)) is False
+
+    def draw_with_blend_mode(cv):
+        cv.setBlendMode("Multiply")
+        cv.drawString(150, 400, "inside")
+
+    assert uses_transparency(_page(draw_with_blend_mode)) is True
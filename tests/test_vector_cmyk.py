@@ -0,0 +1,126 @@
+from io import BytesIO
+
+import pymupdf
+import pytest
+from pypdf import PdfReader
+from reportlab.pdfgen import canvas
+
+from app.transformation import convert_pdf_to_cmyk
+from app.vector_cmyk import convert_vector_pdf_to_cmyk, gray_to_cmyk, is_pdf_device_cmyk, rgb_to_cmyk
+from tests.conftest import set_config
+from tests.pdf_consts import hackney_sample, landscape_rotated_page, rgb_image_pdf
+
+
+def _vector_pdf():
+    pdf = BytesIO()
+    can = canvas.Canvas(pdf)
+    can.setFillColorRGB(0.114, 0.439, 0.722)
+    can.rect(10, 10, 100, 100, fill=1)
+    can.setFillGray(0.3)
+    can.drawString(100, 700, "Hello")
+    can.setStrokeColorRGB(1, 0, 0)
+    can.line(0, 0, 200, 200)
+
+    can.beginForm("logo")
+    can.setFillColorRGB(0, 0, 0)
+    can.circle(50, 50, 20, fill=1)
+    can.endForm()
+    can.doForm("logo")
+
+    can.save()
+    pdf.seek(0)
+    return pdf
+
+
+@pytest.mark.parametrize(
+    "rgb, expected_cmyk",
+    [
+        ((0, 0, 0), (0, 0, 0, 1)),
+        ((1, 1, 1), (0, 0, 0, 0)),
+        ((0.5, 0.5, 0.5), (0, 0, 0, 0.6343)),
+        ((1, 0, 0), (0, 0.9665, 0.9227, 0)),
+    ],
+)
+def test_rgb_to_cmyk_uses_ghostscript_device_link(rgb, expected_cmyk):
+    assert rgb_to_cmyk(*rgb) == expected_cmyk
+
+
+def test_gray_to_cmyk_maps_to_black_only():
+    assert gray_to_cmyk(0) == (0, 0, 0, 1)
+    assert gray_to_cmyk(0.3) == (0, 0, 0, 0.7)
+    assert gray_to_cmyk(1) == (0, 0, 0, 0)
+
+
+def test_convert_vector_pdf_to_cmyk(client):
+    pdf = _vector_pdf()
+
+    output = convert_vector_pdf_to_cmyk(pdf)
+
+    assert pdf.tell() == 0
+    assert output.read(9) == b"%PDF-1.7\n"
+    page = PdfReader(output).pages[0]
+    content = page.get_contents().get_data()
+    assert b"0.7294 0.3438 0.0 0.2634 k" in content
+    assert b"0.0 0.0 0.0 0.7 k" in content
+    assert b"0.0 0.9665 0.9227 0.0 K" in content
+    assert b" rg" not in content and b" g\n" not in content and b" RG" not in content
+
+    [form] = page["/Resources"]["/XObject"].values()
+    assert b"0.0 0.0 0.0 1 k" in form.get_object().get_data()
+
+    output.seek(0)
+    doc = pymupdf.open(stream=output.read(), filetype="pdf")
+    assert doc[0].get_text().strip() == "Hello"
+
+
+@pytest.mark.parametrize(
+    "pdf",
+    [rgb_image_pdf, hackney_sample, landscape_rotated_page],
+    ids=["image", "named colour space", "pattern"],
+)
+def test_convert_vector_pdf_to_cmyk_leaves_complex_pdfs_to_ghostscript(client, pdf):
+    pdf_data = BytesIO(pdf)
+
+    assert convert_vector_pdf_to_cmyk(pdf_data) is None
+    assert pdf_data.tell() == 0
+
+
+def test_is_pdf_device_cmyk(client):
+    pdf = _vector_pdf()
+    assert not is_pdf_device_cmyk(pdf)
+    assert pdf.tell() == 0
+
+    assert is_pdf_device_cmyk(convert_vector_pdf_to_cmyk(pdf))
+
+
+@pytest.mark.parametrize("pdf", [rgb_image_pdf, hackney_sample, landscape_rotated_page])
+def test_is_pdf_device_cmyk_is_false_for_complex_pdfs(client, pdf):
+    assert not is_pdf_device_cmyk(BytesIO(pdf))
+
+
+def test_convert_pdf_to_cmyk_skips_ghostscript_for_vector_pdf(client, mocker):
+    mock_popen = mocker.patch("subprocess.Popen")
+
+    output = convert_pdf_to_cmyk(_vector_pdf(), try_vector_conversion=True)
+
+    assert output.read(9) == b"%PDF-1.7\n"
+    mock_popen.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "enabled, kwargs",
+    [
+        (False, {"try_vector_conversion": True}),
+        (True, {}),
+        (True, {"try_vector_conversion": True, "embed_all_fonts": True}),
+    ],
+)
+def test_convert_pdf_to_cmyk_uses_ghostscript_unless_vector_conversion_allowed(client, mocker, enabled, kwargs):
+    mock_convert_vector_pdf_to_cmyk = mocker.patch("app.transformation.convert_vector_pdf_to_cmyk")
+    mock_popen = mocker.patch("subprocess.Popen")
+    mock_popen.return_value.communicate.side_effect = RuntimeError("ghostscript called")
+
+    with set_config(client.application, "CMYK_VECTOR_CONVERSION", enabled), pytest.raises(RuntimeError):
+        convert_pdf_to_cmyk(_vector_pdf(), **kwargs)
+
+    mock_convert_vector_pdf_to_cmyk.assert_not_called()